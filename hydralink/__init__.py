@@ -2,6 +2,22 @@
 #  License, v. 2.0. If a copy of the MPL was not distributed with this
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from hydralink.hydralink import HydraLink
+from typing import TYPE_CHECKING, Any
 
-__all__ = ['HydraLink']
\ No newline at end of file
+if TYPE_CHECKING:
+    from hydralink.__main__ import main
+    from hydralink.hydralink import HydraLink
+
+__all__ = ['HydraLink', 'main']
+
+
+def __getattr__(name: str) -> Any:
+    # Loaded on first use, so that the command line only imports the modules
+    # it needs
+    if name == 'HydraLink':
+        from hydralink.hydralink import HydraLink
+        return HydraLink
+    if name == 'main':
+        from hydralink.__main__ import main
+        return main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
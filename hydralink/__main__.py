@@ -5,9 +5,115 @@
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
+import sys
+import time
 
-from typing import Union
-from hydralink import HydraLink
+from typing import TYPE_CHECKING, List, Union
+
+# The device stack, the backends and tkinter are only imported by the
+# commands which need them, which keeps --help and --diff fast
+if TYPE_CHECKING:
+    from hydralink.hydralink import HydraLink, SetupReport
+
+
+def _time_to_link(report: 'SetupReport') -> str:
+    if report.time_to_link is None:
+        return ""
+    return ", link up after %.0f ms" % (report.time_to_link * 1e3)
+
+
+def _describe(report: 'SetupReport') -> str:
+    return "changed: %s%s" % (", ".join(report.changed) or "nothing", _time_to_link(report))
+
+
+def _forward(parser: argparse.ArgumentParser, args: argparse.Namespace, devices: List[Union[None, int, str]]) -> None:
+    """Forwards the setup or dump to a running daemon"""
+    from hydralink.daemon import DaemonClient, DaemonError
+    from hydralink.dump import Snapshot, save_snapshot
+    from hydralink.hydralink import SetupReport
+
+    if any([args.eeprom_read, args.eeprom_write, args.from_profile, args.check_profile, args.save_profile]):
+        parser.error("Only the setup and dumps can be forwarded to the daemon")
+    with DaemonClient(args.socket) as client:
+        if args.all:
+            devices = client.request('list')
+
+        if args.dump is not None:
+            if len(devices) != 1:
+                parser.error("Dumps take a single device")
+            text = client.request('dump', device=devices[0], phy=args.phy_dump)
+            save_snapshot(Snapshot.from_json(text), args.dump)
+            return
+
+        request = dict(master=args.master,
+                       speed=(1000 if args.gigabit else 100),
+                       mac_addr=args.mac_addr,
+                       promiscuous=args.promiscuous,
+                       incremental=args.incremental,
+                       wait_link=args.wait_link,
+                       dry_run=args.dry_run)
+        results = client.request('setup', devices=devices, **request)
+
+    for r in results:
+        name = '' if len(results) == 1 else '%s: ' % r['device']
+        if not r['ok']:
+            print("%sfailed: %s" % (name, r['error']))
+        elif args.dry_run:
+            print(name + r['result']['plan'])
+        else:
+            result = r['result']
+            print(name + _describe(SetupReport(tuple(result['changed']), result['phy_reset'],
+                                               result['time_to_link'])))
+    if not all(r['ok'] for r in results):
+        raise DaemonError("Setup failed")
+
+
+def _run(args: argparse.Namespace, hl: 'HydraLink') -> None:
+    """Runs the command on a single device"""
+    from hydralink.config import HydraLinkConfig
+    from hydralink.dump import read_snapshot, save_snapshot
+    from hydralink.profile import BootProfile, has_boot_profile, write_boot_profile
+
+    if args.dump is not None:
+        save_snapshot(read_snapshot(hl.mac, hl.phy.phy_addr if args.phy_dump else None), args.dump)
+        return
+
+    if args.eeprom_read is not None:
+        with open(args.eeprom_read, 'wb') as f:
+            f.write(hl.mac.read_image())
+        return
+
+    if args.eeprom_write is not None:
+        with open(args.eeprom_write, 'rb') as f:
+            image = f.read()
+        written = hl.mac.write_image(image, verify=not args.no_verify)
+        print("%d of %d bytes written" % (written, len(image)))
+        return
+
+    if args.from_profile:
+        if hl.setup_from_boot_profile() is None:
+            print("No boot profile stored")
+            sys.exit(1)
+        return
+
+    profile = BootProfile(master=args.master,
+                          speed=(1000 if args.gigabit else 100),
+                          mac_addr=args.mac_addr,
+                          promiscuous=args.promiscuous)
+
+    if args.check_profile:
+        sys.exit(0 if has_boot_profile(hl.mac, profile) else 1)
+
+    if args.save_profile:
+        write_boot_profile(hl.mac, profile)
+
+    if args.dry_run:
+        print(hl.plan(HydraLinkConfig(*profile), args.incremental).describe())
+        return
+
+    report = hl.setup(**profile._asdict(), incremental=args.incremental, wait_link=args.wait_link)
+    if args.incremental or args.wait_link:
+        print(_describe(report))
 
 
 def main() -> None:
@@ -18,32 +124,147 @@ def main() -> None:
     parser.add_argument('--gui', action='store_true')
     parser.add_argument('-g', '--gigabit', action='store_true')
     parser.add_argument('-m', '--master',  action='store_true')
-    parser.add_argument('-d', '--device', type=str)
+    parser.add_argument('-d', '--device', type=str, action='append',
+                        help="Device to configure, can be given multiple times")
+    parser.add_argument('--all', action='store_true', help="Configure all connected devices")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="Number of devices configured concurrently (default: all)")
     parser.add_argument('-p', '--promiscuous', type=bool)
-    parser.add_argument('--dump', type=str, help="Dump all MAC registers to file")
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help="Only apply the settings which differ, and only reset the PHY if needed")
+    parser.add_argument('-w', '--wait-link', action='store_true',
+                        help="Wait for the link to come up after the setup, and show the time it took")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Show the register writes of the setup instead of applying them")
+    parser.add_argument('--mac-addr', type=str, help="MAC address in the form 01:23:45:ab:cd:ef")
+    parser.add_argument('--save-profile', action='store_true',
+                        help="Store the configuration as boot profile in the EEPROM, and apply it")
+    parser.add_argument('--check-profile', action='store_true',
+                        help="Exit with status 0 if the EEPROM holds the configuration as boot profile. "
+                             "Only the stored record is checked, not the live configuration of the device")
+    parser.add_argument('--from-profile', action='store_true',
+                        help="Apply the boot profile stored in the EEPROM")
+    parser.add_argument('--dump', type=str,
+                        help="Dump all MAC registers to file (.bin: binary, .json: JSON, otherwise text)")
+    parser.add_argument('--phy-dump', action='store_true',
+                        help="Include the PHY MMD registers in the dump")
+    parser.add_argument('--eeprom-read', type=str, metavar='FILE',
+                        help="Save the EEPROM image to a binary file")
+    parser.add_argument('--eeprom-write', type=str, metavar='FILE',
+                        help="Program the EEPROM with the image from a binary file")
+    parser.add_argument('--no-verify', action='store_true',
+                        help="Do not read back the EEPROM image after writing it")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Run as daemon, serving requests on a Unix domain socket")
+    parser.add_argument('-c', '--connect', action='store_true',
+                        help="Forward the setup or dump to a running daemon")
+    parser.add_argument('--socket', type=str,
+                        help="Socket of the daemon (default: $HYDRALINK_SOCKET, or hydralink.sock in the "
+                             "runtime directory)")
+    parser.add_argument('--trace', type=str, metavar='FILE',
+                        help="Record the register transfers of the command to a trace file")
+    parser.add_argument('--replay', type=str, metavar='FILE',
+                        help="Run the command against a trace file instead of a device")
+    parser.add_argument('--replay-timing', action='store_true',
+                        help="Replay the transfers with their recorded timing")
+    parser.add_argument('--trace-diff', type=str, nargs=2, metavar=('A', 'B'),
+                        help="Compare two traces, exit with status 1 if they write different values")
+    parser.add_argument('--exporter', type=str, metavar='[HOST]:PORT',
+                        help="Serve Prometheus metrics of the devices (default: all) on HOST:PORT")
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help="Time between two samples of the exporter, in seconds (default: 5)")
+    parser.add_argument('--diff', type=str, nargs=2, metavar=('A', 'B'),
+                        help="Show the registers which differ between two dumps")
     args = parser.parse_args()
 
     if args.gui:
         import hydralink.gui
         return hydralink.gui.main()
 
-    devid: Union[None, int, str] = None
-    try:
-        devid = int(args.device, 10)
-    except Exception:
-        devid = args.device
+    if args.diff is not None:
+        from hydralink.dump import diff_phy_snapshots, diff_snapshots, load_snapshot
+        a, b = (load_snapshot(path) for path in args.diff)
+        for addr, va, vb in diff_snapshots(a, b):
+            print("%03x: %8s -> %8s" % (addr,
+                                        '-' if va is None else '%08x' % va,
+                                        '-' if vb is None else '%08x' % vb))
+        for (devad, reg), pa, pb in diff_phy_snapshots(a, b):
+            print("%d.%04x: %4s -> %4s" % (devad, reg,
+                                           '-' if pa is None else '%04x' % pa,
+                                           '-' if pb is None else '%04x' % pb))
+        return
 
-    hl = HydraLink(devid)
+    if args.trace_diff is not None:
+        from hydralink.trace import diff_traces, load_trace
+        diff = diff_traces(*(load_trace(path) for path in args.trace_diff))
+        print(diff.describe())
+        sys.exit(1 if diff.changes else 0)
 
-    if args.dump is not None:
-        with open(args.dump, "w") as of:
-            for i in range(0, 0x1000, 4):
-                print("%03x: %08x" % (i, hl.mac[i]), file=of)
+    if args.daemon:
+        from hydralink.daemon import HydraLinkDaemon
+        HydraLinkDaemon(args.socket).serve_forever()
         return
 
-    hl.setup(master=args.master,
-             speed=(1000 if args.gigabit else 100),
-             promiscuous=args.promiscuous)
+    devices: List[Union[None, int, str]] = []
+    for device in args.device or [None]:
+        try:
+            devices.append(int(device, 10))
+        except Exception:
+            devices.append(device)
+
+    if args.connect:
+        return _forward(parser, args, devices)
+
+    if args.exporter is not None:
+        from hydralink.exporter import Exporter, Sampler, parse_address
+        try:
+            address = parse_address(args.exporter)
+        except ValueError as x:
+            parser.error(str(x))
+        Exporter(address, Sampler(None if args.all or not args.device else devices, args.interval)).serve_forever()
+        return
+
+    from hydralink.config import HydraLinkConfig
+    from hydralink.hydralink import HydraLink, get_lan7801_driver, list_hydralinks
+
+    if args.all:
+        devices = list(list_hydralinks())
+
+    if len(devices) != 1 or args.all:
+        if any([args.dump, args.eeprom_read, args.eeprom_write, args.from_profile, args.check_profile,
+                args.save_profile, args.dry_run, args.trace, args.replay]):
+            parser.error("Only the setup can be applied to multiple devices")
+        from hydralink.multi import configure_many
+        config = HydraLinkConfig(master=args.master,
+                                 speed=(1000 if args.gigabit else 100),
+                                 mac_addr=args.mac_addr,
+                                 promiscuous=args.promiscuous)
+        t0 = time.perf_counter()
+        results = configure_many(devices, config, args.incremental, workers=args.jobs, wait_link=args.wait_link)
+        for r in results:
+            name = r.serial or str(r.device)
+            if r.report is not None:
+                print("%s: configured in %.0f ms, %s" % (name, r.duration * 1e3, _describe(r.report)))
+            else:
+                print("%s: failed after %.0f ms: %s" % (name, r.duration * 1e3, r.error))
+        print("%d of %d devices configured in %.0f ms" % (
+            sum(r.error is None for r in results), len(results), (time.perf_counter() - t0) * 1e3))
+        if any(r.error is not None for r in results):
+            sys.exit(1)
+        return
+
+    if args.replay is None and args.trace is None:
+        return _run(args, HydraLink(devices[0]))
+
+    from hydralink.trace import LAN7801_Replay, TraceRecorder, load_trace, save_trace
+    ll = get_lan7801_driver(devices[0]) if args.replay is None else \
+        LAN7801_Replay(load_trace(args.replay), args.replay_timing)
+    recorder = TraceRecorder(ll) if args.trace is not None else None
+    try:
+        _run(args, HydraLink(ll if recorder is None else recorder))
+    finally:
+        if recorder is not None:
+            save_trace(recorder.trace(), args.trace)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""asyncio interface to the HydraLink.
+
+pyusb only offers blocking control transfers, so every operation (a register
+access, an MDIO or EEPROM transaction, a whole `setup()`) is handed to the
+executor of the event loop as a single unit. The event loop never blocks on
+USB, and the threads of the executor are shared by all devices instead of
+being dedicated to one of them. Operations on the same device are serialized
+with a lock, because MDIO and EEPROM transactions must not interleave.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Sequence, TypeVar, Union
+
+from hydralink.config import HydraLinkConfig, Plan
+from hydralink.counters import StatsSample
+from hydralink.hydralink import LINK_POLL, HydraLink, SetupReport
+from hydralink.lan7801 import EEPROM_SIZE, LAN7801, LAN7801_LL, RegisterBatch, RegisterOp
+
+T = TypeVar('T')
+
+
+class AsyncLAN7801:
+    def __init__(self, mac: Union[LAN7801, LAN7801_LL], executor: Optional[Executor] = None) -> None:
+        """Wraps a `LAN7801`, or a bare `LAN7801_LL` transport.
+
+        Blocking calls run in `executor`, or in the default executor of the
+        running event loop if it is None.
+        """
+        if isinstance(mac, LAN7801_LL):
+            mac = LAN7801(mac)
+        self.mac = mac
+        self.executor = executor
+        self.lock = asyncio.Lock()
+
+    async def _call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def batch(self) -> RegisterBatch:
+        """Returns a batch to be executed with `run`"""
+        return self.mac.batch()
+
+    async def run(self, batch: RegisterBatch) -> List[int]:
+        return await self._call(batch.execute)
+
+    async def execute(self, ops: Sequence[RegisterOp]) -> List[int]:
+        return await self._call(self.mac.execute, ops)
+
+    async def read_reg(self, address: int) -> int:
+        return await self._call(self.mac.read_reg, address)
+
+    async def write_reg(self, address: int, value: int) -> None:
+        await self._call(self.mac.write_reg, address, value)
+
+    async def read_mdio_reg(self, phy_addr: int, miirinda: int) -> int:
+        return await self._call(self.mac.read_mdio_reg, phy_addr, miirinda)
+
+    async def write_mdio_reg(self, phy_addr: int, miirinda: int, data: int) -> None:
+        await self._call(self.mac.write_mdio_reg, phy_addr, miirinda, data)
+
+    async def read_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int) -> int:
+        return await self._call(self.mac.read_mdio_reg_c45, phy_addr, devad, miirinda)
+
+    async def write_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int, data: int) -> None:
+        await self._call(self.mac.write_mdio_reg_c45, phy_addr, devad, miirinda, data)
+
+    async def eeprom_read(self, addr: int) -> int:
+        return await self._call(self.mac.eeprom_read, addr)
+
+    async def eeprom_write(self, addr: int, data: int) -> None:
+        await self._call(self.mac.eeprom_write, addr, data)
+
+    async def read_image(self, size: int = EEPROM_SIZE, offset: int = 0) -> bytes:
+        return await self._call(self.mac.read_image, size, offset)
+
+    async def write_image(self, data: bytes, verify: bool = True, offset: int = 0) -> int:
+        return await self._call(self.mac.write_image, data, verify, offset)
+
+    async def read_statistics(self) -> StatsSample:
+        return await self._call(self.mac.read_statistics)
+
+    async def eeprom_erase_all(self) -> None:
+        await self._call(self.mac.eeprom_erase_all)
+
+    async def set_ads(self, ads_enabled: bool) -> None:
+        await self._call(self.mac.set_ads, ads_enabled)
+
+    async def set_speed(self, speed: int) -> None:
+        await self._call(self.mac.set_speed, speed)
+
+    async def get_speed(self) -> int:
+        return await self._call(self.mac.get_speed)
+
+
+class AsyncHydraLink:
+    """asyncio counterpart of `HydraLink`, use `AsyncHydraLink.open` to
+    create one"""
+    def __init__(self, hl: HydraLink, executor: Optional[Executor] = None) -> None:
+        self.hl = hl
+        self.mac = AsyncLAN7801(hl.mac, executor)
+
+    @classmethod
+    async def open(cls,
+                   spec: Union[None, int, str, LAN7801_LL] = None,
+                   cache: bool = False,
+                   executor: Optional[Executor] = None
+                   ) -> 'AsyncHydraLink':
+        """Finds and verifies the device without blocking the event loop. The
+        arguments are the same as for `HydraLink`."""
+        loop = asyncio.get_running_loop()
+        hl = await loop.run_in_executor(executor, functools.partial(HydraLink, spec, cache=cache))
+        return cls(hl, executor)
+
+    @property
+    def verbose(self) -> bool:
+        return self.hl.verbose
+
+    @verbose.setter
+    def verbose(self, verbose: bool) -> None:
+        self.hl.verbose = verbose
+
+    async def read_phy(self, devaddr: int, miiaddr: int) -> int:
+        return await self.mac._call(self.hl.phy.__getitem__, (devaddr, miiaddr))
+
+    async def write_phy(self, devaddr: int, miiaddr: int, value: int) -> None:
+        await self.mac._call(self.hl.phy.__setitem__, (devaddr, miiaddr), value)
+
+    async def get_speed(self) -> Optional[int]:
+        return await self.mac._call(self.hl.phy.get_speed)
+
+    async def get_master(self) -> bool:
+        return await self.mac._call(self.hl.phy.get_master)
+
+    async def setup(self,
+                    master: Optional[bool] = None,
+                    speed: Optional[int] = None,
+                    mac_addr: Optional[str] = None,
+                    promiscuous: Optional[bool] = None,
+                    incremental: bool = False,
+                    wait_link: bool = False
+                    ) -> SetupReport:
+        """See `HydraLink.setup`"""
+        return await self.mac._call(self.hl.setup, master=master, speed=speed, mac_addr=mac_addr,
+                                    promiscuous=promiscuous, incremental=incremental, wait_link=wait_link)
+
+    async def plan(self, config: HydraLinkConfig, incremental: bool = False) -> Plan:
+        """See `HydraLink.plan`"""
+        return await self.mac._call(self.hl.plan, config, incremental)
+
+    async def apply(self, plan: Plan, wait_link: bool = False) -> SetupReport:
+        return await self.mac._call(self.hl.apply, plan, wait_link)
+
+    async def wait_for_link(self, timeout: float = LINK_POLL.timeout) -> float:
+        """See `HydraLink.wait_for_link`. The device is locked while waiting."""
+        return await self.mac._call(self.hl.wait_for_link, timeout)
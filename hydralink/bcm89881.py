@@ -2,22 +2,124 @@
 #  License, v. 2.0. If a copy of the MPL was not distributed with this
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from typing import Optional
-from hydralink.lan7801 import LAN7801
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from hydralink.lan7801 import LAN7801, RegisterBatch
 
 
 class BCM89881:
-    def __init__(self, mac: LAN7801, phy_addr: int):
+    # Status registers: PMA/PMD, PCS and AN status, BASE-T1 PMA/PCS/AN status
+    VOLATILE_REGISTERS = frozenset([(1, 0x0001), (1, 0x0008), (3, 0x0001), (3, 0x0008), (7, 0x0001),
+                                    (1, 0x0901), (3, 0x0901), (3, 0x0902), (7, 0x0201)])
+    # Bits which clear themselves once the requested action is complete
+    SELF_CLEARING_BITS = {(1, 0x0000): 0x8000, (3, 0x0000): 0x8000}
+
+    def __init__(self, mac: LAN7801, phy_addr: int, cache: bool = False):
         if phy_addr & 0x1f != phy_addr:
             raise ValueError('PHY address must be a 5-bit unsigned integer')
         self.mac = mac
         self.phy_addr = phy_addr
+        self._shadow: Optional[Dict[Tuple[int, int], int]] = {} if cache else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self._shadow is not None
+
+    def invalidate(self, key: Optional[Tuple[int, int]] = None) -> None:
+        """Drops one register, or all of them, from the cache"""
+        if self._shadow is not None:
+            if key is None:
+                self._shadow.clear()
+            else:
+                self._shadow.pop(key, None)
+
+    def refresh(self) -> None:
+        """Re-reads every cached register from the device"""
+        if not self._shadow:
+            return
+        b = self.mac.batch()
+        idxs = {key: self.queue_read(b, *key) for key in self._shadow}
+        results = b.execute()
+        for key, idx in idxs.items():
+            self._store(key, results[idx])
+
+    def _store(self, key: Tuple[int, int], value: int) -> None:
+        assert self._shadow is not None
+        if key in self.VOLATILE_REGISTERS or value & self.SELF_CLEARING_BITS.get(key, 0):
+            self._shadow.pop(key, None)
+        else:
+            self._shadow[key] = value
+
+    def cached(self, key: Tuple[int, int]) -> Optional[int]:
+        """Returns the cached value of a register, None if it is not cached"""
+        if self._shadow is None or key not in self._shadow:
+            return None
+        self.cache_hits += 1
+        return self._shadow[key]
+
+    def assume(self, key: Tuple[int, int], value: int) -> None:
+        """Records `value`, written by an executed batch, in the cache"""
+        if self._shadow is not None:
+            self._store(key, value)
 
-    def __getitem__(self, key: tuple[int, int]) -> int:
-        return self.mac.read_mdio_reg_c45(self.phy_addr, *key)
+    def __getitem__(self, key: Tuple[int, int]) -> int:
+        shadow = self._shadow
+        if shadow is None or key in self.VOLATILE_REGISTERS:
+            return self.mac.read_mdio_reg_c45(self.phy_addr, *key)
+        if key in shadow:
+            self.cache_hits += 1
+            return shadow[key]
+        self.cache_misses += 1
+        value = self.mac.read_mdio_reg_c45(self.phy_addr, *key)
+        self._store(key, value)
+        return value
 
-    def __setitem__(self, key: tuple[int, int], value: int) -> None:
+    def __setitem__(self, key: Tuple[int, int], value: int) -> None:
+        self.invalidate(key)
         self.mac.write_mdio_reg_c45(self.phy_addr, *key, value)
+        if self._shadow is not None:
+            self._store(key, value)
+
+    def queue_read(self, batch: RegisterBatch, devaddr: int, miiaddr: int) -> int:
+        return self.mac.queue_mdio_read_c45(batch, self.phy_addr, devaddr, miiaddr)
+
+    def queue_write(self, batch: RegisterBatch, devaddr: int, miiaddr: int, value: int) -> None:
+        # The batch may never be executed, do not assume the new value
+        self.invalidate((devaddr, miiaddr))
+        self.mac.queue_mdio_write_c45(batch, self.phy_addr, devaddr, miiaddr, value)
+
+    @contextmanager
+    def preview(self) -> Iterator[RegisterBatch]:
+        """Yields a batch of `LAN7801.preview`, which is never executed. The
+        registers which queued writes drop from the cache are restored
+        afterwards."""
+        shadow = None if self._shadow is None else dict(self._shadow)
+        try:
+            with self.mac.preview() as b:
+                yield b
+        finally:
+            if self._shadow is not None and shadow is not None:
+                self._shadow.clear()
+                self._shadow.update(shadow)
+
+    def read_block(self, devaddr: int, start: int, count: int) -> List[int]:
+        """Reads `count` consecutive registers in a single batch"""
+        values = self.mac.read_mdio_block_c45(self.phy_addr, devaddr, start, count)
+        if self._shadow is not None:
+            for i, value in enumerate(values):
+                self._store((devaddr, start + i), value)
+        return values
+
+    def write_block(self, devaddr: int, start: int, values: Sequence[int]) -> None:
+        """Writes consecutive registers in a single batch"""
+        for i in range(len(values)):
+            self.invalidate((devaddr, start + i))
+        self.mac.write_mdio_block_c45(self.phy_addr, devaddr, start, values)
+        if self._shadow is not None:
+            for i, value in enumerate(values):
+                self._store((devaddr, start + i), value)
 
     def edit_register(self, devaddr: int, miiaddr: int, set: int, clr: int) -> int:
         if set & 0xffff != set:
@@ -26,12 +128,12 @@ class BCM89881:
             raise ValueError("set mask bust be a 16-bit unsigned integer")
         if clr & set:
             raise ValueError("set and clr masks are conflicting")
-        reg = self.mac.read_mdio_reg_c45(self.phy_addr, devaddr, miiaddr)
+        reg = self[devaddr, miiaddr]
         old_reg = reg
         reg &= (~clr) & 0xffff
         reg |= set
         if old_reg != reg:
-            self.mac.write_mdio_reg_c45(self.phy_addr, devaddr, miiaddr, reg)
+            self[devaddr, miiaddr] = reg
         return reg
 
     def reset(self, rst: bool) -> None:
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Benchmarks of the register, MDIO, EEPROM and setup() hot paths.
+
+Every benchmark reports the number of control transfers per operation, which
+is what costs time on a real device, and the wall time per operation. When
+running on the simulator, the modelled time of the transfers is reported as
+well.
+
+By default the benchmarks run on `LAN7801_Sim`, so they can run anywhere;
+`-d` selects a real device instead. On a real device, the benchmarks which
+program the EEPROM are skipped unless `--destructive` is given. Results can
+be saved to a JSON file and compared against a previous run, e.g.:
+
+    python -m hydralink.benchmark --compare test/benchmark_baseline.json
+
+`--startup` checks the cold-start time of the command line against
+`STARTUP_BUDGET` instead.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import weakref
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Union
+
+from hydralink.health import read_health
+from hydralink.hydralink import HydraLink, get_lan7801_driver
+from hydralink.lan7801 import LAN7801_LL
+from hydralink.simulator import LAN7801_Sim
+
+# Latency of a control transfer on a high-speed USB bus and programming time
+# of the EEPROM, used by the default simulated device
+SIM_LATENCY = 125e-6
+SIM_EEPROM_WRITE_TIME = 4e-3
+
+# Cold-start time of the command line, above the start of a bare interpreter
+STARTUP_BUDGET = 0.08
+# Modules which commands that do not access a device must not load
+STARTUP_EXCLUDED = ['hydralink.hydralink', 'hydralink.lan7801', 'hydralink.lan7801_libusb',
+                    'hydralink.lan7801_win', 'usb', 'tkinter', 'concurrent.futures']
+
+
+class BenchmarkResult(NamedTuple):
+    operations: int
+    transfers: float
+    # Wall time and modelled time per operation, in seconds
+    wall: float
+    modelled: Optional[float]
+
+
+def _edit_register(hl: HydraLink, i: int) -> None:
+    if i & 1:
+        hl.phy.edit_register(1, 0x0834, 0x0000, 0x4000)
+    else:
+        hl.phy.edit_register(1, 0x0834, 0x4000, 0x0000)
+
+
+# Vendor registers of the PHY which `write_mdio_block_c45` writes. They are
+# not scratch registers, so the values read by the warm-up are written back.
+_BLOCK_START = 0x9300
+_block_values: 'weakref.WeakKeyDictionary[HydraLink, List[int]]' = weakref.WeakKeyDictionary()
+
+
+def _write_block(hl: HydraLink, i: int) -> None:
+    values = _block_values.get(hl)
+    if values is None:
+        values = _block_values[hl] = hl.phy.read_block(1, _BLOCK_START, 16)
+    hl.phy.write_block(1, _BLOCK_START, values)
+
+
+BENCHMARKS: Dict[str, Callable[[HydraLink, int], object]] = {
+    'read_reg': lambda hl, i: hl.mac.read_reg(0x0b0),
+    'write_reg': lambda hl, i: hl.mac.write_reg(0x0b0, 0x1c8a),
+    'read_mdio_reg_c45': lambda hl, i: hl.mac.read_mdio_reg_c45(0, 1, 0x0834),
+    'write_mdio_reg_c45': lambda hl, i: hl.mac.write_mdio_reg_c45(0, 1, 0xa027, 0x0f15),
+    'read_mdio_block_c45': lambda hl, i: hl.phy.read_block(1, 0x0000, 16),
+    'write_mdio_block_c45': _write_block,
+    'edit_register': _edit_register,
+    'eeprom_read': lambda hl, i: hl.mac.eeprom_read(i & 0x1ff),
+    'eeprom_write': lambda hl, i: hl.mac.eeprom_write(i & 0x1ff, i & 0xff),
+    'eeprom_read_image': lambda hl, i: hl.mac.read_image(),
+    'eeprom_write_image': lambda hl, i: hl.mac.write_image(bytes([i]) * 16 + bytes(496)),
+    'read_statistics': lambda hl, i: hl.mac.read_statistics(),
+    'read_health': lambda hl, i: read_health(hl.phy),
+    'setup': lambda hl, i: hl.setup(),
+    'setup_master': lambda hl, i: hl.setup(master=bool(i & 1)),
+    'setup_speed': lambda hl, i: hl.setup(speed=100 if i & 1 else 1000),
+    'setup_full': lambda hl, i: hl.setup(master=bool(i & 1), speed=100 if i & 1 else 1000,
+                                         mac_addr='02:00:00:00:00:01', promiscuous=bool(i & 1)),
+    'setup_incremental': lambda hl, i: hl.setup(master=True, speed=1000, mac_addr='02:00:00:00:00:01',
+                                                promiscuous=False, incremental=True),
+}
+# Benchmarks which are also run with the register cache enabled
+CACHED_BENCHMARKS = ['edit_register', 'read_health', 'setup_full', 'setup_incremental']
+# Benchmarks which program the EEPROM, and erase the signature, MAC address
+# and USB strings of a real device
+DESTRUCTIVE_BENCHMARKS = ['eeprom_write', 'eeprom_write_image']
+
+
+def simulated_device() -> LAN7801_LL:
+    return LAN7801_Sim(latency=SIM_LATENCY, eeprom_write_time=SIM_EEPROM_WRITE_TIME)
+
+
+def run_benchmark(factory: Callable[[], LAN7801_LL],
+                  fn: Callable[[HydraLink, int], object],
+                  operations: int = 10,
+                  cache: bool = False) -> BenchmarkResult:
+    ll = factory()
+    hl = HydraLink(ll, cache=cache)
+    hl.verbose = False
+    stats = ll.enable_stats()
+    # Warm up, so that caches are in their steady state
+    fn(hl, 1)
+    stats.reset()
+
+    sim = ll if isinstance(ll, LAN7801_Sim) else None
+    sim_start = sim.now if sim else 0.0
+    t0 = time.perf_counter()
+    for i in range(operations):
+        fn(hl, i)
+    wall = time.perf_counter() - t0
+    modelled = (sim.now - sim_start) / operations if sim else None
+    return BenchmarkResult(operations, stats.transfers / operations, wall / operations, modelled)
+
+
+def run_benchmarks(factory: Callable[[], LAN7801_LL] = simulated_device,
+                   operations: int = 10,
+                   names: Optional[List[str]] = None,
+                   destructive: bool = False) -> Dict[str, BenchmarkResult]:
+    """Runs the benchmarks `names`, or all of them. The benchmarks in
+    `DESTRUCTIVE_BENCHMARKS` only run on the simulator, unless
+    `destructive` is set."""
+    results = {}
+    simulated = isinstance(factory(), LAN7801_Sim)
+    for name, fn in BENCHMARKS.items():
+        if name in DESTRUCTIVE_BENCHMARKS and not (simulated or destructive):
+            continue
+        if names is None or name in names:
+            results[name] = run_benchmark(factory, fn, operations)
+        if name in CACHED_BENCHMARKS and (names is None or name + '_cached' in names):
+            results[name + '_cached'] = run_benchmark(factory, fn, operations, cache=True)
+    return results
+
+
+def save_results(results: Dict[str, BenchmarkResult], path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump({name: {'operations': r.operations,
+                          'transfers': round(r.transfers, 3),
+                          'wall': round(r.wall, 9),
+                          'modelled': None if r.modelled is None else round(r.modelled, 9)}
+                   for name, r in results.items()},
+                  f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def load_results(path: str) -> Dict[str, BenchmarkResult]:
+    with open(path) as f:
+        return {name: BenchmarkResult(**r) for name, r in json.load(f).items()}
+
+
+def regressions(baseline: Dict[str, BenchmarkResult],
+                results: Dict[str, BenchmarkResult]) -> List[str]:
+    """Returns the benchmarks which need more transfers than in `baseline`"""
+    return [name for name, r in results.items()
+            if name in baseline and r.transfers > baseline[name].transfers]
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True)
+
+
+def measure_startup(argv: Sequence[str] = ('--help',), runs: int = 5) -> float:
+    """Returns the best cold-start time of `python -m hydralink argv` over
+    `runs` runs, minus that of a bare interpreter, in seconds"""
+    def best(*args: str) -> float:
+        times = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            _run_python(*args)
+            times.append(time.perf_counter() - t0)
+        return min(times)
+    return best('-m', 'hydralink', *argv) - best('-c', 'pass')
+
+
+def startup_modules(argv: Sequence[str] = ('--help',)) -> List[str]:
+    """Returns the modules loaded by `python -m hydralink argv`"""
+    script = ("import runpy, sys\n"
+              "sys.argv = ['hydralink'] + sys.argv[1:]\n"
+              "try:\n"
+              "    runpy.run_module('hydralink', run_name='__main__', alter_sys=True)\n"
+              "except SystemExit:\n"
+              "    pass\n"
+              "sys.stderr.write('\\n'.join(sys.modules))\n")
+    return _run_python('-c', script, *argv).stderr.splitlines()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+                        prog='hydralink.benchmark',
+                        description='Measures transfers and time of the HydraLink hot paths')
+    parser.add_argument('-d', '--device', type=str,
+                        help="Run on a real HydraLink instead of the simulator")
+    parser.add_argument('-n', '--operations', type=int, default=10)
+    parser.add_argument('--save', type=str, help="Save the results to a JSON file")
+    parser.add_argument('--compare', type=str, help="Compare transfer counts with saved results")
+    parser.add_argument('--destructive', action='store_true',
+                        help="Also run the benchmarks which program the EEPROM on a real device, erasing its "
+                             "configuration")
+    parser.add_argument('--startup', action='store_true',
+                        help="Measure the cold-start time of the command line instead")
+    parser.add_argument('names', nargs='*', help="Benchmarks to run (default: all)")
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = measure_startup()
+        print("startup: %.1f ms, budget %.1f ms" % (startup * 1e3, STARTUP_BUDGET * 1e3))
+        loaded = [name for name in STARTUP_EXCLUDED if name in startup_modules()]
+        if loaded:
+            print("Modules loaded at startup: " + ", ".join(loaded))
+        if startup > STARTUP_BUDGET or loaded:
+            sys.exit(1)
+        return
+
+    if args.device is not None:
+        spec: Union[int, str] = int(args.device, 10) if args.device.isdigit() else args.device
+        ll = get_lan7801_driver(spec)
+        results = run_benchmarks(lambda: ll, args.operations, args.names or None, args.destructive)
+        if not args.destructive:
+            print("Skipped the benchmarks which program the EEPROM: " + ", ".join(DESTRUCTIVE_BENCHMARKS))
+    else:
+        results = run_benchmarks(simulated_device, args.operations, args.names or None)
+    baseline = load_results(args.compare) if args.compare else {}
+
+    print("%-28s %10s %10s %12s %12s" % ("benchmark", "transfers", "baseline", "wall [µs]", "model [µs]"))
+    for name, r in results.items():
+        print("%-28s %10.1f %10s %12.1f %12s" % (
+            name, r.transfers,
+            "%.1f" % baseline[name].transfers if name in baseline else "-",
+            r.wall * 1e6,
+            "%.1f" % (r.modelled * 1e6) if r.modelled is not None else "-"))
+
+    if args.save:
+        save_results(results, args.save)
+    failed = regressions(baseline, results)
+    if failed:
+        print("Transfer count regressions: " + ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
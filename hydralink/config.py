@@ -0,0 +1,238 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Declarative HydraLink configuration.
+
+A `HydraLinkConfig` describes the desired state. `plan_config` compiles it,
+together with the current register values read by `read_state`, into a
+`Plan`: the writes needed to reach that state, in the order the hardware
+requires, namely
+ 1. hold the PHY in reset, if any PHY setting changes,
+ 2. disable TX and RX, if the MAC speed changes,
+ 3. write the MAC registers,
+ 4. write the PHY registers, grouped by MMD and in ascending order,
+ 5. enable TX and RX again,
+ 6. release the PHY from reset,
+ 7. read the link status registers once, see `LINK_STATUS_REGISTERS`.
+
+Every register is written at most once per step, with the combined effect of
+all settings which touch it.
+"""
+
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from hydralink.bcm89881 import BCM89881
+from hydralink.lan7801 import LAN7801, OP_POLL, OP_READ, OP_WRITE, TXRX_POLL, RegisterBatch
+from hydralink.profile import parse_mac_addr
+
+# Settings applied by a plan, in the order they are reported
+SETTINGS = ('release', 'init', 'promiscuous', 'mac_addr', 'mac_speed', 'phy_speed', 'master')
+# Settings which can only be changed while the PHY is held in reset
+PHY_SETTINGS = {'release', 'init', 'phy_speed', 'master'}
+
+# Receive link status of the PMA/PMD and of the PCS. The link bits latch low,
+# so after a PHY reset the first read of each returns 0 even if the link is
+# up: a plan which resets the PHY reads them once to clear the latches.
+LINK_STATUS_REGISTERS = [(1, 0x0001), (3, 0x0001)]
+
+# MAC-PHY RGMII clock delay and PHY LED configuration
+PHY_INIT_REGISTERS = {
+    (1, 0xa010): 0x0001,
+    (1, 0xa015): 0x0000,
+    (1, 0xa027): 0x0f15,
+    (1, 0x931d): 0x0010,
+    (1, 0x931e): 0x0063,
+}
+
+
+class HydraLinkConfig(NamedTuple):
+    """Desired state of a HydraLink, None leaves a setting unchanged.
+    See `HydraLink.setup` for the meaning of the settings."""
+    master: Optional[bool] = None
+    speed: Optional[int] = None
+    mac_addr: Optional[str] = None
+    promiscuous: Optional[bool] = None
+
+
+class DeviceState(NamedTuple):
+    mac: Dict[int, int]
+    phy: Dict[Tuple[int, int], int]
+
+
+class PlanStep(NamedTuple):
+    """A write of a MAC register, or of a PHY register if `devad` is set, a
+    poll of a MAC register until `(reg & mask) == value`, or a read of a PHY
+    register whose value is discarded."""
+    kind: int
+    address: int
+    value: int
+    mask: int = 0
+    devad: Optional[int] = None
+
+    def __str__(self) -> str:
+        if self.kind == OP_POLL:
+            return "poll  %03x & %08x == %08x" % (self.address, self.mask, self.value)
+        if self.kind == OP_READ:
+            return "read  %d.%04x" % (self.devad or 0, self.address)
+        if self.devad is not None:
+            return "write %d.%04x = %04x" % (self.devad, self.address, self.value)
+        return "write %03x = %08x" % (self.address, self.value)
+
+
+class Plan(NamedTuple):
+    config: HydraLinkConfig
+    steps: List[PlanStep]
+    # Settings which are applied, in the order of `SETTINGS`
+    changed: Tuple[str, ...]
+    # Whether the PHY is reset, dropping the link
+    phy_reset: bool
+    # Number of transfers needed to apply the plan, if every poll succeeds
+    # at the first read
+    transfers: Optional[int] = None
+
+    def describe(self) -> str:
+        lines = ["changes: %s" % (", ".join(self.changed) or "none")]
+        lines += [str(step) for step in self.steps]
+        if self.transfers is not None:
+            lines.append("transfers: %d" % self.transfers)
+        return '\n'.join(lines)
+
+
+def read_state(mac: LAN7801, phy: BCM89881, config: HydraLinkConfig, incremental: bool = False) -> DeviceState:
+    """Reads the registers `plan_config` needs for `config`, in a single
+    batch. Registers which a full plan overwrites are only read for
+    incremental plans."""
+    mac_addresses = [0x010]
+    phy_keys: List[Tuple[int, int]] = []
+    if incremental:
+        mac_addresses.append(0x128)
+        phy_keys += PHY_INIT_REGISTERS
+        if config.promiscuous is not None:
+            mac_addresses.append(0x0b0)
+        if config.mac_addr is not None:
+            mac_addresses += [0x118, 0x11c]
+    if config.speed is not None:
+        mac_addresses += [0x100, 0x104, 0x108]
+    if config.master is not None:
+        phy_keys.append((1, 0x0834))
+    # Read last, so that the MMD still points to it when the plan starts by
+    # putting the PHY in reset
+    phy_keys.append((1, 0x0000))
+
+    state = DeviceState({}, {})
+    for key in phy_keys:
+        value = phy.cached(key)
+        if value is not None:
+            state.phy[key] = value
+    b = mac.batch()
+    mac_idxs = {address: b.read(address) for address in mac_addresses}
+    phy_idxs = {key: phy.queue_read(b, *key) for key in phy_keys if key not in state.phy}
+    results = b.execute()
+    state.mac.update((address, results[idx]) for address, idx in mac_idxs.items())
+    state.phy.update((key, results[idx]) for key, idx in phy_idxs.items())
+    return state
+
+
+def plan_config(config: HydraLinkConfig, state: DeviceState, incremental: bool = False) -> Plan:
+    """Compiles `config` into the writes which lead from `state` to it.
+
+    Unless `incremental` is True, every requested setting is written, the
+    PHY is reset and the clock, RGMII and LED registers are re-initialized,
+    as `HydraLink.setup` always did. Otherwise only registers whose value
+    differs are written, and the PHY is only reset if needed.
+    """
+    if config.speed not in (None, 100, 1000):
+        raise ValueError("Speed should be either 100 or 1000")
+
+    mac_writes: Dict[int, int] = {}
+    phy_writes: Dict[Tuple[int, int], int] = {}
+    changed = set()
+
+    def mac_reg(setting: str, address: int, value: int) -> None:
+        if not incremental or state.mac[address] != value:
+            mac_writes[address] = value
+            changed.add(setting)
+
+    def phy_reg(setting: str, key: Tuple[int, int], value: int) -> None:
+        if not incremental or state.phy[key] != value:
+            phy_writes[key] = value
+            changed.add(setting)
+
+    mac_reg('init', 0x010, state.mac[0x010] | 0x02000000)
+    mac_reg('init', 0x128, 0x00000002)
+    for key, value in PHY_INIT_REGISTERS.items():
+        phy_reg('init', key, value)
+
+    if config.promiscuous is not None:
+        mac_reg('promiscuous', 0x0b0, 0x1f80 if config.promiscuous else 0x1c8a)
+
+    if config.mac_addr is not None:
+        hi, lo = struct.unpack(">HI", parse_mac_addr(config.mac_addr))
+        mac_reg('mac_addr', 0x118, hi)
+        mac_reg('mac_addr', 0x11c, lo)
+
+    # PMA/PMD control holds the reset bit as well as the speed
+    pmd_ctrl = state.phy[1, 0x0000]
+    pmd_target = pmd_ctrl & ~0x8000
+    if config.speed is not None:
+        # Disable Automatic Speed Detection and set the MAC speed
+        speed = 2 if config.speed == 1000 else 1
+        mac_reg('mac_speed', 0x100, (state.mac[0x100] & ~0x0806) | (speed << 1))
+        if not state.mac[0x104] & state.mac[0x108] & 1:
+            changed.add('mac_speed')
+        pmd_target = (pmd_target & ~0x2040) | (0x0040 if config.speed == 1000 else 0x2000)
+        if not incremental or pmd_target != pmd_ctrl & ~0x8000:
+            changed.add('phy_speed')
+
+    if config.master is not None:
+        pma_ctrl = state.phy[1, 0x0834]
+        phy_reg('master', (1, 0x0834), (pma_ctrl & ~0x4000) | (0x4000 if config.master else 0))
+
+    if pmd_ctrl & 0x8000 or not incremental:
+        changed.add('release')
+    reset = bool(changed & PHY_SETTINGS)
+    if reset and (pmd_target | 0x8000) != (pmd_ctrl | 0x8000):
+        # The speed is changed while the PHY is held in reset
+        phy_writes[1, 0x0000] = pmd_target | 0x8000
+
+    steps = []
+    if reset:
+        steps.append(PlanStep(OP_WRITE, 0x0000, pmd_ctrl | 0x8000, devad=1))
+    txrx = 'mac_speed' in changed
+    if txrx:
+        # Unlock registers by disabling TXEN and RXEN, writing one clears
+        # the disabled status
+        for address in (0x104, 0x108):
+            steps.append(PlanStep(OP_WRITE, address, (state.mac[address] & ~1) | 2))
+        for address in (0x104, 0x108):
+            steps.append(PlanStep(OP_POLL, address, 0, 1))
+    steps += [PlanStep(OP_WRITE, address, value) for address, value in mac_writes.items()]
+    steps += [PlanStep(OP_WRITE, reg, value, devad=devad) for (devad, reg), value in sorted(phy_writes.items())]
+    if txrx:
+        # Lock registers by enabling TXEN and RXEN
+        for address in (0x104, 0x108):
+            steps.append(PlanStep(OP_WRITE, address, state.mac[address] | 3))
+        for address in (0x104, 0x108):
+            steps.append(PlanStep(OP_POLL, address, 1, 1))
+    if reset:
+        steps.append(PlanStep(OP_WRITE, 0x0000, pmd_target, devad=1))
+        steps += [PlanStep(OP_READ, reg, 0, devad=devad) for devad, reg in LINK_STATUS_REGISTERS]
+
+    return Plan(config, steps, tuple(name for name in SETTINGS if name in changed), reset)
+
+
+def queue_plan(batch: RegisterBatch, phy: BCM89881, plan: Plan) -> None:
+    """Queues the writes, polls and reads of `plan`. A plan does not modify
+    registers, so the batch needs one transfer per operation if every poll
+    succeeds at the first read."""
+    for step in plan.steps:
+        if step.kind == OP_POLL:
+            batch.poll(step.address, step.mask, step.value, TXRX_POLL)
+        elif step.kind == OP_READ:
+            phy.queue_read(batch, step.devad or 0, step.address)
+        elif step.devad is not None:
+            phy.queue_write(batch, step.devad, step.address, step.value)
+        else:
+            batch.write(step.address, step.value)
@@ -0,0 +1,145 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Hardware statistics counters of the LAN7801 MAC.
+
+The LAN7801 returns its 47 RX and TX counters as one block to the vendor
+request 0xA2, as used by the lan78xx driver. Most counters are 20 bits wide,
+the byte counts and the EEE counters 32 bits; all of them wrap around
+silently.
+
+`StatsHistory` turns successive samples into per-interval deltas, which are
+correct across one rollover per interval, and keeps them in a ring buffer of
+`array`s. At one sample per second, the deltas fit in 32 bits, so an hour of
+history costs about 700 kB per device.
+"""
+
+import struct
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+USB_VENDOR_REQUEST_GET_STATS = 0xa2
+
+STAT_COUNTERS = (
+    'rx_fcs_errors', 'rx_alignment_errors', 'rx_fragment_errors', 'rx_jabber_errors',
+    'rx_undersize_frame_errors', 'rx_oversize_frame_errors', 'rx_dropped_frames',
+    'rx_unicast_byte_count', 'rx_broadcast_byte_count', 'rx_multicast_byte_count',
+    'rx_unicast_frames', 'rx_broadcast_frames', 'rx_multicast_frames', 'rx_pause_frames',
+    'rx_64_byte_frames', 'rx_65_127_byte_frames', 'rx_128_255_byte_frames', 'rx_256_511_bytes_frames',
+    'rx_512_1023_byte_frames', 'rx_1024_1518_byte_frames', 'rx_greater_1518_byte_frames',
+    'eee_rx_lpi_transitions', 'eee_rx_lpi_time',
+    'tx_fcs_errors', 'tx_excess_deferral_errors', 'tx_carrier_errors', 'tx_bad_byte_count',
+    'tx_single_collisions', 'tx_multiple_collisions', 'tx_excessive_collision', 'tx_late_collisions',
+    'tx_unicast_byte_count', 'tx_broadcast_byte_count', 'tx_multicast_byte_count',
+    'tx_unicast_frames', 'tx_broadcast_frames', 'tx_multicast_frames', 'tx_pause_frames',
+    'tx_64_byte_frames', 'tx_65_127_byte_frames', 'tx_128_255_byte_frames', 'tx_256_511_bytes_frames',
+    'tx_512_1023_byte_frames', 'tx_1024_1518_byte_frames', 'tx_greater_1518_byte_frames',
+    'eee_tx_lpi_transitions', 'eee_tx_lpi_time',
+)
+STAT_INDEX = {name: i for i, name in enumerate(STAT_COUNTERS)}
+STATS_BLOCK = struct.Struct('<%dI' % len(STAT_COUNTERS))
+
+_WIDE_COUNTERS = {
+    'rx_unicast_byte_count', 'rx_broadcast_byte_count', 'rx_multicast_byte_count',
+    'eee_rx_lpi_transitions', 'eee_rx_lpi_time',
+    'tx_unicast_byte_count', 'tx_broadcast_byte_count', 'tx_multicast_byte_count',
+    'eee_tx_lpi_transitions', 'eee_tx_lpi_time',
+}
+# Largest value of every counter, before it wraps around to 0
+STAT_ROLLOVER = tuple(0xffffffff if name in _WIDE_COUNTERS else 0xfffff for name in STAT_COUNTERS)
+
+
+class StatsSample(NamedTuple):
+    # Time of the sample, from the monotonic clock of the device, in seconds
+    time: float
+    values: Tuple[int, ...]
+
+    def get(self, name: str) -> int:
+        return self.values[STAT_INDEX[name]]
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(zip(STAT_COUNTERS, self.values))
+
+
+def parse_stats_block(data: bytes, time: float) -> StatsSample:
+    if len(data) != STATS_BLOCK.size:
+        raise IOError(f"Statistics block is {len(data)} bytes instead of {STATS_BLOCK.size}")
+    return StatsSample(time, STATS_BLOCK.unpack(data))
+
+
+class StatsDelta(NamedTuple):
+    # Duration of the interval, in seconds
+    interval: float
+    values: Tuple[int, ...]
+
+    def get(self, name: str) -> int:
+        return self.values[STAT_INDEX[name]]
+
+    def rate(self, name: str) -> float:
+        """Returns the increase of counter `name` per second"""
+        return self.get(name) / self.interval if self.interval > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(zip(STAT_COUNTERS, self.values))
+
+
+def stats_delta(old: StatsSample, new: StatsSample) -> StatsDelta:
+    """Returns the increase of every counter from `old` to `new`, assuming
+    that no counter wrapped around more than once"""
+    return StatsDelta(new.time - old.time,
+                      tuple((n - o) & rollover for o, n, rollover in zip(old.values, new.values, STAT_ROLLOVER)))
+
+
+class StatsHistory:
+    """Ring buffer of the last `capacity` deltas of every counter, and their
+    totals since the first sample"""
+    def __init__(self, capacity: int = 3600) -> None:
+        self.capacity = capacity
+        self._deltas = [array('I', [0]) * capacity for _ in STAT_COUNTERS]
+        self._intervals = array('d', [0.0]) * capacity
+        self._next = 0
+        self._count = 0
+        self._last: Optional[StatsSample] = None
+        self._totals = [0] * len(STAT_COUNTERS)
+
+    def add(self, sample: StatsSample) -> Optional[StatsDelta]:
+        """Records `sample`, and returns the delta to the previous one, or
+        None for the first sample"""
+        last, self._last = self._last, sample
+        if last is None:
+            return None
+        delta = stats_delta(last, sample)
+        i = self._next
+        for buffer, value in zip(self._deltas, delta.values):
+            buffer[i] = value
+        for n, value in enumerate(delta.values):
+            self._totals[n] += value
+        self._intervals[i] = delta.interval
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        return delta
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _order(self) -> List[int]:
+        start = (self._next - self._count) % self.capacity
+        return [(start + i) % self.capacity for i in range(self._count)]
+
+    def deltas(self, name: str) -> List[int]:
+        """Returns the recorded deltas of counter `name`, oldest first"""
+        buffer = self._deltas[STAT_INDEX[name]]
+        return [buffer[i] for i in self._order()]
+
+    def intervals(self) -> List[float]:
+        return [self._intervals[i] for i in self._order()]
+
+    def rates(self, name: str) -> List[float]:
+        """Returns the recorded rates of counter `name` per second, oldest
+        first"""
+        return [d / t if t > 0 else 0.0 for d, t in zip(self.deltas(name), self.intervals())]
+
+    def totals(self) -> Dict[str, int]:
+        """Returns the increase of every counter since the first sample"""
+        return dict(zip(STAT_COUNTERS, self._totals))
@@ -0,0 +1,214 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Resident HydraLink daemon, controlled through a Unix domain socket.
+
+The daemon keeps the devices open in a `HydraLinkPool`, so a request only
+costs the register traffic it needs. The protocol is one JSON object per line in each
+direction. A request names a command and its arguments:
+
+    {"cmd": "setup", "device": "dscthl_00001", "master": true, "speed": 1000}
+
+and is answered with `{"ok": true, "result": ...}`, or with
+`{"ok": false, "error": "..."}`. `device` is a device specification as
+accepted by `HydraLink`, omitted for the first device. Commands:
+ - `list`: specifications of the connected devices
+ - `setup`: `HydraLink.setup`, with the arguments of `HydraLinkConfig` and
+   `incremental`, `wait_link` and `dry_run`. `devices` configures several
+   devices concurrently, the result is a list of per-device results.
+ - `status`: speed, master mode and link status
+ - `dump`: `read_snapshot` in JSON, with the PHY registers if `phy` is set
+ - `close`: closes the device, it is reopened by the next request
+
+A request connection can be kept open for any number of requests.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
+
+from hydralink.config import HydraLinkConfig
+from hydralink.dump import read_snapshot
+from hydralink.hydralink import HydraLink, list_hydralinks
+from hydralink.pool import HydraLinkPool, PoolKey
+
+
+def default_socket_path() -> str:
+    """`HYDRALINK_SOCKET`, or `hydralink.sock` in the runtime directory"""
+    path = os.environ.get('HYDRALINK_SOCKET')
+    if path:
+        return path
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), 'hydralink.sock')
+
+
+class DaemonError(Exception):
+    """Error reported by the daemon"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: '_Server'
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                result = self.server.daemon.handle(json.loads(line))
+                response = {'ok': True, 'result': result}
+            except Exception as x:
+                response = {'ok': False, 'error': '%s: %s' % (type(x).__name__, x)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: 'HydraLinkDaemon') -> None:
+        self.daemon = daemon
+        super().__init__(path, _Handler)
+
+
+class HydraLinkDaemon:
+    def __init__(self,
+                 path: Optional[str] = None,
+                 pool: Optional[HydraLinkPool] = None,
+                 lister: Callable[[], List[Union[int, str]]] = list_hydralinks) -> None:
+        """Creates the daemon, listening on `path` (`default_socket_path()`
+        if None). `pool` holds the open devices, `lister` lists the connected
+        devices."""
+        self.path = path or default_socket_path()
+        self.pool = pool if pool is not None else HydraLinkPool()
+        self.lister = lister
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            # A stale socket of a previous daemon, unless it still answers
+            try:
+                with socket.socket(socket.AF_UNIX) as s:
+                    s.connect(self.path)
+                raise OSError(f"A daemon is already listening on {self.path}")
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+        self._server = _Server(self.path, self)
+
+    def serve_forever(self) -> None:
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def shutdown(self) -> None:
+        """Stops `serve_forever`, from another thread"""
+        self._server.shutdown()
+
+    def _call(self, key: PoolKey, fn: Callable[[HydraLink], Any]) -> Any:
+        # Locked by location, as the pool, so that the requests naming the
+        # same device differently are serialized too
+        location = self.pool.locator(key)
+        with self._lock:
+            lock = self._locks.setdefault(location if location is not None else key, threading.Lock())
+        with lock:
+            hl = self.pool.get(key)
+            hl.verbose = False
+            try:
+                return fn(hl)
+            except (ValueError, TimeoutError):
+                raise
+            except Exception:
+                # The device may be in a bad state, open it again next time
+                self.pool.evict(key)
+                raise
+
+    def handle(self, request: Dict[str, Any]) -> Any:
+        cmd = request.get('cmd')
+        handler = getattr(self, '_cmd_%s' % cmd, None) if isinstance(cmd, str) else None
+        if handler is None:
+            raise ValueError(f"Unknown command {cmd!r}")
+        return handler(request)
+
+    def _cmd_list(self, request: Dict[str, Any]) -> Any:
+        return self.lister()
+
+    def _cmd_setup(self, request: Dict[str, Any]) -> Any:
+        config = HydraLinkConfig(**{k: request[k] for k in HydraLinkConfig._fields if k in request})
+        incremental = bool(request.get('incremental', False))
+        wait_link = bool(request.get('wait_link', False))
+        dry_run = bool(request.get('dry_run', False))
+
+        def setup(hl: HydraLink) -> Any:
+            if dry_run:
+                plan = hl.plan(config, incremental)
+                return {'changed': plan.changed, 'phy_reset': plan.phy_reset, 'transfers': plan.transfers,
+                        'plan': plan.describe()}
+            return hl.setup(**config._asdict(), incremental=incremental, wait_link=wait_link)._asdict()
+
+        if 'devices' not in request:
+            return self._call(request.get('device'), setup)
+
+        def setup_one(key: PoolKey) -> Dict[str, Any]:
+            try:
+                return {'device': key, 'ok': True, 'result': self._call(key, setup)}
+            except Exception as x:
+                return {'device': key, 'ok': False, 'error': '%s: %s' % (type(x).__name__, x)}
+
+        devices = request['devices']
+        with ThreadPoolExecutor(max_workers=max(len(devices), 1)) as executor:
+            return list(executor.map(setup_one, devices))
+
+    def _cmd_status(self, request: Dict[str, Any]) -> Any:
+        def status(hl: HydraLink) -> Dict[str, Any]:
+            phy_link, mac_enabled = hl.link_status()
+            return {'serial': hl.mac.dev.get_serial(),
+                    'speed': hl.phy.get_speed(),
+                    'master': hl.phy.get_master(),
+                    'phy_link': phy_link,
+                    'mac_enabled': mac_enabled}
+        return self._call(request.get('device'), status)
+
+    def _cmd_dump(self, request: Dict[str, Any]) -> Any:
+        phy = bool(request.get('phy', False))
+        return self._call(request.get('device'),
+                          lambda hl: read_snapshot(hl.mac, hl.phy.phy_addr if phy else None).to_json())
+
+    def _cmd_close(self, request: Dict[str, Any]) -> Any:
+        self.pool.evict(request.get('device'))
+        return None
+
+
+class DaemonClient:
+    """Connection to a `HydraLinkDaemon`"""
+    def __init__(self, path: Optional[str] = None, timeout: Optional[float] = 60.0) -> None:
+        self.path = path or default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX)
+        self._socket.settimeout(timeout)
+        self._socket.connect(self.path)
+        self._file = self._socket.makefile('rwb')
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> 'DaemonClient':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def request(self, cmd: str, **args: Any) -> Any:
+        """Sends a request and returns its result. Raises `DaemonError` if
+        the daemon reports an error."""
+        self._file.write(json.dumps({'cmd': cmd, **args}).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise DaemonError("Connection closed by the daemon")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise DaemonError(response.get('error'))
+        return response.get('result')
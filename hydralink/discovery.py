@@ -0,0 +1,325 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Index of the connected HydraLinks, built from sysfs.
+
+Looking a device up with `usb.core.find` opens every USB device on the host
+and, to match a serial number, reads its string descriptors. The kernel
+already exports all of that in sysfs: a `DiscoveryIndex` scans
+`/sys/bus/usb/devices` once, and afterwards only rescans the devices named
+by hotplug events. Events are read from an `EventSource`: `NetlinkEvents`
+receives the kernel uevents, `EventQueue` is fed by the caller, e.g. from
+a udev monitor or a test. Without an event source, listing the devices
+rescans sysfs, and a lookup rereads the attributes of the device it finds.
+When events were lost, e.g. because the socket buffer overflowed, or a
+lookup finds nothing, sysfs is scanned again.
+
+The index needs sysfs, so it is only used on Linux. `default_index()`
+returns None elsewhere, and the callers fall back to enumerating the bus.
+"""
+
+import os
+import re
+import socket
+import sys
+import threading
+from typing import Dict, List, NamedTuple, Optional, Protocol, Sequence, Tuple, Union
+
+SYSFS_USB_DEVICES = '/sys/bus/usb/devices'
+SYSFS_NET = '/sys/class/net'
+NETLINK_KOBJECT_UEVENT = 15
+
+# Name of a USB device in sysfs: bus, then the port path, e.g. 3-1.2
+_USB_DEVICE_NAME = re.compile(r'^(\d+)-(\d+(?:\.\d+)*)$')
+
+
+class DeviceInfo(NamedTuple):
+    # Name of the device in sysfs, e.g. 3-1.2
+    sysname: str
+    serial: Optional[str]
+    bus: int
+    address: int
+    port_numbers: Tuple[int, ...]
+    # Network interface and driver bound to the LAN7801, if any
+    netif: Optional[str]
+    driver: Optional[str]
+
+    @property
+    def name(self) -> str:
+        """Serial number, or bus and address if the device has none"""
+        return self.serial if self.serial is not None else '%d.%d' % (self.bus, self.address)
+
+
+class HotplugEvent(NamedTuple):
+    action: str
+    # Path of the device below /sys, e.g. /devices/pci0000:00/.../3-1.2
+    devpath: str
+    subsystem: Optional[str] = None
+
+
+# Action of the event returned by an event source which lost events
+EVENTS_LOST = 'lost'
+
+
+class EventSource(Protocol):
+    def poll(self) -> List[HotplugEvent]:
+        """Returns the events received since the last call, without waiting,
+        and an `EVENTS_LOST` event if some were dropped"""
+        ...
+
+
+class EventQueue:
+    """Event source fed by the caller"""
+    def __init__(self) -> None:
+        self._events: List[HotplugEvent] = []
+        self._lock = threading.Lock()
+
+    def push(self, action: str, devpath: str, subsystem: Optional[str] = None) -> None:
+        with self._lock:
+            self._events.append(HotplugEvent(action, devpath, subsystem))
+
+    def poll(self) -> List[HotplugEvent]:
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+
+def parse_uevent(data: bytes) -> Optional[HotplugEvent]:
+    """Parses a kernel uevent message, `action@devpath` followed by
+    NUL-separated `KEY=value` pairs"""
+    fields = data.split(b'\0')
+    if b'@' not in fields[0]:
+        return None
+    env = dict(f.decode(errors='replace').split('=', 1) for f in fields[1:] if b'=' in f)
+    action, devpath = fields[0].decode(errors='replace').split('@', 1)
+    return HotplugEvent(env.get('ACTION', action), env.get('DEVPATH', devpath), env.get('SUBSYSTEM'))
+
+
+class NetlinkEvents:
+    """Kernel uevents, received on a netlink socket. Throws `OSError` if the
+    socket cannot be opened, e.g. on other platforms than Linux."""
+    def __init__(self) -> None:
+        if not hasattr(socket, 'AF_NETLINK'):
+            raise OSError("Netlink is not available")
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            self._socket.bind((0, 1))
+            self._socket.setblocking(False)
+        except OSError:
+            self._socket.close()
+            raise
+
+    def poll(self) -> List[HotplugEvent]:
+        events: List[HotplugEvent] = []
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                return events
+            except OSError:
+                # ENOBUFS: the receive buffer overflowed, the events are lost
+                events.append(HotplugEvent(EVENTS_LOST, ''))
+                return events
+            event = parse_uevent(data)
+            if event is not None:
+                events.append(event)
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+def _read_attr(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def usb_device_name(devpath: str) -> Optional[str]:
+    """Returns the name of the USB device which `devpath` belongs to: the
+    device itself, one of its interfaces or a network interface below it"""
+    for part in reversed(devpath.rstrip('/').split('/')):
+        if _USB_DEVICE_NAME.match(part):
+            return part
+    return None
+
+
+def scan_device(root: str, sysname: str) -> Optional[DeviceInfo]:
+    """Reads the device `sysname` from the sysfs directory `root`. Returns
+    None if it is gone or is not a LAN7801."""
+    m = _USB_DEVICE_NAME.match(sysname)
+    path = os.path.join(root, sysname)
+    if not m or _read_attr(os.path.join(path, 'idVendor')) != '0424' or \
+            _read_attr(os.path.join(path, 'idProduct')) != '7801':
+        return None
+    busnum, devnum = _read_attr(os.path.join(path, 'busnum')), _read_attr(os.path.join(path, 'devnum'))
+    if busnum is None or devnum is None:
+        return None
+    interface = os.path.join(path, sysname + ':1.0')
+    try:
+        netifs = sorted(os.listdir(os.path.join(interface, 'net')))
+    except OSError:
+        netifs = []
+    driver = os.path.join(interface, 'driver')
+    return DeviceInfo(sysname=sysname,
+                      serial=_read_attr(os.path.join(path, 'serial')),
+                      bus=int(busnum),
+                      address=int(devnum),
+                      port_numbers=tuple(int(p) for p in m[2].split('.')),
+                      netif=netifs[0] if netifs else None,
+                      driver=os.path.basename(os.readlink(driver)) if os.path.islink(driver) else None)
+
+
+def usb_sysname(bus: int, port_numbers: Sequence[int]) -> str:
+    """Returns the sysfs name of the USB device at `port_numbers` of `bus`"""
+    return '%d-%s' % (bus, '.'.join(str(p) for p in port_numbers))
+
+
+def resolve_netif(name: str, net_root: str = SYSFS_NET) -> Optional[DeviceInfo]:
+    """Returns the LAN7801 behind the network interface `name`, found by
+    following its `device` link in `net_root`. None if there is no such
+    interface, or if it is not a LAN7801."""
+    try:
+        interface = os.path.realpath(os.path.join(net_root, name, 'device'), strict=True)
+    except OSError:
+        return None
+    path = os.path.dirname(interface)
+    info = scan_device(os.path.dirname(path), os.path.basename(path))
+    return None if info is None else info._replace(netif=name)
+
+
+class InterfaceMap(NamedTuple):
+    by_serial: Dict[str, DeviceInfo]
+    # By sysfs name of the USB device, e.g. 3-1.2
+    by_path: Dict[str, DeviceInfo]
+    by_netif: Dict[str, DeviceInfo]
+
+
+def interface_map(net_root: str = SYSFS_NET) -> InterfaceMap:
+    """Maps the serial numbers, USB paths and network interfaces of all
+    LAN7801 to each other, in one pass over `net_root`"""
+    result = InterfaceMap({}, {}, {})
+    for name in sorted(os.listdir(net_root)):
+        info = resolve_netif(name, net_root)
+        if info is None:
+            continue
+        if info.serial is not None:
+            result.by_serial[info.serial] = info
+        result.by_path[info.sysname] = info
+        result.by_netif[name] = info
+    return result
+
+
+def _sort_key(sysname: str) -> Tuple[int, ...]:
+    bus, ports = sysname.split('-', 1)
+    return (int(bus), *(int(p) for p in ports.split('.')))
+
+
+class DiscoveryIndex:
+    def __init__(self, root: str = SYSFS_USB_DEVICES, events: Optional[EventSource] = None) -> None:
+        """Creates the index of the devices in the sysfs directory `root`,
+        kept up to date with the events of `events`. The directory is
+        scanned on the first lookup."""
+        self.root = root
+        self.events = events
+        self.scans = 0
+        self._devices: Optional[Dict[str, DeviceInfo]] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Scans all devices again"""
+        with self._lock:
+            if self.events is not None:
+                self.events.poll()
+            self._scan_all()
+
+    def _scan_all(self) -> None:
+        devices = {}
+        for sysname in os.listdir(self.root):
+            info = scan_device(self.root, sysname)
+            if info is not None:
+                devices[sysname] = info
+        self._devices = devices
+        self.scans += 1
+
+    def _rescan(self, sysname: str) -> Optional[DeviceInfo]:
+        assert self._devices is not None
+        info = scan_device(self.root, sysname)
+        if info is None:
+            self._devices.pop(sysname, None)
+        else:
+            self._devices[sysname] = info
+        return info
+
+    def _update(self, full: bool) -> Dict[str, DeviceInfo]:
+        # Called with the lock held
+        if self._devices is None or (full and self.events is None):
+            if self.events is not None:
+                self.events.poll()
+            self._scan_all()
+        elif self.events is not None:
+            events = self.events.poll()
+            if any(event.action == EVENTS_LOST for event in events):
+                self._scan_all()
+            else:
+                for sysname in {usb_device_name(event.devpath) for event in events}:
+                    if sysname is not None:
+                        self._rescan(sysname)
+        assert self._devices is not None
+        return self._devices
+
+    def devices(self) -> List[DeviceInfo]:
+        """Returns the connected LAN7801, ordered by bus and port path"""
+        with self._lock:
+            devices = self._update(full=True)
+            return [devices[sysname] for sysname in sorted(devices, key=_sort_key)]
+
+    def find(self, spec: Union[None, int, str] = None) -> Optional[DeviceInfo]:
+        """Returns the device specified as for `get_lan7801_driver`: the
+        first one, the n-th one, or the one with the given serial number or
+        network interface name. None if it is not connected.
+
+        A device which is not in the index is looked for once more in a full
+        scan, in case its events were missed."""
+        if not isinstance(spec, str):
+            index = spec or 0
+            devices = self.devices()
+            if index >= len(devices) and self.events is not None:
+                self.refresh()
+                devices = self.devices()
+            return devices[index] if index < len(devices) else None
+        with self._lock:
+            for full in (False, True):
+                if full and self.events is not None:
+                    self._scan_all()
+                for info in list(self._update(full).values()):
+                    if spec not in (info.serial, info.netif):
+                        continue
+                    if self.events is not None:
+                        return info
+                    # Without events, the device may have been replugged
+                    current = self._rescan(info.sysname)
+                    if current is not None and spec in (current.serial, current.netif):
+                        return current
+        return None
+
+
+_default_index: Optional[DiscoveryIndex] = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> Optional[DiscoveryIndex]:
+    """Returns the index of the package, updated by kernel uevents if they
+    can be received. None if sysfs is not available."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None and sys.platform == 'linux' and os.path.isdir(SYSFS_USB_DEVICES):
+            events: Optional[EventSource]
+            try:
+                events = NetlinkEvents()
+            except OSError:
+                events = None
+            _default_index = DiscoveryIndex(SYSFS_USB_DEVICES, events)
+        return _default_index
@@ -0,0 +1,175 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Register snapshots of a HydraLink, their file formats and comparison.
+
+A snapshot holds the MAC register space and, optionally, the PHY registers
+listed in `PHY_REGISTER_RANGES`. Three file formats are supported, selected by
+the file extension:
+ - `.bin`: compact binary format, see `Snapshot.to_bytes`
+ - `.json`: JSON object with serial, timestamp and register values
+ - anything else: one `addr: value` line per register, in hexadecimal. PHY
+   registers are written as `devad.addr: value`.
+"""
+
+import json
+import struct
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from hydralink.lan7801 import LAN7801, OP_READ, RegisterOp
+
+MAC_REGISTER_SPACE = 0x1000
+
+# (MMD, first register, number of registers) of the PHY registers in a dump
+PHY_REGISTER_RANGES = [
+    (1, 0x0000, 0x0010),  # PMA/PMD
+    (1, 0x0834, 0x0003),  # BASE-T1 PMA/PMD control
+    (1, 0x0900, 0x0004),  # 1000BASE-T1 PMA/PMD
+    (1, 0x9300, 0x0020),  # vendor specific: LEDs
+    (1, 0xa000, 0x0030),  # vendor specific: RGMII and clock configuration
+    (3, 0x0000, 0x0010),  # PCS
+    (3, 0x0900, 0x0004),  # 1000BASE-T1 PCS
+    (7, 0x0000, 0x0010),  # auto-negotiation
+    (7, 0x0200, 0x0008),  # BASE-T1 auto-negotiation
+]
+
+_BIN_MAGIC = b'HLDUMP'
+# Version 2 appends the PHY registers
+_BIN_VERSION = 2
+# magic, version, timestamp, number of MAC registers, serial length
+_BIN_HEADER = struct.Struct('<6sHdHB')
+# MMD, register, value
+_BIN_PHY_REGISTER = struct.Struct('<BHH')
+
+
+class Snapshot(NamedTuple):
+    serial: Optional[str]
+    timestamp: float
+    # Value of the MAC registers, indexed by register address
+    mac: Dict[int, int]
+    # Value of the PHY registers, indexed by (MMD, register address)
+    phy: Dict[Tuple[int, int], int]
+
+    def to_bytes(self) -> bytes:
+        serial = (self.serial or '').encode()
+        if len(serial) > 0xff:
+            raise ValueError("Serial number too long")
+        addresses = sorted(self.mac)
+        if addresses != list(range(0, 4 * len(addresses), 4)):
+            raise ValueError("The binary format only supports contiguous MAC register dumps")
+        return (_BIN_HEADER.pack(_BIN_MAGIC, _BIN_VERSION, self.timestamp, len(addresses), len(serial))
+                + serial
+                + struct.pack(f'<{len(addresses)}I', *(self.mac[a] for a in addresses))
+                + struct.pack('<H', len(self.phy))
+                + b''.join(_BIN_PHY_REGISTER.pack(d, a, v) for (d, a), v in sorted(self.phy.items())))
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'Snapshot':
+        magic, version, timestamp, count, serial_len = _BIN_HEADER.unpack_from(data)
+        if magic != _BIN_MAGIC or version not in (1, _BIN_VERSION):
+            raise ValueError("Not a HydraLink binary dump")
+        offset = _BIN_HEADER.size
+        serial = data[offset:offset + serial_len].decode()
+        offset += serial_len
+        values = struct.unpack_from(f'<{count}I', data, offset)
+        offset += 4 * count
+        phy = {}
+        if version >= 2:
+            phy_count, = struct.unpack_from('<H', data, offset)
+            offset += 2
+            for i in range(phy_count):
+                devad, addr, value = _BIN_PHY_REGISTER.unpack_from(data, offset + i * _BIN_PHY_REGISTER.size)
+                phy[devad, addr] = value
+        return Snapshot(serial or None, timestamp, {4 * i: v for i, v in enumerate(values)}, phy)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'serial': self.serial,
+            'timestamp': self.timestamp,
+            'mac': {'%03x' % a: v for a, v in sorted(self.mac.items())},
+            'phy': {'%d.%04x' % k: v for k, v in sorted(self.phy.items())},
+        }, indent=1)
+
+    @staticmethod
+    def from_json(text: str) -> 'Snapshot':
+        obj = json.loads(text)
+        return Snapshot(obj.get('serial'), obj.get('timestamp', 0.0),
+                        {int(a, 16): v for a, v in obj['mac'].items()},
+                        {_parse_phy_key(k): v for k, v in obj.get('phy', {}).items()})
+
+    def to_text(self) -> str:
+        return (''.join("%03x: %08x\n" % (a, v) for a, v in sorted(self.mac.items()))
+                + ''.join("%d.%04x: %04x\n" % (d, a, v) for (d, a), v in sorted(self.phy.items())))
+
+    @staticmethod
+    def from_text(text: str) -> 'Snapshot':
+        mac = {}
+        phy = {}
+        for line in text.splitlines():
+            if line.strip():
+                a, v = line.split(':')
+                if '.' in a:
+                    phy[_parse_phy_key(a)] = int(v, 16)
+                else:
+                    mac[int(a, 16)] = int(v, 16)
+        return Snapshot(None, 0.0, mac, phy)
+
+
+def _parse_phy_key(key: str) -> Tuple[int, int]:
+    devad, addr = key.split('.')
+    return int(devad, 10), int(addr, 16)
+
+
+def read_snapshot(mac: LAN7801, phy_addr: Optional[int] = None) -> Snapshot:
+    """Reads the whole MAC register space in a single batch. The register
+    cache, if any, is bypassed. If `phy_addr` is given, the registers in
+    `PHY_REGISTER_RANGES` of that PHY are read as well."""
+    addresses = range(0, MAC_REGISTER_SPACE, 4)
+    values = mac.dev.execute([RegisterOp(OP_READ, a) for a in addresses])
+    phy = {}
+    if phy_addr is not None:
+        b = mac.batch()
+        idxs = {(devad, start): mac.queue_mdio_read_block_c45(b, phy_addr, devad, start, count)
+                for devad, start, count in PHY_REGISTER_RANGES}
+        results = b.execute()
+        for (devad, start), block in idxs.items():
+            for i, idx in enumerate(block):
+                phy[devad, start + i] = results[idx]
+    return Snapshot(mac.dev.get_serial(), time.time(), dict(zip(addresses, values)), phy)
+
+
+def save_snapshot(snapshot: Snapshot, path: str) -> None:
+    if path.endswith('.bin'):
+        with open(path, 'wb') as f:
+            f.write(snapshot.to_bytes())
+    else:
+        with open(path, 'w') as of:
+            of.write(snapshot.to_json() if path.endswith('.json') else snapshot.to_text())
+
+
+def load_snapshot(path: str) -> Snapshot:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(_BIN_MAGIC):
+        return Snapshot.from_bytes(data)
+    text = data.decode()
+    if text.lstrip().startswith('{'):
+        return Snapshot.from_json(text)
+    return Snapshot.from_text(text)
+
+
+def diff_snapshots(a: Snapshot, b: Snapshot) -> List[Tuple[int, Optional[int], Optional[int]]]:
+    """Returns `(address, value in a, value in b)` for every register which
+    differs. A value is None if the register is missing from a snapshot."""
+    return [(addr, a.mac.get(addr), b.mac.get(addr))
+            for addr in sorted(a.mac.keys() | b.mac.keys())
+            if a.mac.get(addr) != b.mac.get(addr)]
+
+
+def diff_phy_snapshots(a: Snapshot, b: Snapshot) -> List[Tuple[Tuple[int, int], Optional[int], Optional[int]]]:
+    """Like `diff_snapshots`, for the PHY registers"""
+    return [(key, a.phy.get(key), b.phy.get(key))
+            for key in sorted(a.phy.keys() | b.phy.keys())
+            if a.phy.get(key) != b.phy.get(key)]
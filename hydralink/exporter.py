@@ -0,0 +1,282 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Prometheus exporter for any number of HydraLinks.
+
+A `Sampler` reads every device in a background thread, at a fixed interval,
+and renders the metrics in the Prometheus text format. The HTTP server of
+the `Exporter` only returns the last rendering, so a scrape never waits for
+USB, and any number of scrapers can be served. The devices are kept open in
+a `HydraLinkPool` and are sampled concurrently.
+
+Per device, labelled with `device`:
+ - `hydralink_up`: whether the last sample succeeded
+ - `hydralink_speed_mbps`, `hydralink_master`: the configuration of the PHY
+ - `hydralink_promiscuous`: unicast frames are accepted to any address
+ - `hydralink_link_up`, `hydralink_phy_status`: see `hydralink.health`
+ - `hydralink_phy_pcs_errors_total`, `hydralink_mac_statistic_total`: error
+   and frame counters, counted since the exporter started; the MAC counters
+   start over when the device is reopened or reset
+ - `hydralink_transfer_duration_seconds`: latency histogram of the register
+   transfers, by category
+"""
+
+import http.server
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from hydralink.counters import StatsHistory, StatsSample
+from hydralink.health import HEALTH_FIELDS, read_health
+from hydralink.hydralink import HydraLink, list_hydralinks
+from hydralink.pool import HydraLinkPool, PoolKey
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = {
+    'hydralink_up': ('gauge', "Whether the last sample of the device succeeded"),
+    'hydralink_sample_timestamp_seconds': ('gauge', "Time of the last successful sample, in seconds since the epoch"),
+    'hydralink_sample_duration_seconds': ('gauge', "Duration of the last sample"),
+    'hydralink_speed_mbps': ('gauge', "Configured speed of the PHY, 0 if unknown"),
+    'hydralink_master': ('gauge', "Whether the PHY is configured as master"),
+    'hydralink_promiscuous': ('gauge', "Whether the MAC accepts unicast frames to any address"),
+    'hydralink_link_up': ('gauge', "Whether the PMA and the PCS have a link"),
+    'hydralink_phy_status': ('gauge', "Status bits of the PHY, by field"),
+    'hydralink_phy_pcs_errors_total': ('counter', "Errored blocks counted by the PCS"),
+    'hydralink_mac_statistic_total': ('counter', "Statistics counters of the MAC, by counter"),
+    'hydralink_transfer_duration_seconds': ('histogram', "Duration of the register transfers, by category"),
+}
+# The PHY status bits which are not reported as metrics of their own
+_STATUS_FIELDS = [name for name in HEALTH_FIELDS if name not in ('master', 'pcs_errors')]
+# RFE_CTL: accept all unicast frames
+_RFE_CTL_UCAST_EN = 0x0100
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """Parses `[HOST]:PORT`, an empty host listens on all interfaces"""
+    host, sep, port = text.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid address {text!r}, expected [HOST]:PORT")
+    return host, int(port)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(name: str, labels: Dict[str, str], value: float) -> str:
+    label_text = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+    return '%s{%s} %s' % (name, label_text, repr(value) if isinstance(value, float) else value)
+
+
+def render(samples: Sequence[Sample]) -> str:
+    """Renders `samples` in the Prometheus text format, grouped by metric"""
+    by_metric: Dict[str, List[str]] = {name: [] for name in METRICS}
+    for name, labels, value in samples:
+        family = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                family = name[:-len(suffix)]
+        by_metric[family].append(_format(name, labels, value))
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        if by_metric[name]:
+            lines += ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, kind)] + by_metric[name]
+    return ''.join(line + '\n' for line in lines)
+
+
+def _counters_reset(old: StatsSample, new: StatsSample) -> bool:
+    """Whether every counter which had counted went backwards, as when the
+    MAC is reset, rather than one of them wrapping around"""
+    counted = [(o, n) for o, n in zip(old.values, new.values) if o]
+    return bool(counted) and all(n < o for o, n in counted)
+
+
+class _DeviceState:
+    """Counters of a device since the exporter started"""
+    def __init__(self) -> None:
+        self.history = StatsHistory(capacity=1)
+        self.has_statistics = True
+        self.pcs_errors = 0
+        # The handle, and the last statistics sample, of `history`
+        self.hl: Optional[HydraLink] = None
+        self.last: Optional[StatsSample] = None
+
+    def add_statistics(self, hl: HydraLink, sample: StatsSample) -> None:
+        """Adds `sample`, read from `hl`. The totals start over when the
+        device was reopened, e.g. after a replug, or its counters were
+        reset, instead of counting the difference to the old counters."""
+        if hl is not self.hl or self.last is not None and _counters_reset(self.last, sample):
+            self.history = StatsHistory(capacity=1)
+        self.hl = hl
+        self.last = sample
+        self.history.add(sample)
+
+
+class Sampler:
+    def __init__(self,
+                 devices: Optional[Sequence[PoolKey]] = None,
+                 interval: float = 5.0,
+                 pool: Optional[HydraLinkPool] = None,
+                 lister: Callable[[], List[Union[int, str]]] = list_hydralinks) -> None:
+        """Samples the devices `devices`, or all devices listed by `lister`
+        if None, every `interval` seconds. `pool` holds the open devices."""
+        self.devices = devices
+        self.interval = interval
+        self.pool = pool if pool is not None else HydraLinkPool()
+        self.lister = lister
+        self.cycles = 0
+        self._states: Dict[str, _DeviceState] = {}
+        self._text = b''
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample_device(self, key: PoolKey) -> List[Sample]:
+        name = str(key)
+        device = {'device': name}
+        state = self._states.setdefault(name, _DeviceState())
+        t0 = time.perf_counter()
+        try:
+            hl = self.pool.get(key)
+            hl.verbose = False
+            samples = self._read(hl, device, state)
+        except Exception:
+            # Reopened by the next sample
+            self.pool.evict(key)
+            return [('hydralink_up', device, 0)]
+        return [('hydralink_up', device, 1),
+                ('hydralink_sample_timestamp_seconds', device, time.time()),
+                ('hydralink_sample_duration_seconds', device, time.perf_counter() - t0)] + samples
+
+    def _read(self, hl: HydraLink, device: Dict[str, str], state: _DeviceState) -> List[Sample]:
+        transfer_stats = hl.mac.dev.enable_stats()
+        health = read_health(hl.phy)
+        state.pcs_errors += health.pcs_errors
+        rfe_ctl = hl.mac[0x0b0]
+        samples: List[Sample] = [
+            ('hydralink_speed_mbps', device, hl.phy.get_speed() or 0),
+            # Read by `read_health` from the register of `get_master`
+            ('hydralink_master', device, int(health.master)),
+            ('hydralink_promiscuous', device, int(rfe_ctl & _RFE_CTL_UCAST_EN == _RFE_CTL_UCAST_EN)),
+            ('hydralink_link_up', device, int(health.link)),
+            ('hydralink_phy_pcs_errors_total', device, state.pcs_errors),
+        ]
+        samples += [('hydralink_phy_status', {**device, 'field': field}, int(getattr(health, field)))
+                    for field in _STATUS_FIELDS]
+        if state.has_statistics:
+            try:
+                state.add_statistics(hl, hl.mac.read_statistics())
+            except NotImplementedError:
+                # The backend has no access to the statistics block
+                state.has_statistics = False
+        if state.has_statistics:
+            samples += [('hydralink_mac_statistic_total', {**device, 'counter': counter}, total)
+                        for counter, total in state.history.totals().items()]
+        for category, stats in transfer_stats.snapshot().items():
+            labels = {**device, 'category': category}
+            cumulative = 0
+            for i, count in enumerate(stats.histogram[:-1]):
+                cumulative += count
+                samples.append(('hydralink_transfer_duration_seconds_bucket',
+                                {**labels, 'le': repr(2 ** i * 1e-6)}, cumulative))
+            samples += [('hydralink_transfer_duration_seconds_bucket', {**labels, 'le': '+Inf'}, stats.transfers),
+                        ('hydralink_transfer_duration_seconds_sum', labels, stats.total),
+                        ('hydralink_transfer_duration_seconds_count', labels, stats.transfers)]
+        return samples
+
+    def sample(self) -> None:
+        """Samples every device once, concurrently, and renders the metrics"""
+        keys = list(self.devices) if self.devices is not None else list(self.lister())
+        with ThreadPoolExecutor(max_workers=max(len(keys), 1)) as executor:
+            results = list(executor.map(self._sample_device, keys))
+        if self.devices is None:
+            # Unplugged devices start counting from 0 when they are back
+            listed = {str(key) for key in keys}
+            for name in [name for name in self._states if name not in listed]:
+                del self._states[name]
+            self.pool.sweep()
+        text = render([sample for samples in results for sample in samples]).encode()
+        with self._lock:
+            self._text = text
+            self.cycles += 1
+
+    def exposition(self) -> bytes:
+        """Returns the metrics of the last sample, without any USB access"""
+        with self._lock:
+            return self._text
+
+    def run(self) -> None:
+        """Samples until `stop` is called"""
+        while not self._stop.is_set():
+            t0 = time.monotonic()
+            self.sample()
+            self._stop.wait(max(self.interval - (time.monotonic() - t0), 0.0))
+
+    def start(self) -> None:
+        """Runs the sampler in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='hydralink-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server: '_Server'
+
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.sampler.exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], sampler: Sampler) -> None:
+        self.sampler = sampler
+        super().__init__(address, _Handler)
+
+
+class Exporter:
+    def __init__(self, address: Tuple[str, int], sampler: Optional[Sampler] = None) -> None:
+        """Creates the exporter, serving the metrics of `sampler` on
+        `http://address/metrics`"""
+        self.sampler = sampler if sampler is not None else Sampler()
+        self._server = _Server(address, self.sampler)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self._server.server_address[:2]
+        return str(host), int(port)
+
+    def serve_forever(self) -> None:
+        """Starts the sampler and serves the scrapes until `shutdown`"""
+        self.sampler.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.sampler.stop()
+
+    def shutdown(self) -> None:
+        """Stops `serve_forever`, from another thread"""
+        self._server.shutdown()
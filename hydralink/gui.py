@@ -2,12 +2,18 @@
 #  License, v. 2.0. If a copy of the MPL was not distributed with this
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from tkinter import ttk, messagebox
-import tkinter as tk
-from typing import Any, Dict, NamedTuple, Optional
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional, Union
 import hydralink.hydralink
+from hydralink.discovery import DeviceInfo, default_index
 from hydralink.hydralink import HydraLink
 
+# tkinter and the USB backend are imported on first use, so that the device
+# discovery can be used without them
+if TYPE_CHECKING:
+    from tkinter import ttk, messagebox
+    import tkinter as tk
+    import usb.core
+
 
 class FoundUsbDevice(NamedTuple):
     vid: int
@@ -18,41 +24,50 @@ class FoundUsbDevice(NamedTuple):
 
 
 if hydralink.hydralink.is_windows():
-    from hydralink.windows_apis import list_usb_devices
-    from hydralink.lan7801_win import LAN7801_Win
-
     def get_hydralinks() -> Dict[str, Any]:
+        from hydralink.windows_apis import list_usb_devices
         return {t.serialnum: t for t in list_usb_devices() if t.vid == 0x0424 and t.pid == 0x7801}
 
     def hydralink_by_serial(serial: str) -> Optional[HydraLink]:
+        from hydralink.lan7801_win import LAN7801_Win
         devices = get_hydralinks()
         if serial not in devices:
             return None
         key = devices[serial].software_key
         mac = LAN7801_Win.by_key(key)
         if mac:
+            mac.serial = serial
             return HydraLink(mac)
         return None
 
 else:
-    import usb.core
-    from hydralink.lan7801_libusb import LAN7801_LibUSB
-
     def get_hydralinks() -> Dict[str, Any]:
+        discovery = default_index()
+        if discovery is not None:
+            return {info.name: info for info in discovery.devices()}
+        import usb.core
         return {"%d.%d" % (dev.bus, dev.address) if dev.serial_number is None else dev.serial_number: dev
                 for dev in usb.core.find(find_all=True, idVendor=0x0424, idProduct=0x7801)}
 
     def hydralink_by_serial(serial: str) -> Optional[HydraLink]:
+        from hydralink.lan7801_libusb import LAN7801_LibUSB
         devices = get_hydralinks()
         if serial in devices:
-            dev: usb.core.Device = devices[serial]
+            dev: Union['usb.core.Device', DeviceInfo] = devices[serial]
             return HydraLink(LAN7801_LibUSB(dev))
         else:
             return None
 
 
+def _import_tkinter() -> None:
+    global tk, ttk, messagebox
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+
+
 class Gui:
     def __init__(self) -> None:
+        _import_tkinter()
         self.root = tk.Tk()
         self.root.title('HydraLink configuration')
         self.frm = ttk.Frame(self.root, padding=10)
@@ -115,7 +130,7 @@ class Gui:
             promiscuous = bool(self.promiscuous_var.get())
 
             try:
-                self.hl.setup(speed=speed, master=master, promiscuous=promiscuous)
+                self.hl.setup(speed=speed, master=master, promiscuous=promiscuous, incremental=True)
             except Exception as x:
                 messagebox.showerror("Error", str(x))
 
@@ -147,7 +162,7 @@ class Gui:
             self.master_var.set(1 if master else 0)
             self.promiscuous_var.set(1 if promiscuous else 0)
 
-    def change_device(self, o: tk.Event) -> object:  # type: ignore
+    def change_device(self, o: 'tk.Event') -> object:  # type: ignore
         try:
             found = hydralink_by_serial(self.device_var.get())
             self.hl = found
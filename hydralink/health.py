@@ -0,0 +1,187 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Link health of the BCM89881.
+
+`read_health` reads the link, receiver and fault status of the PHY in a
+single batch, grouped by MMD so that the MMD is addressed as rarely as
+possible. `HealthMonitor` samples any number of PHYs on one thread and
+reports changes, rather than every sample.
+
+The location of every status bit is listed in `HEALTH_FIELDS`. The link,
+auto-negotiation and master/slave bits are in the BASE-T1 registers of IEEE
+802.3 Clause 45, the receiver status and fault bits in the 1000BASE-T1 PMA
+and PCS status registers. The signal quality indicator is vendor specific
+and is only read if `sqi` is added to the fields.
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from hydralink.bcm89881 import BCM89881
+
+
+class Field(NamedTuple):
+    devad: int
+    register: int
+    shift: int = 0
+    width: int = 1
+
+    def extract(self, value: int) -> int:
+        return (value >> self.shift) & ((1 << self.width) - 1)
+
+
+HEALTH_FIELDS = {
+    # PMA/PMD and PCS status 1: receive link status, latching low
+    'pma_link': Field(1, 0x0001, 2),
+    'pcs_link': Field(3, 0x0001, 2),
+    # BASE-T1 PMA/PMD control: configured as master
+    'master': Field(1, 0x0834, 14),
+    # 1000BASE-T1 PMA status
+    'master_slave_fault': Field(1, 0x0901, 15),
+    'local_receiver': Field(1, 0x0901, 13),
+    'remote_receiver': Field(1, 0x0901, 12),
+    # 1000BASE-T1 PCS status 2
+    'block_lock': Field(3, 0x0902, 8),
+    'high_ber': Field(3, 0x0902, 9),
+    'pcs_errors': Field(3, 0x0902, 0, 8),
+    # BASE-T1 AN status
+    'an_complete': Field(7, 0x0201, 5),
+    'remote_fault': Field(7, 0x0201, 4),
+}
+# Fields which are numbers rather than flags
+_COUNTERS = {'pcs_errors', 'sqi'}
+
+
+class PhyHealth(NamedTuple):
+    """Status of the PHY, fields which are not read are False"""
+    # Time of the sample, from the monotonic clock of the device, in seconds
+    time: float
+    pma_link: bool = False
+    pcs_link: bool = False
+    master: bool = False
+    master_slave_fault: bool = False
+    local_receiver: bool = False
+    remote_receiver: bool = False
+    block_lock: bool = False
+    high_ber: bool = False
+    # Errored blocks since the previous read
+    pcs_errors: int = 0
+    an_complete: bool = False
+    remote_fault: bool = False
+    # Signal quality indicator, None if not read
+    sqi: Optional[int] = None
+
+    @property
+    def link(self) -> bool:
+        return self.pma_link and self.pcs_link
+
+
+def read_health(phy: BCM89881, fields: Dict[str, Field] = HEALTH_FIELDS) -> PhyHealth:
+    """Reads the registers of `fields` in a single batch. Registers in the
+    cache of `phy`, such as the master/slave configuration, are not read."""
+    keys = sorted({(f.devad, f.register) for f in fields.values()})
+    registers = {key: phy.cached(key) for key in keys}
+    b = phy.mac.batch()
+    idxs = {key: phy.queue_read(b, *key) for key, value in registers.items() if value is None}
+    results = b.execute()
+    for key, idx in idxs.items():
+        registers[key] = results[idx]
+        phy.assume(key, results[idx])
+    values: Dict[str, Any] = {}
+    for name, f in fields.items():
+        value = f.extract(registers[f.devad, f.register] or 0)
+        values[name] = value if name in _COUNTERS else bool(value)
+    return PhyHealth(phy.mac.dev.monotonic(), **values)
+
+
+class HealthEvent(NamedTuple):
+    """Change of `field` of the PHY `device`"""
+    device: str
+    time: float
+    field: str
+    old: Optional[int]
+    new: int
+
+
+class HealthMonitor:
+    def __init__(self,
+                 phys: Dict[str, BCM89881],
+                 interval: float = 1.0,
+                 down_interval: Optional[float] = None,
+                 fields: Dict[str, Field] = HEALTH_FIELDS,
+                 on_event: Optional[Callable[[HealthEvent], None]] = None) -> None:
+        """Monitors the PHYs `phys`, keyed by a name which is reported in
+        the events.
+
+        Parameters
+        ----------
+        interval : float
+            time between two samples of every PHY, in seconds.
+        down_interval : float
+            optional, time between two samples while any PHY has no link,
+            to report its recovery quickly. By default, `interval`.
+        fields : dict
+            the status bits to read, see `HEALTH_FIELDS`.
+        on_event : callable
+            called with every `HealthEvent` by the monitor thread.
+        """
+        self.phys = phys
+        self.interval = interval
+        self.down_interval = interval if down_interval is None else down_interval
+        self.fields = fields
+        self.on_event = on_event
+        self.last: Dict[str, PhyHealth] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll(self) -> List[HealthEvent]:
+        """Samples every PHY once and returns the changes. The first sample
+        of a PHY reports every field, with `old` set to None. A PHY which
+        cannot be read is skipped, and reported as `error` once."""
+        events = []
+        for name, phy in self.phys.items():
+            try:
+                health = read_health(phy, self.fields)
+            except (IOError, TimeoutError):
+                if self.last.pop(name, None) is not None:
+                    events.append(HealthEvent(name, phy.mac.dev.monotonic(), 'error', None, 1))
+                continue
+            self.samples += 1
+            previous = self.last.get(name)
+            for field, value in health._asdict().items():
+                if field == 'time' or value is None:
+                    continue
+                old = None if previous is None else getattr(previous, field)
+                # The error counter is reported whenever it counts errors
+                if old != value or (field == 'pcs_errors' and value):
+                    events.append(HealthEvent(name, health.time, field, None if old is None else int(old), int(value)))
+            self.last[name] = health
+        return events
+
+    def _next_interval(self) -> float:
+        if any(not health.link for health in self.last.values()) or len(self.last) < len(self.phys):
+            return self.down_interval
+        return self.interval
+
+    def run(self) -> None:
+        """Samples until `stop` is called, passing the events to `on_event`"""
+        while not self._stop.is_set():
+            for event in self.poll():
+                if self.on_event is not None:
+                    self.on_event(event)
+            self._stop.wait(self._next_interval())
+
+    def start(self) -> None:
+        """Runs the monitor in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='hydralink-health', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -2,14 +2,34 @@
 #  License, v. 2.0. If a copy of the MPL was not distributed with this
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import struct
 import sys
 
-import time
-from typing import Union, Optional
+from typing import List, NamedTuple, Optional, Tuple, Union
 
-from hydralink.lan7801 import LAN7801, LAN7801_LL
+from hydralink.lan7801 import LAN7801, LAN7801_LL, MIN_POLL_INTERVAL, OP_WRITE, PollPolicy
 from hydralink.bcm89881 import BCM89881
+from hydralink.config import LINK_STATUS_REGISTERS, HydraLinkConfig, Plan, plan_config, queue_plan, read_state
+from hydralink.profile import BootProfile, read_boot_profile
+
+
+# Link training takes tens to hundreds of milliseconds, depending on the
+# speed and on the link partner
+LINK_POLL = PollPolicy(0.0, 2.0, 0.01)
+
+
+class SetupReport(NamedTuple):
+    """Result of `HydraLink.setup()`.
+
+    `changed` lists the names of the `hydralink.config.SETTINGS` which were
+    applied:
+    `release` means the PHY had to be released from reset, `init` that the
+    clock, RGMII and LED registers were written.
+    """
+    changed: Tuple[str, ...]
+    # Whether the PHY was reset, dropping the link
+    phy_reset: bool
+    # Seconds from the end of the setup until the link was up, if waited for
+    time_to_link: Optional[float] = None
 
 
 def is_windows() -> bool:
@@ -45,10 +65,33 @@ def get_lan7801_driver(spec: Union[None, int, str] = None) -> LAN7801_LL:
         return LAN7801_LibUSB(spec)
 
 
+def list_hydralinks() -> List[Union[int, str]]:
+    """Returns a specification, for `get_lan7801_driver`, of every connected
+    LAN7801: its USB serial number, or its index if it has none."""
+    if is_windows():
+        from hydralink.windows_apis import list_usb_devices
+        return [t.serialnum for t in list_usb_devices() if t.vid == 0x0424 and t.pid == 0x7801]
+    from hydralink.discovery import default_index
+    discovery = default_index()
+    if discovery is not None:
+        return [i if info.serial is None else info.serial for i, info in enumerate(discovery.devices())]
+    import usb.core
+    specs: List[Union[int, str]] = []
+    for i, dev in enumerate(usb.core.find(find_all=True, idVendor=0x0424, idProduct=0x7801)):
+        try:
+            serial = dev.serial_number
+        except (ValueError, usb.core.USBError):
+            serial = None
+        specs.append(i if serial is None else serial)
+    return specs
+
+
 class HydraLink:
     """A class used to configure a dissecto HydraLink"""
     def __init__(self,
-                 spec: Union[None, int, str, LAN7801_LL] = None
+                 spec: Union[None, int, str, LAN7801_LL] = None,
+                 cache: bool = False,
+                 track_mmd: bool = False
                  ) -> None:
         """Initializes the HydraLink configuration class.
 
@@ -56,6 +99,12 @@ class HydraLink:
         handle to be used as an argument to indicate a specific device if
         multiple LAN7801 are connected.
 
+        If `cache` is True, the configuration registers of the MAC and of the
+        PHY are cached in memory, so read-modify-write operations only need to
+        write to the device. This is only safe as long as nobody else
+        reconfigures the device. `track_mmd` is passed on to `LAN7801`, and
+        has the same condition.
+
         If the product identifiers of the MAC or the PHY are unexpected, this
         constructor will throw `IOError`.
         If the specified device is not found, `FileNotFoundError` is thrown.
@@ -64,7 +113,7 @@ class HydraLink:
             ll = spec
         else:
             ll = get_lan7801_driver(spec)
-        self.mac = LAN7801(ll)
+        self.mac = LAN7801(ll, cache=cache, track_mmd=track_mmd)
         self.verbose = True
 
         # Read MAC register
@@ -73,7 +122,7 @@ class HydraLink:
             raise IOError(f"Wrong MAC identifier: 0x{identifier:x}")
 
         # Access clause 45 registers
-        self.phy = BCM89881(self.mac, 0)
+        self.phy = BCM89881(self.mac, 0, cache=cache)
         identifier = self.phy[1, 2]
         if identifier != 0xae02:
             raise IOError(f"Wrong PHY identifier: 0x{identifier:x}")
@@ -82,8 +131,10 @@ class HydraLink:
               master: Optional[bool] = None,
               speed: Optional[int] = None,
               mac_addr: Optional[str] = None,
-              promiscuous: Optional[bool] = None
-              ) -> None:
+              promiscuous: Optional[bool] = None,
+              incremental: bool = False,
+              wait_link: bool = False
+              ) -> SetupReport:
         """All-in-one function to setup the HydraLink.
 
         Parameters
@@ -100,85 +151,98 @@ class HydraLink:
         promiscuous : bool
             optional, set to True to enable promiscuous mode (for example, to
             be able to sniff all packets on wireshark).
+        incremental : bool
+            optional, read the current configuration first and only apply
+            what differs. The PHY is only reset, dropping the link, if one of
+            its settings changes.
+        wait_link : bool
+            optional, wait for the link to come up, see `wait_for_link`.
+
+        Returns a `SetupReport` of the settings which were applied.
         """
-        mac = self.mac
-        phy = self.phy
-
-        # Stop operation
-        phy.reset(True)
-
-        # Enable clocks
-        mac[0x010] |= 0x02000000
-        mac[0x128] = 0x00000002
-        # MAC-PHY RGMII clock delay setup
-        phy[1, 0xa010] = 0x0001
-        phy[1, 0xa015] = 0x0000
-        # PHY LEDs setup
-        phy[1, 0xa027] = 0x0f15
-        phy[1, 0x931d] = 0x0010
-        phy[1, 0x931e] = 0x0063
-
-        if promiscuous is not None:
-            if promiscuous:
-                mac[0x0b0] = 0x1f80
-                if self.verbose:
-                    print("Enabled promiscuous mode")
-            else:
-                mac[0x0b0] = 0x1c8a
-                if self.verbose:
-                    print("Disabled promiscuous mode")
-
-        if mac_addr is not None:
-            mac_addr_bytes = b''
-            for b in mac_addr.split(':'):
-                bb = bytes.fromhex(b)
-                if len(bb) != 1:
-                    raise ValueError("Malformed MAC address")
-                mac_addr_bytes += bb
-            if len(mac_addr_bytes) != 6:
-                raise ValueError("Malformed MAC address")
-            hi, lo = struct.unpack(">HI", mac_addr_bytes)
-            mac[0x118] = hi
-            mac[0x11c] = lo
-
-        if speed is not None:
-            # Unlock registers by disabling TXEN and TXEN
-            mac[0x104] = (mac[0x104] | 2) & 0xfffffffe
-            mac[0x108] = (mac[0x108] | 2) & 0xfffffffe
-            while mac[0x104] & 1:
-                time.sleep(.001)
-            while mac[0x108] & 1:
-                time.sleep(.001)
-            mac[0x104] |= 2
-            mac[0x108] |= 2
-
-            # Disable Automatic Speed Detection
-            mac.set_ads(False)
-            if speed == 1000:
-                mac.set_speed(2)
-                phy.set_speed(1000)
-                if self.verbose:
-                    print("Set hydralink speed to 1 Gb/s")
-            elif speed == 100:
-                mac.set_speed(1)
-                phy.set_speed(100)
-                if self.verbose:
-                    print("Set hydralink speed to 100 Mb/s")
-            else:
-                raise ValueError("Speed should be either 100 or 1000")
-
-            # Lock registers by enabling TXEN and TXEN
-            mac[0x104] |= 1
-            mac[0x108] |= 1
-            while not mac[0x104] & 1:
-                time.sleep(.001)
-            while not mac[0x108] & 1:
-                time.sleep(.001)
-
-        if master is not None:
-            phy.set_master(master)
-            if self.verbose:
-                print("Set hydralink to operate as %s" % ("master" if master else "slave"))
-
-        # Resume operation
-        phy.reset(False)
+        config = HydraLinkConfig(master, speed, mac_addr, promiscuous)
+        if speed not in (None, 100, 1000):
+            raise ValueError("Speed should be either 100 or 1000")
+        return self.apply(self.plan(config, incremental), wait_link)
+
+    def plan(self, config: HydraLinkConfig, incremental: bool = False) -> Plan:
+        """Reads the current configuration and compiles the plan which
+        `apply` executes to reach `config`, see `hydralink.config`. The plan
+        can be inspected, e.g. with `Plan.describe`, before it is applied.
+        It is only valid as long as nobody else reconfigures the device.
+
+        The current configuration is read from the device, or from the
+        cache; nothing is written, and the cache is left as it was."""
+        plan = plan_config(config, read_state(self.mac, self.phy, config, incremental), incremental)
+        with self.phy.preview() as b:
+            queue_plan(b, self.phy, plan)
+            return plan._replace(transfers=len(b))
+
+    def apply(self, plan: Plan, wait_link: bool = False) -> SetupReport:
+        """Executes `plan` in a single batch, and optionally waits for the
+        link to come up"""
+        b = self.mac.batch()
+        queue_plan(b, self.phy, plan)
+        b.execute()
+        for step in plan.steps:
+            if step.kind == OP_WRITE and step.devad is not None:
+                self.phy.assume((step.devad, step.address), step.value)
+
+        config = plan.config
+        if self.verbose:
+            if 'promiscuous' in plan.changed:
+                print("Enabled promiscuous mode" if config.promiscuous else "Disabled promiscuous mode")
+            if 'mac_speed' in plan.changed or 'phy_speed' in plan.changed:
+                print("Set hydralink speed to %s" % ("1 Gb/s" if config.speed == 1000 else "100 Mb/s"))
+            if 'master' in plan.changed:
+                print("Set hydralink to operate as %s" % ("master" if config.master else "slave"))
+        time_to_link = self.wait_for_link() if wait_link else None
+        return SetupReport(plan.changed, plan.phy_reset, time_to_link)
+
+    def link_status(self) -> Tuple[bool, bool]:
+        """Returns whether the PHY has a link, and whether the MAC receiver and
+        transmitter are enabled, read in a single batch.
+
+        The receive link status bits of the PMA/PMD and of the PCS latch low,
+        so the PHY only reports a link if it did not drop since the
+        previous read."""
+        b = self.mac.batch()
+        idxs = [self.phy.queue_read(b, *key) for key in LINK_STATUS_REGISTERS]
+        rx = b.read(0x104)
+        tx = b.read(0x108)
+        results = b.execute()
+        phy_up = all(results[idx] & 0x0004 for idx in idxs)
+        return phy_up, bool(results[rx] & results[tx] & 1)
+
+    def wait_for_link(self, timeout: float = LINK_POLL.timeout) -> float:
+        """Waits until the link is usable: the PHY has a link and the MAC
+        receiver and transmitter are enabled. `link_status` is polled with
+        the backoff of `LINK_POLL`, so the PMA/PMD and PCS status are read
+        together and both latches are cleared by the first poll.
+
+        Returns the time waited, in seconds. Raises `TimeoutError` if the link
+        is not up after `timeout` seconds."""
+        dev = self.mac.dev
+        start = dev.monotonic()
+        deadline = start + timeout
+        interval = max(LINK_POLL.expected / 4, MIN_POLL_INTERVAL)
+        if LINK_POLL.expected:
+            dev.sleep(LINK_POLL.expected)
+        while True:
+            phy_up, mac_up = self.link_status()
+            if phy_up and mac_up:
+                return dev.monotonic() - start
+            now = dev.monotonic()
+            if now >= deadline:
+                raise TimeoutError("Link not up after %.1f s: %s" % (
+                    timeout, "MAC receiver/transmitter disabled" if phy_up else "no PHY link"))
+            dev.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, LINK_POLL.max_interval)
+
+    def setup_from_boot_profile(self) -> Optional[BootProfile]:
+        """Applies the boot profile stored in the EEPROM with `setup()`.
+        Returns the profile, or None if the EEPROM holds none."""
+        profile = read_boot_profile(self.mac)
+        if profile is not None:
+            self.setup(**profile._asdict())
+        return profile
@@ -2,7 +2,88 @@
 #  License, v. 2.0. If a copy of the MPL was not distributed with this
 #  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from hydralink.counters import StatsSample, parse_stats_block
+from hydralink.stats import CAT_EEPROM, CAT_MDIO_C22, CAT_MDIO_C45, CAT_POLL, CAT_REG_READ, TransferStats
+
+OP_READ = 0
+OP_WRITE = 1
+OP_MODIFY = 2
+OP_POLL = 3
+
+
+class PollPolicy(NamedTuple):
+    """How to wait for a busy flag to clear.
+
+    The first read is delayed by `expected`, the typical duration of the
+    operation. If the flag is still set, it is polled again at intervals
+    starting from a quarter of `expected` (at least `MIN_POLL_INTERVAL`) and
+    doubling up to `max_interval`. After `timeout` seconds `TimeoutError` is
+    raised.
+    """
+    expected: float
+    timeout: float
+    max_interval: float = 0.005
+
+
+MIN_POLL_INTERVAL = 50e-6
+
+# An MDIO frame takes ~30 µs at 2.5 MHz, less than a USB round trip
+MDIO_POLL = PollPolicy(0.0, 0.1)
+# Reads and write enable/disable commands complete within microseconds
+EEPROM_POLL = PollPolicy(0.0, 0.1)
+# Programming cycle of a Microwire EEPROM, a few milliseconds
+EEPROM_WRITE_POLL = PollPolicy(0.003, 0.1, 0.001)
+# Stopping RX/TX waits for the frame in flight, 1 Gb/s jumbo frames take ~80 µs
+TXRX_POLL = PollPolicy(0.0, 0.5, 0.001)
+DEFAULT_POLL = PollPolicy(0.0, 1.0)
+
+# Functions of the MMD access control register (Clause 22 register 0xd)
+MMD_ADDRESS = 0x0000
+MMD_DATA = 0x4000
+MMD_DATA_INC = 0x8000
+MMD_DATA_INC_WRITE = 0xc000
+
+# Size of the EEPROM addressable through E2P_CMD
+EEPROM_SIZE = 512
+
+
+class RegisterOp(NamedTuple):
+    """A single step of a `RegisterBatch`.
+
+    For `OP_MODIFY`, `value` is the mask of bits to set and `mask` the mask of
+    bits to clear. For `OP_POLL`, the register is read until
+    `(reg & mask) == value`.
+
+    `category` is the `hydralink.stats` category of the transaction the
+    operation belongs to, `CAT_REG_READ` for plain register accesses.
+    `policy` is the `PollPolicy` of polls, `DEFAULT_POLL` if None.
+    """
+    kind: int
+    address: int
+    value: int = 0
+    mask: int = 0
+    category: int = CAT_REG_READ
+    policy: Optional[PollPolicy] = None
+
+
 class LAN7801_LL:
+    # Transfer statistics, recorded by the backends when enabled
+    stats: Optional[TransferStats] = None
+    # Category of the transfers being issued; backends record plain writes
+    # as CAT_REG_WRITE
+    _category = CAT_REG_READ
+    # Number of wait_reg calls and of the reads they issued
+    polls = 0
+    poll_iterations = 0
+
+    def enable_stats(self) -> TransferStats:
+        if self.stats is None:
+            self.stats = TransferStats()
+        return self.stats
 
     def write_reg(self, address: int, value: int) -> None:
         raise NotImplementedError()
@@ -10,86 +91,435 @@ class LAN7801_LL:
     def read_reg(self, address: int) -> int:
         raise NotImplementedError()
 
+    def get_serial(self) -> Optional[str]:
+        """Returns the USB serial number of the device, if known"""
+        return None
+
+    def read_stats_block(self) -> bytes:
+        """Returns the statistics counter block, see `hydralink.counters`"""
+        raise NotImplementedError()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def wait_reg(self, address: int, mask: int, value: int, policy: PollPolicy = DEFAULT_POLL) -> int:
+        """Reads `address` until `(reg & mask) == value`, following `policy`,
+        and returns the last value read"""
+        self.polls += 1
+        deadline = self.monotonic() + policy.timeout
+        if policy.expected > 0:
+            self.sleep(policy.expected)
+        interval = max(policy.expected / 4, MIN_POLL_INTERVAL)
+        while True:
+            self.poll_iterations += 1
+            reg = self.read_reg(address)
+            if (reg & mask) == value:
+                return reg
+            now = self.monotonic()
+            if now >= deadline:
+                raise TimeoutError(f"Register 0x{address:03x} is 0x{reg:08x} after {policy.timeout} s, "
+                                   f"waited for 0x{value:x} in 0x{mask:x}")
+            self.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, policy.max_interval)
+
+    def execute(self, ops: Sequence[RegisterOp]) -> List[int]:
+        """Executes a sequence of register operations and returns one result
+        per operation: the value read for reads and polls, the value written
+        for writes and read-modify-writes.
+
+        This implementation issues the operations one at a time. Backends
+        which can pipeline control transfers should override it.
+        """
+        results: List[int] = []
+        try:
+            for op in ops:
+                self._category = op.category
+                if op.kind == OP_READ:
+                    value = self.read_reg(op.address)
+                elif op.kind == OP_WRITE:
+                    value = op.value
+                    self.write_reg(op.address, value)
+                elif op.kind == OP_MODIFY:
+                    value = (self.read_reg(op.address) & ~op.mask) | op.value
+                    self.write_reg(op.address, value)
+                elif op.kind == OP_POLL:
+                    self._category = CAT_POLL
+                    value = self.wait_reg(op.address, op.mask, op.value, op.policy or DEFAULT_POLL)
+                else:
+                    raise ValueError(f"Unknown register operation {op.kind}")
+                results.append(value)
+        finally:
+            self._category = CAT_REG_READ
+        return results
+
+
+class RegisterBatch:
+    """Collects register operations to be executed as a single unit.
+
+    Every queuing method returns the index of its result in the list returned
+    by `execute`.
+    """
+    def __init__(self, execute: Callable[[Sequence[RegisterOp]], List[int]]) -> None:
+        self._execute = execute
+        self.ops: List[RegisterOp] = []
+        self.category = CAT_REG_READ
+        # Polls known to be satisfied: address -> (mask, value, result index)
+        self._settled: Dict[int, Tuple[int, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    @contextmanager
+    def transaction(self, category: int) -> Iterator[None]:
+        """Attributes the operations queued inside the context to `category`,
+        unless they are already part of an enclosing transaction"""
+        outer = self.category
+        if outer == CAT_REG_READ:
+            self.category = category
+        try:
+            yield
+        finally:
+            self.category = outer
+
+    def _append(self, op: RegisterOp) -> int:
+        if op.kind != OP_READ:
+            self._settled.pop(op.address, None)
+        self.ops.append(op)
+        return len(self.ops) - 1
+
+    def read(self, address: int) -> int:
+        return self._append(RegisterOp(OP_READ, address, category=self.category))
+
+    def write(self, address: int, value: int) -> int:
+        return self._append(RegisterOp(OP_WRITE, address, value, category=self.category))
+
+    def modify(self, address: int, set: int = 0, clr: int = 0) -> int:
+        if set & 0xffffffff != set:
+            raise ValueError("set mask must be a 32-bit unsigned integer")
+        if clr & 0xffffffff != clr:
+            raise ValueError("clr mask must be a 32-bit unsigned integer")
+        return self._append(RegisterOp(OP_MODIFY, address, set, clr, self.category))
+
+    def poll(self, address: int, mask: int, value: int = 0, policy: Optional[PollPolicy] = None) -> int:
+        """Waits until `(reg & mask) == value`, see `LAN7801_LL.wait_reg`.
+
+        Busy flags only get set by writing the register, so a poll which
+        repeats the previous poll of the same register, with no write to it in
+        between, is already satisfied and is not queued again.
+        """
+        if value & mask != value:
+            raise ValueError("Polled value must be contained in the mask")
+        settled = self._settled.get(address)
+        if settled is not None and settled[:2] == (mask, value):
+            return settled[2]
+        idx = self._append(RegisterOp(OP_POLL, address, value, mask, self.category, policy))
+        self._settled[address] = (mask, value, idx)
+        return idx
+
+    def execute(self) -> List[int]:
+        return self._execute(self.ops)
+
 
 class LAN7801:
-    def __init__(self, dev: LAN7801_LL) -> None:
+    # Registers whose content can change without being written by the host:
+    # interrupt and power management status, EEPROM and MII engines, data
+    # port, FIFO controllers and the RXEN/TXEN status bits of MAC_RX/MAC_TX.
+    VOLATILE_REGISTERS = frozenset([0x00c, 0x014, 0x024, 0x028, 0x040, 0x044, 0x0c0, 0x0c4,
+                                    0x104, 0x108, 0x120, 0x124])
+    # Bits which clear themselves once the requested action is complete
+    SELF_CLEARING_BITS = {0x010: 0x00000003}
+
+    def __init__(self, dev: LAN7801_LL, cache: bool = False, track_mmd: bool = False) -> None:
+        """Wraps a `LAN7801_LL` register transport.
+
+        If `cache` is True, the values of non-volatile registers are kept in a
+        write-through shadow copy and reads of those registers are served
+        from memory. `invalidate` or `refresh` must be called if the device
+        is reconfigured by someone else.
+
+        If `track_mmd` is True, the register each PHY's MMD access registers
+        (0xd/0xe) point to is remembered, and Clause 45 accesses only
+        re-address the MMD when needed. Data accesses post-increment the
+        address on writes, so registers written in ascending order need no
+        re-addressing either. This requires batches to be executed in the
+        order they are created, and nobody else to access the MMD registers:
+        neither the lan78xx driver, which accesses them on probe and on link
+        changes, nor another process or handle. It is off by default; block
+        accesses are addressed once either way.
+        """
         self.dev = dev
-        self.write_reg = dev.write_reg
-        self.read_reg = dev.read_reg
+        self._shadow: Optional[Dict[int, int]] = {} if cache else None
+        self.track_mmd = track_mmd
+        # PHY address -> (devad, function, address of the next data access)
+        self._mmd: Dict[int, Tuple[int, int, int]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-    def read_mdio_reg(self, phy_addr: int, miirinda: int) -> int:
+    @property
+    def cache_enabled(self) -> bool:
+        return self._shadow is not None
+
+    def invalidate(self, address: Optional[int] = None) -> None:
+        """Drops one register, or the whole shadow copy, from the cache.
+        Invalidating everything also forgets the state of the MMD access
+        registers."""
+        if address is None:
+            self._mmd.clear()
+        if self._shadow is not None:
+            if address is None:
+                self._shadow.clear()
+            else:
+                self._shadow.pop(address, None)
+
+    def refresh(self) -> None:
+        """Re-reads every cached register from the device"""
+        if not self._shadow:
+            return
+        addresses = list(self._shadow)
+        values = self.dev.execute([RegisterOp(OP_READ, a) for a in addresses])
+        self._shadow.update(zip(addresses, values))
+
+    def _cacheable(self, address: int) -> bool:
+        return address not in self.VOLATILE_REGISTERS
+
+    def _store(self, shadow: Dict[int, int], address: int, value: int) -> None:
+        if value & self.SELF_CLEARING_BITS.get(address, 0):
+            shadow.pop(address, None)
+        else:
+            shadow[address] = value
+
+    def read_reg(self, address: int) -> int:
+        shadow = self._shadow
+        if shadow is None or not self._cacheable(address):
+            return self.dev.read_reg(address)
+        if address in shadow:
+            self.cache_hits += 1
+            return shadow[address]
+        self.cache_misses += 1
+        value = self.dev.read_reg(address)
+        shadow[address] = value
+        return value
+
+    def write_reg(self, address: int, value: int) -> None:
+        shadow = self._shadow
+        if shadow is not None:
+            # Whatever happens, the old value is not valid anymore
+            shadow.pop(address, None)
+        self.dev.write_reg(address, value)
+        if shadow is not None and self._cacheable(address):
+            self._store(shadow, address, value)
+
+    def execute(self, ops: Sequence[RegisterOp]) -> List[int]:
+        try:
+            if self._shadow is None:
+                return self.dev.execute(ops)
+            return self._execute_cached(self._shadow, ops)
+        except BaseException:
+            # The MMD access registers may have been left in any state
+            self._mmd.clear()
+            raise
+
+    def _execute_cached(self, shadow: Dict[int, int], ops: Sequence[RegisterOp]) -> List[int]:
+        # Serve what we can from the shadow copy and forward the rest
+        known = dict(shadow)
+        forwarded: List[RegisterOp] = []
+        results: List[Optional[int]] = []
+        for op in ops:
+            address = op.address
+            cacheable = self._cacheable(address)
+            if cacheable and op.kind == OP_READ and address in known:
+                self.cache_hits += 1
+                results.append(known[address])
+                continue
+            if cacheable and op.kind == OP_MODIFY and address in known:
+                self.cache_hits += 1
+                op = op._replace(kind=OP_WRITE, value=(known[address] & ~op.mask) | op.value, mask=0)
+            elif cacheable and op.kind in (OP_READ, OP_MODIFY):
+                self.cache_misses += 1
+            if op.kind == OP_WRITE and cacheable:
+                self._store(known, address, op.value)
+            else:
+                known.pop(address, None)
+            results.append(None)
+            forwarded.append(op)
+
+        try:
+            values = iter(self.dev.execute(forwarded))
+        except BaseException:
+            shadow.clear()
+            raise
+        final = [next(values) if r is None else r for r in results]
+
+        for op, value in zip(ops, final):
+            if self._cacheable(op.address):
+                self._store(shadow, op.address, value)
+        return final
+
+    def batch(self) -> RegisterBatch:
+        return RegisterBatch(self.execute)
+
+    @contextmanager
+    def preview(self) -> Iterator[RegisterBatch]:
+        """Yields a batch which is only inspected, never executed. The state
+        of the MMD access registers, which queuing assumes, is restored
+        afterwards."""
+        mmd = dict(self._mmd)
+        try:
+            yield self.batch()
+        finally:
+            self._mmd.clear()
+            self._mmd.update(mmd)
+
+    def queue_mdio_read(self, batch: RegisterBatch, phy_addr: int, miirinda: int) -> int:
         if phy_addr != phy_addr & 0x1f:
             raise ValueError("PHY address must be a 5-bit unsigned integer")
         if miirinda != miirinda & 0x1f:
             raise ValueError("MII Register Index must be a 5-bit unsigned integer")
-        miibzy = 1
-        while miibzy:
-            mii_access = self.read_reg(0x120)
-            miibzy = mii_access & 1
-        self.write_reg(0x120, (phy_addr << 11) | (miirinda << 6) | 1)
-        while miibzy:
-            mii_access = self.read_reg(0x120)
-            miibzy = mii_access & 1
-        return self.read_reg(0x124)
+        if miirinda == 0xe:
+            # May move the address of the MMD
+            self._mmd.pop(phy_addr, None)
+        return self._queue_c22_read(batch, phy_addr, miirinda)
 
-    def write_mdio_reg(self, phy_addr: int, miirinda: int, data: int) -> None:
+    def _queue_c22_read(self, batch: RegisterBatch, phy_addr: int, miirinda: int) -> int:
+        with batch.transaction(CAT_MDIO_C22):
+            batch.poll(0x120, 1, policy=MDIO_POLL)
+            batch.write(0x120, (phy_addr << 11) | (miirinda << 6) | 1)
+            batch.poll(0x120, 1, policy=MDIO_POLL)
+            return batch.read(0x124)
+
+    def queue_mdio_write(self, batch: RegisterBatch, phy_addr: int, miirinda: int, data: int) -> None:
         if data != data & 0xffff:
             raise ValueError("MII data must be a 16-bit unsigned integer")
         if phy_addr != phy_addr & 0x1f:
             raise ValueError("PHY address must be a 5-bit unsigned integer")
         if miirinda != miirinda & 0x1f:
             raise ValueError("MII Register Index must be a 5-bit unsigned integer")
-        miibzy = 1
-        while miibzy:
-            mii_access = self.read_reg(0x120)
-            miibzy = mii_access & 1
-        self.write_reg(0x124, data)
-        self.write_reg(0x120, (phy_addr << 11) | (miirinda << 6) | 3)
-        while miibzy:
-            mii_access = self.read_reg(0x120)
-            miibzy = mii_access & 1
+        if miirinda in (0xd, 0xe) or (miirinda == 0 and data & 0x8000):
+            # MMD access registers changed, or PHY reset
+            self._mmd.pop(phy_addr, None)
+        self._queue_c22_write(batch, phy_addr, miirinda, data)
 
-    def read_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int) -> int:
+    def _queue_c22_write(self, batch: RegisterBatch, phy_addr: int, miirinda: int, data: int) -> None:
+        with batch.transaction(CAT_MDIO_C22):
+            batch.poll(0x120, 1, policy=MDIO_POLL)
+            batch.write(0x124, data)
+            batch.write(0x120, (phy_addr << 11) | (miirinda << 6) | 3)
+            batch.poll(0x120, 1, policy=MDIO_POLL)
+
+    def _queue_mmd_access(self, batch: RegisterBatch, phy_addr: int, devad: int, miirinda: int,
+                          function: int, write: bool, continues: bool = False) -> None:
+        """Points the MMD access registers of the PHY to a register, unless
+        they already are. `continues` is set for the accesses of a block after
+        the first one, which rely on the state left by the previous access
+        even without `track_mmd`."""
         if phy_addr != phy_addr & 0x1f:
             raise ValueError("PHY address must be a 5-bit unsigned integer")
         if devad != devad & 0x1f:
             raise ValueError("DEVAD must be a 5-bit unsigned integer")
         if miirinda != miirinda & 0xffff:
             raise ValueError("MII Register Index must be a 16-bit unsigned integer")
-        self.write_mdio_reg(phy_addr, 0xd, 0x0000 | devad)
-        self.write_mdio_reg(phy_addr, 0xe, miirinda)
-        self.write_mdio_reg(phy_addr, 0xd, 0x4000 | devad)
-        return self.read_mdio_reg(phy_addr, 0xe)
+        state = self._mmd.get(phy_addr) if self.track_mmd or continues else None
+        if state is None or state[0] != devad or state[2] != miirinda:
+            self._queue_c22_write(batch, phy_addr, 0xd, MMD_ADDRESS | devad)
+            self._queue_c22_write(batch, phy_addr, 0xe, miirinda)
+            self._queue_c22_write(batch, phy_addr, 0xd, function | devad)
+        elif state[1] != function:
+            self._queue_c22_write(batch, phy_addr, 0xd, function | devad)
+        if function == MMD_DATA_INC or (function == MMD_DATA_INC_WRITE and write):
+            miirinda = (miirinda + 1) & 0xffff
+        self._mmd[phy_addr] = (devad, function, miirinda)
 
-    def write_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int, data: int) -> None:
+    def queue_mdio_read_c45(self, batch: RegisterBatch, phy_addr: int, devad: int, miirinda: int) -> int:
+        with batch.transaction(CAT_MDIO_C45):
+            self._queue_mmd_access(batch, phy_addr, devad, miirinda, MMD_DATA_INC_WRITE, False)
+            return self._queue_c22_read(batch, phy_addr, 0xe)
+
+    def queue_mdio_write_c45(self, batch: RegisterBatch, phy_addr: int, devad: int, miirinda: int,
+                             data: int) -> None:
+        self._queue_c45_write(batch, phy_addr, devad, miirinda, data, False)
+
+    def _queue_c45_write(self, batch: RegisterBatch, phy_addr: int, devad: int, miirinda: int, data: int,
+                         continues: bool) -> None:
         if data != data & 0xffff:
             raise ValueError("MII data must be a 16-bit unsigned integer")
-        if phy_addr != phy_addr & 0x1f:
-            raise ValueError("PHY address must be a 5-bit unsigned integer")
-        if devad != devad & 0x1f:
-            raise ValueError("DEVAD must be a 5-bit unsigned integer")
-        if miirinda != miirinda & 0xffff:
-            raise ValueError("MII Register Index must be a 16-bit unsigned integer")
-        self.write_mdio_reg(phy_addr, 0xd, 0x0000 | devad)
-        self.write_mdio_reg(phy_addr, 0xe, miirinda)
-        self.write_mdio_reg(phy_addr, 0xd, 0x4000 | devad)
-        self.write_mdio_reg(phy_addr, 0xe, data)
+        with batch.transaction(CAT_MDIO_C45):
+            self._queue_mmd_access(batch, phy_addr, devad, miirinda, MMD_DATA_INC_WRITE, True, continues)
+            self._queue_c22_write(batch, phy_addr, 0xe, data)
+        if (devad, miirinda) == (1, 0) and data & 0x8000:
+            # The PHY reset may clear the MMD access registers
+            self._mmd.pop(phy_addr, None)
 
-    def _eeprom_cmd(self, cmd: int, addr: int) -> None:
+    def queue_mdio_read_block_c45(self, batch: RegisterBatch, phy_addr: int, devad: int, start: int,
+                                  count: int) -> List[int]:
+        """Queues the read of `count` consecutive registers, using the
+        post-increment function of the MMD access registers. Returns the
+        indexes of the results."""
+        if count < 0 or start + count > 0x10000:
+            raise ValueError("Register block must be within the 16-bit register space")
+        idxs = []
+        with batch.transaction(CAT_MDIO_C45):
+            for i in range(count):
+                self._queue_mmd_access(batch, phy_addr, devad, start + i, MMD_DATA_INC, False, i > 0)
+                idxs.append(self._queue_c22_read(batch, phy_addr, 0xe))
+        return idxs
+
+    def queue_mdio_write_block_c45(self, batch: RegisterBatch, phy_addr: int, devad: int, start: int,
+                                   values: Sequence[int]) -> None:
+        if start + len(values) > 0x10000:
+            raise ValueError("Register block must be within the 16-bit register space")
+        for i, value in enumerate(values):
+            self._queue_c45_write(batch, phy_addr, devad, start + i, value, i > 0)
+
+    def read_mdio_block_c45(self, phy_addr: int, devad: int, start: int, count: int) -> List[int]:
+        b = self.batch()
+        idxs = self.queue_mdio_read_block_c45(b, phy_addr, devad, start, count)
+        results = b.execute()
+        return [results[i] for i in idxs]
+
+    def write_mdio_block_c45(self, phy_addr: int, devad: int, start: int, values: Sequence[int]) -> None:
+        b = self.batch()
+        self.queue_mdio_write_block_c45(b, phy_addr, devad, start, values)
+        b.execute()
+
+    def read_mdio_reg(self, phy_addr: int, miirinda: int) -> int:
+        b = self.batch()
+        idx = self.queue_mdio_read(b, phy_addr, miirinda)
+        return b.execute()[idx]
+
+    def write_mdio_reg(self, phy_addr: int, miirinda: int, data: int) -> None:
+        b = self.batch()
+        self.queue_mdio_write(b, phy_addr, miirinda, data)
+        b.execute()
+
+    def read_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int) -> int:
+        b = self.batch()
+        idx = self.queue_mdio_read_c45(b, phy_addr, devad, miirinda)
+        return b.execute()[idx]
+
+    def write_mdio_reg_c45(self, phy_addr: int, devad: int, miirinda: int, data: int) -> None:
+        b = self.batch()
+        self.queue_mdio_write_c45(b, phy_addr, devad, miirinda, data)
+        b.execute()
+
+    def _queue_eeprom_cmd(self, batch: RegisterBatch, cmd: int, addr: int) -> None:
         if (cmd & 0b111) != cmd:
             raise ValueError("EPC command must be a 3-bit unsigned integer")
         if (addr & 0x1ff) != addr:
             raise ValueError("EPC address must be a 9-bit unsigned integer")
+        with batch.transaction(CAT_EEPROM):
+            batch.poll(0x040, 0x80000000, policy=EEPROM_POLL)
+            batch.write(0x040, 0x80000000 | (cmd << 28) | addr)
+            # WRITE, WRAL, ERASE and ERAL program the EEPROM
+            programming = 0b011 <= cmd <= 0b110
+            batch.poll(0x040, 0x80000000, policy=EEPROM_WRITE_POLL if programming else EEPROM_POLL)
 
-        e2p_cmd = 0x80000000
-        while e2p_cmd & 0x80000000:
-            e2p_cmd = self.dev.read_reg(0x040)
-
-        self.dev.write_reg(0x040, 0x80000000 | (cmd << 28) | addr)
-
-        e2p_cmd = 0x80000000
-        while e2p_cmd & 0x80000000:
-            e2p_cmd = self.dev.read_reg(0x040)
+    def _eeprom_cmd(self, cmd: int, addr: int) -> None:
+        b = self.batch()
+        self._queue_eeprom_cmd(b, cmd, addr)
+        b.execute()
 
     def eeprom_write(self, addr: int, data: int) -> None:
         if (data & 0xff) != data:
@@ -97,22 +527,83 @@ class LAN7801:
         if (addr & 0x1ff) != addr:
             raise ValueError("EPC address must be a 9-bit unsigned integer")
 
-        self._eeprom_cmd(0b010, 0)  # EWEN
-        self.write_reg(0x044, data)
-        self._eeprom_cmd(0b011, addr)  # WRITE
-        self._eeprom_cmd(0b001, 0)  # EWDS
+        b = self.batch()
+        with b.transaction(CAT_EEPROM):
+            self._queue_eeprom_cmd(b, 0b010, 0)  # EWEN
+            b.write(0x044, data)
+            self._queue_eeprom_cmd(b, 0b011, addr)  # WRITE
+            self._queue_eeprom_cmd(b, 0b001, 0)  # EWDS
+        b.execute()
 
     def eeprom_read(self, addr: int) -> int:
         if (addr & 0x1ff) != addr:
             raise ValueError("EPC address must be a 9-bit unsigned integer")
 
-        self._eeprom_cmd(0b000, addr)  # READ
-        return self.read_reg(0x044)
+        b = self.batch()
+        with b.transaction(CAT_EEPROM):
+            self._queue_eeprom_cmd(b, 0b000, addr)  # READ
+            idx = b.read(0x044)
+        return b.execute()[idx]
+
+    def read_image(self, size: int = EEPROM_SIZE, offset: int = 0) -> bytes:
+        """Reads `size` bytes of the EEPROM from `offset` in a single batch"""
+        if size < 0 or offset < 0 or offset + size > EEPROM_SIZE:
+            raise ValueError("Image must be within the EEPROM")
+        b = self.batch()
+        idxs = []
+        with b.transaction(CAT_EEPROM):
+            for addr in range(offset, offset + size):
+                self._queue_eeprom_cmd(b, 0b000, addr)  # READ
+                idxs.append(b.read(0x044))
+        results = b.execute()
+        return bytes(results[i] & 0xff for i in idxs)
+
+    def write_image(self, data: bytes, verify: bool = True, offset: int = 0) -> int:
+        """Writes `data` to the EEPROM, at `offset`.
+
+        Only the bytes which differ from the current contents are
+        programmed, all within a single write enable. Returns the number of
+        bytes written.
+
+        Parameters
+        ----------
+        data : bytes
+            the image, at most `EEPROM_SIZE` bytes.
+        verify : bool
+            read the image back and raise `IOError` if it differs.
+        offset : int
+            EEPROM address of the first byte of `data`.
+        """
+        if offset < 0 or offset + len(data) > EEPROM_SIZE:
+            raise ValueError("Image must be within the EEPROM")
+        current = self.read_image(len(data), offset)
+        changed = [offset + i for i in range(len(data)) if data[i] != current[i]]
+        if changed:
+            b = self.batch()
+            with b.transaction(CAT_EEPROM):
+                self._queue_eeprom_cmd(b, 0b010, 0)  # EWEN
+                for addr in changed:
+                    b.write(0x044, data[addr - offset])
+                    self._queue_eeprom_cmd(b, 0b011, addr)  # WRITE
+                self._queue_eeprom_cmd(b, 0b001, 0)  # EWDS
+            b.execute()
+        if verify:
+            mismatch = [i for i, value in enumerate(self.read_image(len(data), offset)) if value != data[i]]
+            if mismatch:
+                raise IOError("EEPROM verification failed at 0x%03x" % (offset + mismatch[0]))
+        return len(changed)
 
     def eeprom_erase_all(self) -> None:
-        self._eeprom_cmd(0b010, 0)  # EWEN
-        self._eeprom_cmd(0b110, 0)  # ERAL
-        self._eeprom_cmd(0b001, 0)  # EWDS
+        b = self.batch()
+        self._queue_eeprom_cmd(b, 0b010, 0)  # EWEN
+        self._queue_eeprom_cmd(b, 0b110, 0)  # ERAL
+        self._queue_eeprom_cmd(b, 0b001, 0)  # EWDS
+        b.execute()
+
+    def read_statistics(self) -> StatsSample:
+        """Reads all statistics counters with a single transfer"""
+        data = self.dev.read_stats_block()
+        return parse_stats_block(data, self.dev.monotonic())
 
     def __getitem__(self, key: int) -> int:
         if isinstance(key, int):
@@ -127,11 +618,9 @@ class LAN7801:
             raise ValueError("Unsupported key type")
 
     def set_ads(self, ads_enabled: bool) -> None:
-        p = self[0x100]
-        p &= ~0x0800
-        if ads_enabled:
-            p |= 0x0800
-        self[0x100] = p
+        b = self.batch()
+        b.modify(0x100, set=0x0800 if ads_enabled else 0, clr=0x0800)
+        b.execute()
 
     def set_speed(self, speed: int) -> None:
         if speed & 3 != speed:
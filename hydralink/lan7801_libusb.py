@@ -5,49 +5,48 @@
 import usb.core
 import struct
 import sys
-import re
+import time
 
-from glob import glob
-from typing import Tuple, Union, cast, Optional
+from typing import Union, cast, Optional
 
+from hydralink.counters import STATS_BLOCK, USB_VENDOR_REQUEST_GET_STATS
+from hydralink.discovery import DeviceInfo, default_index, resolve_netif
 from hydralink.lan7801 import LAN7801_LL
+from hydralink.stats import CAT_REG_WRITE
 
 
 def get_lan78xx_usb_dev_by_interface_name(name: str) -> usb.core.Device:
     if sys.platform == 'linux':
-        globies = glob(f'/sys/bus/usb/drivers/**/**/net/{name}/')
-        if len(globies) == 0:
-            raise FileNotFoundError("Network interface not found")
-        if len(globies) > 1:
-            raise Exception("More than one Hydralink matches the same interface?")
-        g = globies[0]
-        m = re.match(r'^/sys/bus/usb/drivers/([^/]+)/([^/]+)/net/([^/]+)/$', g)
-        if not m or m[3] != name:
-            raise FileNotFoundError("Network interface name does not match")
-        driver, usbdir = m[1], m[2]
-        if driver != 'lan78xx':
-            raise IOError(f"Network interface is associated to driver {driver} instead of lan78xx")
-        m = re.match(r'(\d)+-(\d+)(?:\.(\d+))?:(\d+)\.(\d+)', usbdir)
-        if not m:
-            raise Exception("USB path string does not match")
-        bus = int(m[1])
-        port = int(m[2])
-        port_numbers: Union[Tuple[int, int], Tuple[int]] = (port, )
-        if m[3]:
-            hubport = int(m[3])
-            port_numbers = (port, hubport)
-        dev = usb.core.find(idVendor=0x0424, idProduct=0x7801, bus=bus, port_numbers=port_numbers)
-        assert dev
-        assert isinstance(dev, usb.core.Device)
+        info = resolve_netif(name)
+        if info is None:
+            raise FileNotFoundError("Network interface of a LAN7801 not found")
+        if info.driver is not None and info.driver != 'lan78xx':
+            raise IOError(f"Network interface is associated to driver {info.driver} instead of lan78xx")
+        dev = find_by_info(info)
+        if dev is None:
+            raise FileNotFoundError("USB device of the network interface not found")
         return dev
     raise NotImplementedError(f"Search by interface name not implemented for platform {sys.platform}")
 
 
+def find_by_info(info: DeviceInfo) -> Optional[usb.core.Device]:
+    """Finds the device of a discovery index entry. Only that device is
+    opened, instead of every device on the bus."""
+    dev = usb.core.find(idVendor=0x0424, idProduct=0x7801, bus=info.bus, address=info.address)
+    return cast(Optional[usb.core.Device], dev)
+
+
 class LAN7801_LibUSB(LAN7801_LL):
-    def __init__(self, d: Union[None, int, usb.core.Device, str] = None) -> None:
+    def __init__(self, d: Union[None, int, usb.core.Device, str, DeviceInfo] = None) -> None:
         dev: Optional[usb.core.Device] = None
+        discovery = default_index()
         if isinstance(d, usb.core.Device):
             dev = d
+        elif isinstance(d, DeviceInfo):
+            dev = find_by_info(d)
+        elif discovery is not None:
+            info = discovery.find(d)
+            dev = None if info is None else find_by_info(info)
         elif isinstance(d, int):
             dev = list(usb.core.find(find_all=True, idVendor=0x0424, idProduct=0x7801))[d]
         elif isinstance(d, str):
@@ -62,20 +61,42 @@ class LAN7801_LibUSB(LAN7801_LL):
             raise FileNotFoundError("Device not found!")
         self.dev = dev
 
+    def get_serial(self) -> Optional[str]:
+        try:
+            return cast(Optional[str], self.dev.serial_number)
+        except (ValueError, usb.core.USBError):
+            return None
+
     def write_reg(self, address: int, value: int) -> None:
         if value != value & 0xffffffff:
             raise ValueError("Value must be an unsigned 32-bit integer")
         if address != address & 0xfff:
             raise ValueError("Address must be an unsigned 12-bit integer")
         msg = struct.pack("<I", value)
+        stats = self.stats
+        t0 = time.perf_counter_ns() if stats is not None else 0
         ret = self.dev.ctrl_transfer(0x40, 0xa0, 0, address, msg)
+        if stats is not None:
+            stats.record(self._category or CAT_REG_WRITE, time.perf_counter_ns() - t0)
         if ret != 4:
             raise IOError("Written bytes is not 4")
 
+    def read_stats_block(self) -> bytes:
+        stats = self.stats
+        t0 = time.perf_counter_ns() if stats is not None else 0
+        ret = self.dev.ctrl_transfer(0xc0, USB_VENDOR_REQUEST_GET_STATS, 0, 0, STATS_BLOCK.size)
+        if stats is not None:
+            stats.record(self._category, time.perf_counter_ns() - t0)
+        return bytes(ret)
+
     def read_reg(self, address: int) -> int:
         if address != address & 0xfff:
             raise ValueError("Address must be an unsigned 12-bit integer")
+        stats = self.stats
+        t0 = time.perf_counter_ns() if stats is not None else 0
         ret = self.dev.ctrl_transfer(0xc0, 0xa1, 0, address, 4)
+        if stats is not None:
+            stats.record(self._category, time.perf_counter_ns() - t0)
         if len(ret) != 4:
             raise IOError("Received response is not 4 bytes")
         val, = struct.unpack("<I", bytes(ret))
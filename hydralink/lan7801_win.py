@@ -10,6 +10,7 @@ from typing import List, Optional, Union, cast
 from hydralink.windows_apis import CloseHandle, CreateFile, DeviceIoControl, list_usb_devices
 
 from hydralink.lan7801 import LAN7801_LL
+from hydralink.stats import CAT_REG_WRITE
 
 
 class LAN7801_Win(LAN7801_LL):
@@ -28,6 +29,7 @@ class LAN7801_Win(LAN7801_LL):
 
         self._buffer = bytearray(0x1000)
         self._buffer_c = (ctypes.c_char * 0x1000).from_buffer(self._buffer)
+        self.serial: Optional[str] = None
         self.iidx = 0
         self.oidx = 0x10002
         if isinstance(interface_idx, int):
@@ -41,7 +43,10 @@ class LAN7801_Win(LAN7801_LL):
                 and t.serialnum == serial]
         if len(devs) == 0:
             return None
-        return LAN7801_Win.by_key(devs[0].software_key)
+        mac = LAN7801_Win.by_key(devs[0].software_key)
+        if mac:
+            mac.serial = serial
+        return mac
 
     @staticmethod
     def by_key(key: str) -> Optional['LAN7801_Win']:
@@ -67,6 +72,9 @@ class LAN7801_Win(LAN7801_LL):
                 raise x
         raise exceptions[0]
 
+    def get_serial(self) -> Optional[str]:
+        return self.serial
+
     def __del__(self) -> None:
         CloseHandle(self.handle)
 
@@ -107,7 +115,11 @@ class LAN7801_Win(LAN7801_LL):
         if address != address & 0xfff:
             raise ValueError("Address must be an unsigned 12-bit integer")
 
+        stats = self.stats
+        t0 = time.perf_counter_ns() if stats is not None else 0
         resbuf = self._xfer(struct.pack("<IIIII", self.oidx, 9, self.iidx, address, value))
+        if stats is not None:
+            stats.record(self._category or CAT_REG_WRITE, time.perf_counter_ns() - t0)
 
         if len(resbuf) != 1:
             raise IOError(f"Unexpected response length ({len(resbuf)} != 1) to WRITE_REGISTER")
@@ -116,7 +128,11 @@ class LAN7801_Win(LAN7801_LL):
         if address != address & 0xfff:
             raise ValueError("Address must be an unsigned 12-bit integer")
 
+        stats = self.stats
+        t0 = time.perf_counter_ns() if stats is not None else 0
         resbuf = self._xfer(struct.pack("<IIII", self.oidx, 8, self.iidx, address))
+        if stats is not None:
+            stats.record(self._category, time.perf_counter_ns() - t0)
 
         if len(resbuf) != 4:
             raise IOError(f"Unexpected response length ({len(resbuf)} != 4) to READ_REGISTER")
@@ -0,0 +1,78 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Configuration of many HydraLinks at once.
+
+Every device is opened and set up by a worker thread. Control transfers
+release the GIL while waiting for the device, so the devices are configured
+concurrently and bringing up a rack takes about as long as its slowest
+device.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+from hydralink.config import HydraLinkConfig
+from hydralink.hydralink import HydraLink, SetupReport
+from hydralink.lan7801 import LAN7801_LL
+
+DeviceSpec = Union[None, int, str, LAN7801_LL]
+
+
+class DeviceResult(NamedTuple):
+    device: DeviceSpec
+    serial: Optional[str]
+    # The report of `HydraLink.setup`, None if it failed with `error`
+    report: Optional[SetupReport]
+    error: Optional[Exception]
+    # Time to open and set up the device, in seconds
+    duration: float
+
+
+def configure_one(device: DeviceSpec,
+                  config: HydraLinkConfig,
+                  incremental: bool = False,
+                  cache: bool = False,
+                  wait_link: bool = False) -> DeviceResult:
+    """Opens and sets up one device, returning errors instead of raising them"""
+    t0 = time.perf_counter()
+    serial = None
+    try:
+        hl = HydraLink(device, cache=cache)
+        hl.verbose = False
+        serial = hl.mac.dev.get_serial()
+        report = hl.setup(**config._asdict(), incremental=incremental, wait_link=wait_link)
+        return DeviceResult(device, serial, report, None, time.perf_counter() - t0)
+    except Exception as x:
+        return DeviceResult(device, serial, None, x, time.perf_counter() - t0)
+
+
+def configure_many(devices: Sequence[DeviceSpec],
+                   config: HydraLinkConfig,
+                   incremental: bool = False,
+                   cache: bool = False,
+                   workers: Optional[int] = None,
+                   wait_link: bool = False) -> List[DeviceResult]:
+    """Sets up all `devices` with `config` concurrently.
+
+    Parameters
+    ----------
+    devices : list
+        specifications of the devices, as accepted by `HydraLink`.
+    config : HydraLinkConfig
+        the configuration to apply, see `HydraLink.setup`.
+    incremental, cache, wait_link : bool
+        see `HydraLink.setup` and `HydraLink`.
+    workers : int
+        optional, number of worker threads. By default, one per device.
+
+    Returns one `DeviceResult` per device, in the order of `devices`. A
+    device failing does not affect the others.
+    """
+    if not devices:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or len(devices)) as executor:
+        futures = [executor.submit(configure_one, device, config, incremental, cache, wait_link) for device in devices]
+        return [f.result() for f in futures]
@@ -0,0 +1,174 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Pool of open HydraLink handles.
+
+Constructing a `HydraLink` looks the device up on the bus and verifies the
+MAC and PHY identifiers, which costs several control transfers, among them
+a full Clause 45 access. A `HydraLinkPool` keeps the handles open and
+verified, and hands them out again as long as the device has not moved. A
+device may be named by its index, serial number or interface name; the
+handles are pooled by location, so every name of a device gets the same
+handle.
+
+Whether a device has moved is decided by a locator, which maps a key to the
+location of the device without talking to it: its USB bus and address,
+which change whenever the device is replugged, or its device path on
+Windows. A handle is reopened, and verified again, only when the location
+changes, and it is evicted when the device is gone.
+"""
+
+import threading
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Union
+
+from hydralink.discovery import default_index
+from hydralink.hydralink import HydraLink, is_windows
+
+PoolKey = Union[None, int, str]
+Locator = Callable[[PoolKey], Optional[Hashable]]
+
+
+def usb_location(key: PoolKey) -> Optional[Hashable]:
+    """Returns the location of the device `key`, as accepted by
+    `get_lan7801_driver`, or None if it is not connected.
+
+    On Linux, the device is looked up in the discovery index, which does not
+    need any USB transfer.
+    """
+    if is_windows():
+        from hydralink.windows_apis import list_usb_devices
+        paths = [t.path for t in list_usb_devices() if t.vid == 0x0424 and t.pid == 0x7801
+                 and (not isinstance(key, str) or t.serialnum == key)]
+        index = key if isinstance(key, int) else 0
+        return paths[index] if index < len(paths) else None
+    discovery = default_index()
+    if discovery is not None:
+        info = discovery.find(key)
+        return None if info is None else (info.bus, info.address)
+
+    import usb.core
+    devices = list(usb.core.find(find_all=True, idVendor=0x0424, idProduct=0x7801))
+    if isinstance(key, str):
+        for dev in devices:
+            try:
+                if dev.serial_number == key:
+                    return dev.bus, dev.address
+            except (ValueError, usb.core.USBError):
+                pass
+        return None
+    index = key or 0
+    return (devices[index].bus, devices[index].address) if index < len(devices) else None
+
+
+class PoolStats(NamedTuple):
+    # Handles given out without opening the device
+    hits: int
+    # Handles which had to be opened, among them `revalidations` because
+    # the device moved
+    misses: int
+    revalidations: int
+    evictions: int
+
+
+class HydraLinkPool:
+    def __init__(self,
+                 opener: Optional[Callable[[PoolKey], HydraLink]] = None,
+                 locator: Locator = usb_location,
+                 cache: bool = False) -> None:
+        """Creates an empty pool. `opener` opens and verifies a device given
+        its key, by default `HydraLink(key, cache=cache, track_mmd=False)`
+        as the device is shared with the kernel driver and other processes;
+        `locator` returns the location of a device given its key, or None if
+        it is gone."""
+        self.opener = opener or (lambda key: HydraLink(key, cache=cache, track_mmd=False))
+        self.locator = locator
+        self._handles: Dict[Hashable, HydraLink] = {}
+        # The location of each key, when it was last looked up
+        self._locations: Dict[PoolKey, Hashable] = {}
+        # Set once the device at a location, which is being opened, is pooled
+        self._opening: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._revalidations = self._evictions = 0
+
+    def get(self, key: PoolKey = None) -> HydraLink:
+        """Returns the open handle of the device `key`, opening it if it is
+        not in the pool or has moved since. Concurrent callers for the same
+        device wait for one of them to open it.
+
+        Throws `FileNotFoundError` if the device is not connected, and
+        `IOError` if its identifiers are unexpected.
+        """
+        location = self.locator(key)
+        with self._lock:
+            previous = self._locations.pop(key, None)
+            if previous is not None and previous != location and previous not in self._locations.values():
+                # The device moved, or is gone: the old handle is stale
+                if self._handles.pop(previous, None) is not None and location is None:
+                    self._evictions += 1
+            if location is None:
+                raise FileNotFoundError(f"HydraLink '{key}' not found")
+            self._locations[key] = location
+        while True:
+            with self._lock:
+                hl = self._handles.get(location)
+                if hl is not None:
+                    self._hits += 1
+                    return hl
+                opening = self._opening.get(location)
+                if opening is None:
+                    opening = self._opening[location] = threading.Event()
+                    self._misses += 1
+                    if previous is not None and previous != location:
+                        self._revalidations += 1
+                    break
+            # Another caller opens the device, use its handle, or try again
+            # if it failed
+            opening.wait()
+        try:
+            hl = self.opener(key)
+            with self._lock:
+                self._handles[location] = hl
+            return hl
+        finally:
+            with self._lock:
+                del self._opening[location]
+            opening.set()
+
+    def evict(self, key: PoolKey) -> bool:
+        """Drops the handle of `key`, and thereby of every key naming the
+        same device, e.g. after an I/O error. Returns whether it was in the
+        pool."""
+        with self._lock:
+            location = self._locations.pop(key, None)
+            if location is None or self._handles.pop(location, None) is None:
+                return False
+            self._evictions += 1
+            return True
+
+    def sweep(self) -> List[PoolKey]:
+        """Evicts the handles of the devices which are gone, and returns
+        their keys"""
+        with self._lock:
+            keys = list(self._locations)
+        gone = [key for key in keys if self.locator(key) is None]
+        for key in gone:
+            self.evict(key)
+        return gone
+
+    def clear(self) -> None:
+        with self._lock:
+            self._evictions += len(self._handles)
+            self._handles.clear()
+            self._locations.clear()
+
+    @property
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(self._hits, self._misses, self._revalidations, self._evictions)
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __contains__(self, key: PoolKey) -> bool:
+        return self._locations.get(key) in self._handles
@@ -0,0 +1,158 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Boot profiles: the HydraLink configuration stored in the EEPROM.
+
+The LAN7801 loads its MAC address from the EEPROM at power-up, if the
+EEPROM starts with the 0xA5 signature. Everything else `HydraLink.setup()`
+configures lives in the BCM89881 or in LAN7801 registers which the EEPROM
+cannot preset, so it still has to be applied by software after every
+power-up. The profile is therefore also stored as a record at the end of
+the EEPROM, where the LAN7801 configuration loader does not look. The
+record lets the configuration be applied without knowing it, and lets a
+setup tool quickly check whether a device already holds a profile. If the
+EEPROM holds a LAN7801 configuration, its USB string, device and
+configuration descriptors may be stored anywhere after the header; the
+record is not written over them.
+
+Record layout, little endian:
+ - magic `HLBP`, version (u8)
+ - flags (u8): master set, master, promiscuous set, promiscuous, MAC set
+ - speed (u8): 0 unset, 1 100 Mb/s, 2 1000 Mb/s
+ - reserved (u8), MAC address (6 bytes)
+ - CRC-32 of the preceding bytes (u32)
+"""
+
+import struct
+import zlib
+from typing import List, NamedTuple, Optional, Tuple
+
+from hydralink.lan7801 import EEPROM_SIZE, LAN7801
+
+EEPROM_SIGNATURE = 0xa5
+
+_MAGIC = b'HLBP'
+_VERSION = 1
+_RECORD = struct.Struct('<4sBBBB6sI')
+PROFILE_OFFSET = EEPROM_SIZE - _RECORD.size
+
+_MASTER_SET = 0x01
+_MASTER = 0x02
+_PROMISCUOUS_SET = 0x04
+_PROMISCUOUS = 0x08
+_MAC_SET = 0x10
+_SPEEDS = {None: 0, 100: 1, 1000: 2}
+
+# Length in bytes and offset in 16-bit words of the USB descriptors in the
+# LAN7801 EEPROM header, from byte 0x0c on
+_DESCRIPTORS = ('manufacturer string', 'product string', 'serial string', 'configuration string',
+                'interface string', 'high-speed device descriptor', 'high-speed configuration descriptor',
+                'full-speed device descriptor', 'full-speed configuration descriptor')
+_HEADER_SIZE = 0x0c + 2 * len(_DESCRIPTORS)
+
+
+def parse_mac_addr(mac_addr: str) -> bytes:
+    """Converts a MAC address in the form 01:23:45:ab:cd:ef to bytes"""
+    mac_addr_bytes = b''
+    for byte in mac_addr.split(':'):
+        bb = bytes.fromhex(byte)
+        if len(bb) != 1:
+            raise ValueError("Malformed MAC address")
+        mac_addr_bytes += bb
+    if len(mac_addr_bytes) != 6:
+        raise ValueError("Malformed MAC address")
+    return mac_addr_bytes
+
+
+class BootProfile(NamedTuple):
+    """Arguments of `HydraLink.setup()`, None leaves a setting unchanged"""
+    master: Optional[bool] = None
+    speed: Optional[int] = None
+    mac_addr: Optional[str] = None
+    promiscuous: Optional[bool] = None
+
+    def to_bytes(self) -> bytes:
+        if self.speed not in _SPEEDS:
+            raise ValueError("Speed should be either 100 or 1000")
+        flags = 0
+        if self.master is not None:
+            flags |= _MASTER_SET | (_MASTER if self.master else 0)
+        if self.promiscuous is not None:
+            flags |= _PROMISCUOUS_SET | (_PROMISCUOUS if self.promiscuous else 0)
+        mac_addr = b'\x00' * 6
+        if self.mac_addr is not None:
+            flags |= _MAC_SET
+            mac_addr = parse_mac_addr(self.mac_addr)
+        data = _RECORD.pack(_MAGIC, _VERSION, flags, _SPEEDS[self.speed], 0, mac_addr, 0)
+        return data[:-4] + struct.pack('<I', zlib.crc32(data[:-4]))
+
+    @staticmethod
+    def from_bytes(data: bytes) -> Optional['BootProfile']:
+        """Returns None if `data` is not a valid profile record"""
+        if len(data) != _RECORD.size:
+            return None
+        magic, version, flags, speed, _, mac_addr, crc = _RECORD.unpack(data)
+        if magic != _MAGIC or version != _VERSION or crc != zlib.crc32(data[:-4]):
+            return None
+        speeds = {v: k for k, v in _SPEEDS.items()}
+        if speed not in speeds:
+            return None
+        return BootProfile(
+            master=bool(flags & _MASTER) if flags & _MASTER_SET else None,
+            speed=speeds[speed],
+            mac_addr=':'.join('%02x' % b for b in mac_addr) if flags & _MAC_SET else None,
+            promiscuous=bool(flags & _PROMISCUOUS) if flags & _PROMISCUOUS_SET else None)
+
+
+def header_descriptors(header: bytes) -> List[Tuple[str, int, int]]:
+    """Returns the name, first byte and length of the USB descriptors
+    listed in a LAN7801 EEPROM header. Empty descriptors and descriptors
+    which do not fit into the EEPROM, e.g. erased ones, are left out."""
+    result = []
+    for i, name in enumerate(_DESCRIPTORS):
+        length, offset = header[0x0c + 2 * i], 2 * header[0x0d + 2 * i]
+        if 0 < length and offset + length <= EEPROM_SIZE:
+            result.append((name, offset, length))
+    return result
+
+
+def read_boot_profile(mac: LAN7801) -> Optional[BootProfile]:
+    return BootProfile.from_bytes(mac.read_image(_RECORD.size, PROFILE_OFFSET))
+
+
+def write_boot_profile(mac: LAN7801, profile: BootProfile, verify: bool = True) -> int:
+    """Stores `profile` in the EEPROM. If the EEPROM holds a LAN7801
+    configuration, the MAC address it loads at power-up is updated as well.
+    Only the bytes which change are written, their number is returned.
+
+    Throws `ValueError` if the record would overwrite one of the USB
+    descriptors of the LAN7801 configuration.
+    """
+    record = profile.to_bytes()
+    header = mac.read_image(_HEADER_SIZE)
+    configured = header[0] == EEPROM_SIGNATURE
+    if configured:
+        for name, offset, length in header_descriptors(header):
+            if offset < PROFILE_OFFSET + _RECORD.size and PROFILE_OFFSET < offset + length:
+                raise ValueError(f"The {name} string at EEPROM bytes {offset}-{offset + length - 1} "
+                                 f"overlaps the boot profile at {PROFILE_OFFSET}-{EEPROM_SIZE - 1}")
+    written = 0
+    if profile.mac_addr is not None and configured:
+        written += mac.write_image(parse_mac_addr(profile.mac_addr), verify, offset=1)
+    return written + mac.write_image(record, verify, offset=PROFILE_OFFSET)
+
+
+def has_boot_profile(mac: LAN7801, profile: BootProfile) -> bool:
+    """Checks whether the EEPROM already holds `profile`. Only the stored
+    record, and the MAC address loaded at power-up, are compared: the PHY
+    settings of the profile are not applied by the hardware, so the device
+    may still need `HydraLink.setup()`."""
+    record = profile.to_bytes()
+    if mac.read_image(_RECORD.size, PROFILE_OFFSET) != record:
+        return False
+    if profile.mac_addr is not None:
+        header = mac.read_image(7)
+        if header[0] == EEPROM_SIGNATURE and header[1:] != parse_mac_addr(profile.mac_addr):
+            return False
+    return True
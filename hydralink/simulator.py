@@ -0,0 +1,330 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""In-process model of a HydraLink: a LAN7801 MAC with a BCM89881 PHY.
+
+`LAN7801_Sim` implements `LAN7801_LL`, so it can be passed anywhere a real
+device can, e.g. `HydraLink(LAN7801_Sim())`. Time is virtual: every transfer
+advances `LAN7801_Sim.now` by the configured latency, which keeps timing
+measurements deterministic. Set `realtime` to also spend the latency in
+`time.sleep`.
+
+Busy flags (MII_ACC, E2P_CMD) and the RXEN/TXEN state of MAC_RX/MAC_TX follow
+the commands after a configurable number of reads, so the polling behavior of
+the host code can be exercised.
+
+Accesses which the real hardware would not accept, such as writing MII_ACC
+while busy or changing the MAC speed while RX/TX are enabled, are recorded in
+`LAN7801_Sim.violations`.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from hydralink.counters import STAT_COUNTERS, STAT_INDEX, STAT_ROLLOVER, STATS_BLOCK
+from hydralink.lan7801 import LAN7801_LL
+from hydralink.stats import CAT_REG_WRITE
+
+MII_ACC = 0x120
+MII_DATA = 0x124
+E2P_CMD = 0x040
+E2P_DATA = 0x044
+MAC_CR = 0x100
+MAC_RX = 0x104
+MAC_TX = 0x108
+
+
+class BCM89881_Model:
+    """Clause 22 view of the BCM89881, with Clause 45 registers reachable
+    through the MMD access registers 0xd/0xe."""
+    RESET_VALUES = {
+        (1, 0x0000): 0x0040,  # PMA/PMD control: 1000 Mb/s
+        (1, 0x0002): 0xae02,  # PMA/PMD identifier
+        (1, 0x0834): 0x8000,  # BASE-T1 PMA/PMD control: slave
+    }
+
+    def __init__(self, link_delay: float = 0.0) -> None:
+        self.link_delay = link_delay
+        self.c45: Dict[Tuple[int, int], int] = dict(self.RESET_VALUES)
+        self.mmd_ctrl = 0
+        self.mmd_addr: Dict[int, int] = {}
+        self.resets = 0
+        self.link_up_at: Optional[float] = 0.0
+        # Per receive link status register, whether the link has not dropped
+        # since it was last read
+        self._link_latched = {(1, 0x0001): True, (3, 0x0001): True}
+        self._link_was_up = True
+        self.violations: List[str] = []
+
+    def in_reset(self) -> bool:
+        return (self.c45.get((1, 0), 0) & 0x8000) != 0
+
+    def link_up(self, now: float) -> bool:
+        return self.link_up_at is not None and now >= self.link_up_at
+
+    def _observe_link(self, now: float) -> bool:
+        up = self.link_up(now)
+        if self._link_was_up and not up:
+            # The link dropped, every status register latches it
+            self._link_latched = dict.fromkeys(self._link_latched, False)
+        self._link_was_up = up
+        return up
+
+    def read_c45(self, devad: int, reg: int, now: float) -> int:
+        if (devad, reg) in self._link_latched:
+            # Receive link status, latching low until read
+            up = self._observe_link(now)
+            status = 0x0004 if self._link_latched[devad, reg] and up else 0
+            self._link_latched[devad, reg] = True
+            return status
+        return self.c45.get((devad, reg), 0)
+
+    def write_c45(self, devad: int, reg: int, value: int, now: float) -> None:
+        if (devad, reg) == (1, 0):
+            if value & 0x8000 and not self.in_reset():
+                self.resets += 1
+                self.link_up_at = None
+                self._link_latched = dict.fromkeys(self._link_latched, False)
+                self._link_was_up = False
+            elif not value & 0x8000 and self.in_reset():
+                self.link_up_at = now + self.link_delay
+        elif (devad, reg) == (1, 0x0834) and not self.in_reset() and self.c45.get((devad, reg)) != value:
+            self.violations.append("PHY master/slave changed while not in reset")
+        if (devad, reg) == (1, 0) and not self.in_reset() and (self.c45[1, 0] ^ value) & 0x2040:
+            self.violations.append("PHY speed changed while not in reset")
+        self.c45[devad, reg] = value
+
+    def _mmd_data(self, write: bool) -> Tuple[int, int]:
+        devad = self.mmd_ctrl & 0x1f
+        addr = self.mmd_addr.get(devad, 0)
+        function = self.mmd_ctrl >> 14
+        if function == 2 or (function == 3 and write):
+            self.mmd_addr[devad] = (addr + 1) & 0xffff
+        return devad, addr
+
+    def read_c22(self, reg: int, now: float) -> int:
+        if reg == 0xd:
+            return self.mmd_ctrl
+        if reg == 0xe:
+            if self.mmd_ctrl >> 14 == 0:
+                return self.mmd_addr.get(self.mmd_ctrl & 0x1f, 0)
+            return self.read_c45(*self._mmd_data(False), now)
+        return 0
+
+    def write_c22(self, reg: int, value: int, now: float) -> None:
+        if reg == 0xd:
+            self.mmd_ctrl = value & 0xc01f
+        elif reg == 0xe:
+            if self.mmd_ctrl >> 14 == 0:
+                self.mmd_addr[self.mmd_ctrl & 0x1f] = value
+            else:
+                self.write_c45(*self._mmd_data(True), value, now)
+
+
+class LAN7801_Sim(LAN7801_LL):
+    RESET_VALUES = {
+        0x000: 0x78010002,  # ID_REV
+        0x0b0: 0x00001c8a,  # RFE_CTL
+        MAC_CR: 0x00000800,  # automatic speed detection enabled
+        MAC_RX: 0x00000002,  # disabled
+        MAC_TX: 0x00000002,  # disabled
+    }
+
+    def __init__(self,
+                 serial: Optional[str] = 'dscthl_sim',
+                 phy: Optional[BCM89881_Model] = None,
+                 phy_addr: int = 0,
+                 latency: float = 0.0,
+                 mii_busy_cycles: int = 0,
+                 eeprom_busy_cycles: int = 0,
+                 txrx_busy_cycles: int = 0,
+                 eeprom_write_time: float = 0.0,
+                 eeprom_size: int = 512,
+                 realtime: bool = False) -> None:
+        """Creates a simulated HydraLink.
+
+        Parameters
+        ----------
+        latency : float
+            duration of every register transfer, in seconds.
+        mii_busy_cycles, eeprom_busy_cycles : int
+            number of reads of MII_ACC or E2P_CMD which still report busy
+            after a command is issued.
+        txrx_busy_cycles : int
+            number of reads of MAC_RX or MAC_TX after which a change of the
+            RXEN/TXEN bit takes effect.
+        eeprom_write_time : float
+            duration of the EEPROM programming commands, in seconds.
+        realtime : bool
+            also wait for `latency` in real time for every transfer.
+        """
+        self.serial = serial
+        self.phy = phy if phy is not None else BCM89881_Model()
+        self.phy_addr = phy_addr
+        self.latency = latency
+        self.mii_busy_cycles = mii_busy_cycles
+        self.eeprom_busy_cycles = eeprom_busy_cycles
+        self.txrx_busy_cycles = txrx_busy_cycles
+        self.eeprom_write_time = eeprom_write_time
+        self.realtime = realtime
+
+        self.regs: Dict[int, int] = dict(self.RESET_VALUES)
+        self.eeprom = bytearray(b'\xff' * eeprom_size)
+        self.eeprom_write_enabled = False
+        # Number of reads left, and time, before a busy flag clears
+        self._busy: Dict[int, int] = {}
+        self._busy_until: Dict[int, float] = {}
+        # Enable bit that MAC_RX/MAC_TX are moving to, and reads left
+        self._pending_en: Dict[int, Tuple[int, int]] = {}
+
+        # Statistics counters, wrapped around like the hardware ones
+        self.counters = [0] * len(STAT_COUNTERS)
+
+        self.now = 0.0
+        self.reads = 0
+        self.writes = 0
+        self.violations: List[str] = []
+
+    @property
+    def transfers(self) -> int:
+        return self.reads + self.writes
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+        if self.realtime:
+            time.sleep(seconds)
+
+    def _transfer(self, category: int) -> None:
+        self.now += self.latency
+        if self.realtime and self.latency:
+            time.sleep(self.latency)
+        if self.stats is not None:
+            self.stats.record(category, round(self.latency * 1e9))
+
+    def get_serial(self) -> Optional[str]:
+        return self.serial
+
+    def count(self, name: str, increase: int) -> None:
+        """Increases the statistics counter `name`"""
+        i = STAT_INDEX[name]
+        self.counters[i] = (self.counters[i] + increase) & STAT_ROLLOVER[i]
+
+    def read_stats_block(self) -> bytes:
+        self._transfer(self._category)
+        self.reads += 1
+        return STATS_BLOCK.pack(*self.counters)
+
+    def read_reg(self, address: int) -> int:
+        if address != address & 0xfff:
+            raise ValueError("Address must be an unsigned 12-bit integer")
+        self._transfer(self._category)
+        self.reads += 1
+        if address in self._busy:
+            self._busy[address] -= 1
+            if self._busy[address] < 0 and self.now >= self._busy_until.get(address, 0.0):
+                del self._busy[address]
+                self.regs[address] &= ~(0x80000000 if address == E2P_CMD else 1)
+        if address in self._pending_en:
+            en, left = self._pending_en[address]
+            if left <= 0:
+                del self._pending_en[address]
+                self._set_enabled(address, en)
+            else:
+                self._pending_en[address] = (en, left - 1)
+        return self.regs.get(address, 0)
+
+    def write_reg(self, address: int, value: int) -> None:
+        if value != value & 0xffffffff:
+            raise ValueError("Value must be an unsigned 32-bit integer")
+        if address != address & 0xfff:
+            raise ValueError("Address must be an unsigned 12-bit integer")
+        self._transfer(self._category or CAT_REG_WRITE)
+        self.writes += 1
+        if address == MII_ACC:
+            self._mii_command(value)
+        elif address == E2P_CMD:
+            self._eeprom_command(value)
+        elif address in (MAC_RX, MAC_TX):
+            self._txrx_write(address, value)
+        elif address == MAC_CR:
+            old = self.regs.get(MAC_CR, 0)
+            if (old ^ value) & 0x0006 and (self.regs[MAC_RX] & 1 or self.regs[MAC_TX] & 1):
+                self.violations.append("MAC speed changed while RX/TX enabled")
+            self.regs[address] = value
+        elif address == 0x000:
+            pass  # read-only
+        else:
+            self.regs[address] = value
+
+    def _mii_command(self, value: int) -> None:
+        if self.regs.get(MII_ACC, 0) & 1:
+            self.violations.append("MII_ACC written while busy")
+            return
+        if value & 1:
+            phy_addr = (value >> 11) & 0x1f
+            reg = (value >> 6) & 0x1f
+            if value & 2:
+                if phy_addr == self.phy_addr:
+                    self.phy.write_c22(reg, self.regs.get(MII_DATA, 0) & 0xffff, self.now)
+            elif phy_addr == self.phy_addr:
+                self.regs[MII_DATA] = self.phy.read_c22(reg, self.now)
+            else:
+                self.regs[MII_DATA] = 0xffff
+            self._busy[MII_ACC] = self.mii_busy_cycles
+        self.regs[MII_ACC] = value
+
+    def _eeprom_command(self, value: int) -> None:
+        if self.regs.get(E2P_CMD, 0) & 0x80000000:
+            self.violations.append("E2P_CMD written while busy")
+            return
+        if value & 0x80000000:
+            cmd = (value >> 28) & 0b111
+            addr = value & 0x1ff
+            data = self.regs.get(E2P_DATA, 0) & 0xff
+            if addr >= len(self.eeprom):
+                value |= 0x400  # timeout
+            elif cmd == 0b000:  # READ
+                self.regs[E2P_DATA] = self.eeprom[addr]
+            elif cmd == 0b001:  # EWDS
+                self.eeprom_write_enabled = False
+            elif cmd == 0b010:  # EWEN
+                self.eeprom_write_enabled = True
+            elif not self.eeprom_write_enabled:
+                pass
+            elif cmd == 0b011:  # WRITE
+                self.eeprom[addr] = data
+            elif cmd == 0b100:  # WRAL
+                self.eeprom[:] = bytes([data]) * len(self.eeprom)
+            elif cmd == 0b101:  # ERASE
+                self.eeprom[addr] = 0xff
+            elif cmd == 0b110:  # ERAL
+                self.eeprom[:] = b'\xff' * len(self.eeprom)
+            self._busy[E2P_CMD] = self.eeprom_busy_cycles
+            if 0b011 <= cmd <= 0b110:
+                self._busy_until[E2P_CMD] = self.now + self.eeprom_write_time
+        self.regs[E2P_CMD] = value
+
+    def _txrx_write(self, address: int, value: int) -> None:
+        old = self.regs.get(address, 0)
+        new = (value & ~3) | (old & 3)
+        if value & 2:
+            new &= ~2  # write one to clear the disabled status
+        self.regs[address] = new
+        if (value ^ old) & 1:
+            self._pending_en[address] = (value & 1, self.txrx_busy_cycles)
+            if self.txrx_busy_cycles == 0:
+                self._set_enabled(address, value & 1)
+                del self._pending_en[address]
+        else:
+            self._pending_en.pop(address, None)
+
+    def _set_enabled(self, address: int, en: int) -> None:
+        reg = self.regs.get(address, 0)
+        if en:
+            self.regs[address] = reg | 1
+        else:
+            self.regs[address] = (reg & ~1) | 2
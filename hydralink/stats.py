@@ -0,0 +1,75 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Counters and latency histograms of register transfers.
+
+Every transfer is attributed to one category. Plain register accesses are
+`reg_read` or `reg_write`; transfers issued on behalf of an MDIO or EEPROM
+transaction are attributed to that transaction, and every read made while
+waiting for a busy flag counts as a `poll` iteration.
+"""
+
+from typing import Dict, List, NamedTuple
+
+CAT_REG_READ = 0
+CAT_REG_WRITE = 1
+CAT_MDIO_C22 = 2
+CAT_MDIO_C45 = 3
+CAT_EEPROM = 4
+CAT_POLL = 5
+CATEGORIES = ('reg_read', 'reg_write', 'mdio_c22', 'mdio_c45', 'eeprom', 'poll')
+
+# Histogram bucket `i` counts the transfers which took at least 2**(i-1) µs
+# and less than 2**i µs, the last bucket counts everything slower.
+HISTOGRAM_BUCKETS = 24
+
+
+class CategoryStats(NamedTuple):
+    transfers: int
+    # Total, minimum and maximum duration of the transfers, in seconds
+    total: float
+    min: float
+    max: float
+    histogram: List[int]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.transfers if self.transfers else 0.0
+
+
+class TransferStats:
+    """Transfer counters, cheap enough to be always enabled"""
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        n = len(CATEGORIES)
+        self._count = [0] * n
+        self._total_ns = [0] * n
+        self._min_ns = [0] * n
+        self._max_ns = [0] * n
+        self._histogram = [[0] * HISTOGRAM_BUCKETS for i in range(n)]
+
+    def record(self, category: int, duration_ns: int) -> None:
+        count = self._count[category]
+        self._count[category] = count + 1
+        self._total_ns[category] += duration_ns
+        if count == 0 or duration_ns < self._min_ns[category]:
+            self._min_ns[category] = duration_ns
+        if duration_ns > self._max_ns[category]:
+            self._max_ns[category] = duration_ns
+        bucket = min((duration_ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self._histogram[category][bucket] += 1
+
+    @property
+    def transfers(self) -> int:
+        return sum(self._count)
+
+    def snapshot(self) -> Dict[str, CategoryStats]:
+        return {name: CategoryStats(self._count[i],
+                                    self._total_ns[i] * 1e-9,
+                                    self._min_ns[i] * 1e-9,
+                                    self._max_ns[i] * 1e-9,
+                                    list(self._histogram[i]))
+                for i, name in enumerate(CATEGORIES)}
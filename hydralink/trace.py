@@ -0,0 +1,335 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Recording and replay of the register transfers of a HydraLink.
+
+`TraceRecorder` wraps any `LAN7801_LL` and records every transfer: address,
+value, start time and latency, from the clock of the wrapped device. The
+trace can be saved in a compact binary format and served back by
+`LAN7801_Replay`, so the code paths of `HydraLink`, `LAN7801` and `BCM89881`
+can be run again offline, e.g. on a trace of a device which fails in the
+field. The replay checks that the same transfers are issued in the same
+order, and raises `ReplayError` at the first one which differs. Its clock
+follows the trace, and with `timing` it also waits for the recorded latency
+of every transfer.
+
+`diff_traces` compares two traces of the same operation: the number of
+transfers, and the registers which end up with a different value. Writes to
+the PHY and the EEPROM are decoded from the MDIO and EEPROM commands, so an
+optimization can show that it issues fewer transfers while writing the same
+values.
+"""
+
+import struct
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from hydralink.lan7801 import LAN7801_LL, MMD_ADDRESS
+from hydralink.stats import CAT_REG_WRITE
+
+TRACE_READ = 0
+TRACE_WRITE = 1
+# Read of the statistics block, the data follows the record
+TRACE_STATS = 2
+_KINDS = ('read', 'write', 'stats')
+
+_BIN_MAGIC = b'HLTRACE'
+_BIN_VERSION = 1
+# magic, version, wall clock time of the start, serial length
+_BIN_HEADER = struct.Struct('<7sBdB')
+# kind, category, address, value (length of the data for TRACE_STATS),
+# start of the transfer since the start of the trace, latency
+_BIN_RECORD = struct.Struct('<BBHIdd')
+
+MII_ACC = 0x120
+MII_DATA = 0x124
+E2P_CMD = 0x040
+E2P_DATA = 0x044
+
+
+class TraceRecord(NamedTuple):
+    kind: int
+    category: int
+    address: int
+    value: int
+    # Start of the transfer since the start of the trace, and its duration,
+    # in seconds
+    time: float
+    latency: float
+    data: bytes = b''
+
+    def describe(self) -> str:
+        return '%s 0x%03x = 0x%08x' % (_KINDS[self.kind], self.address, self.value)
+
+
+class Trace(NamedTuple):
+    serial: Optional[str]
+    # Wall clock time of the start of the recording
+    timestamp: float
+    records: List[TraceRecord]
+
+    @property
+    def duration(self) -> float:
+        return self.records[-1].time + self.records[-1].latency if self.records else 0.0
+
+    def count(self, kind: int) -> int:
+        return sum(r.kind == kind for r in self.records)
+
+    def to_bytes(self) -> bytes:
+        serial = (self.serial or '').encode()
+        if len(serial) > 0xff:
+            raise ValueError("Serial number too long")
+        parts = [_BIN_HEADER.pack(_BIN_MAGIC, _BIN_VERSION, self.timestamp, len(serial)), serial]
+        for r in self.records:
+            parts.append(_BIN_RECORD.pack(r.kind, r.category, r.address,
+                                          len(r.data) if r.kind == TRACE_STATS else r.value, r.time, r.latency))
+            parts.append(r.data)
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'Trace':
+        magic, version, timestamp, serial_len = _BIN_HEADER.unpack_from(data)
+        if magic != _BIN_MAGIC or version != _BIN_VERSION:
+            raise ValueError("Not a HydraLink trace")
+        offset = _BIN_HEADER.size
+        serial = data[offset:offset + serial_len].decode()
+        offset += serial_len
+        records = []
+        while offset < len(data):
+            kind, category, address, value, t, latency = _BIN_RECORD.unpack_from(data, offset)
+            offset += _BIN_RECORD.size
+            payload = b''
+            if kind == TRACE_STATS:
+                payload = data[offset:offset + value]
+                offset += value
+            records.append(TraceRecord(kind, category, address, value, t, latency, payload))
+        return Trace(serial or None, timestamp, records)
+
+
+def save_trace(trace: Trace, path: str) -> None:
+    with open(path, 'wb') as f:
+        f.write(trace.to_bytes())
+
+
+def load_trace(path: str) -> Trace:
+    with open(path, 'rb') as f:
+        return Trace.from_bytes(f.read())
+
+
+class TraceRecorder(LAN7801_LL):
+    def __init__(self, dev: LAN7801_LL) -> None:
+        """Records the transfers to `dev`, which is accessed through the
+        recorder only. Sleeps and the clock are passed on to `dev`."""
+        self.dev = dev
+        self.records: List[TraceRecord] = []
+        self._start = dev.monotonic()
+        self._timestamp = time.time()
+        self._serial = dev.get_serial()
+
+    def trace(self) -> Trace:
+        return Trace(self._serial, self._timestamp, list(self.records))
+
+    def _record(self, kind: int, category: int, address: int, value: int, t0: float, data: bytes = b'') -> None:
+        t1 = self.dev.monotonic()
+        self.records.append(TraceRecord(kind, category, address, value, t0 - self._start, t1 - t0, data))
+        if self.stats is not None:
+            self.stats.record(category, round((t1 - t0) * 1e9))
+
+    def read_reg(self, address: int) -> int:
+        category = self.dev._category = self._category
+        t0 = self.dev.monotonic()
+        value = self.dev.read_reg(address)
+        self._record(TRACE_READ, category, address, value, t0)
+        return value
+
+    def write_reg(self, address: int, value: int) -> None:
+        category = self.dev._category = self._category or CAT_REG_WRITE
+        t0 = self.dev.monotonic()
+        self.dev.write_reg(address, value)
+        self._record(TRACE_WRITE, category, address, value, t0)
+
+    def read_stats_block(self) -> bytes:
+        category = self.dev._category = self._category
+        t0 = self.dev.monotonic()
+        data = self.dev.read_stats_block()
+        self._record(TRACE_STATS, category, 0, len(data), t0, data)
+        return data
+
+    def get_serial(self) -> Optional[str]:
+        return self._serial
+
+    def monotonic(self) -> float:
+        return self.dev.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        self.dev.sleep(seconds)
+
+
+class ReplayError(IOError):
+    """The replayed code issued a transfer which is not in the trace"""
+
+
+class LAN7801_Replay(LAN7801_LL):
+    def __init__(self, trace: Trace, timing: bool = False) -> None:
+        """Serves the transfers of `trace`. The clock of the device is the
+        time of the trace; with `timing`, every transfer also completes at
+        its recorded time after the creation of the replay."""
+        self.trace = trace
+        self.timing = timing
+        self.position = 0
+        self.now = 0.0
+        self._wall_start = time.perf_counter()
+
+    @property
+    def remaining(self) -> int:
+        """Number of recorded transfers which were not replayed"""
+        return len(self.trace.records) - self.position
+
+    def _next(self, kind: int, category: int, address: int, value: Optional[int] = None) -> TraceRecord:
+        n = self.position
+        expected = '%s 0x%03x' % (_KINDS[kind], address) + ('' if value is None else ' = 0x%08x' % value)
+        if n >= len(self.trace.records):
+            raise ReplayError(f"Transfer {n}: {expected} after the end of the trace")
+        r = self.trace.records[n]
+        if r.kind != kind or r.address != address or (value is not None and r.value != value):
+            raise ReplayError(f"Transfer {n}: {expected} instead of {r.describe()}")
+        self.position += 1
+        end = r.time + r.latency
+        if self.timing:
+            delay = end - (time.perf_counter() - self._wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        self.now = max(self.now, end)
+        if self.stats is not None:
+            self.stats.record(category, round(r.latency * 1e9))
+        return r
+
+    def read_reg(self, address: int) -> int:
+        return self._next(TRACE_READ, self._category, address).value
+
+    def write_reg(self, address: int, value: int) -> None:
+        self._next(TRACE_WRITE, self._category or CAT_REG_WRITE, address, value)
+
+    def read_stats_block(self) -> bytes:
+        return self._next(TRACE_STATS, self._category, 0).data
+
+    def get_serial(self) -> Optional[str]:
+        return self.trace.serial
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        # With timing, the next transfer waits for its recorded time instead
+        self.now += seconds
+
+
+def register_values(trace: Trace) -> Tuple[Dict[str, int], Set[str]]:
+    """Decodes the register values seen in `trace`, and returns the last
+    value of every register and the names of the registers written.
+
+    MAC registers are named by address, e.g. `0b0`; PHY registers as
+    `devad.register` for Clause 45 and as `c22.register`; EEPROM bytes as
+    `eeprom.address`. The MDIO and EEPROM command and data registers are
+    not listed themselves.
+    """
+    values: Dict[str, int] = {}
+    written: Set[str] = set()
+    mii_data = e2p_data = 0
+    mmd_ctrl = 0
+    mmd_addr: Dict[int, int] = {}
+    # Register whose value is read from MII_DATA or E2P_DATA next
+    pending: Dict[int, str] = {}
+
+    def store(name: str, value: int, write: bool) -> None:
+        values[name] = value
+        if write:
+            written.add(name)
+
+    def mmd_data(write: bool) -> str:
+        devad = mmd_ctrl & 0x1f
+        addr = mmd_addr.get(devad, 0)
+        function = mmd_ctrl >> 14
+        if function == 2 or (function == 3 and write):
+            mmd_addr[devad] = (addr + 1) & 0xffff
+        return '%d.%04x' % (devad, addr)
+
+    for r in trace.records:
+        if r.kind == TRACE_READ:
+            if r.address in pending:
+                store(pending.pop(r.address), r.value & (0xffff if r.address == MII_DATA else 0xff), False)
+            elif r.address not in (MII_ACC, MII_DATA, E2P_CMD, E2P_DATA):
+                store('%03x' % r.address, r.value, False)
+        elif r.kind != TRACE_WRITE:
+            continue
+        elif r.address == MII_DATA:
+            mii_data = r.value & 0xffff
+        elif r.address == E2P_DATA:
+            e2p_data = r.value & 0xff
+        elif r.address == MII_ACC and r.value & 1:
+            reg = (r.value >> 6) & 0x1f
+            write = bool(r.value & 2)
+            if reg == 0xd:
+                if write:
+                    mmd_ctrl = mii_data & 0xc01f
+            elif reg == 0xe and (mmd_ctrl & 0xc000) == MMD_ADDRESS:
+                if write:
+                    mmd_addr[mmd_ctrl & 0x1f] = mii_data
+            else:
+                name = mmd_data(write) if reg == 0xe else 'c22.%02x' % reg
+                if write:
+                    store(name, mii_data, True)
+                else:
+                    pending[MII_DATA] = name
+        elif r.address == E2P_CMD and r.value & 0x80000000:
+            cmd = (r.value >> 28) & 0b111
+            addr = r.value & 0x1ff
+            if cmd == 0b000:  # READ
+                pending[E2P_DATA] = 'eeprom.%03x' % addr
+            elif cmd in (0b011, 0b101):  # WRITE, ERASE
+                store('eeprom.%03x' % addr, e2p_data if cmd == 0b011 else 0xff, True)
+            elif cmd in (0b100, 0b110):  # WRAL, ERAL
+                for a in range(0x200):
+                    store('eeprom.%03x' % a, e2p_data if cmd == 0b100 else 0xff, True)
+        elif r.address not in (MII_ACC, E2P_CMD):
+            store('%03x' % r.address, r.value, True)
+    return values, written
+
+
+class TraceDiff(NamedTuple):
+    # Counts of the traces a and b
+    transfers: Tuple[int, int]
+    reads: Tuple[int, int]
+    writes: Tuple[int, int]
+    duration: Tuple[float, float]
+    # (register, value in a, value in b) of every register written in either
+    # trace which ends up with a different value; None if it is not known
+    changes: List[Tuple[str, Optional[int], Optional[int]]]
+
+    def describe(self) -> str:
+        lines = ["%-10s %10s %10s" % ('', 'a', 'b')]
+        for name in ('transfers', 'reads', 'writes'):
+            a, b = getattr(self, name)
+            lines.append("%-10s %10d %10d" % (name, a, b))
+        lines.append("%-10s %10.3f %10.3f" % ('time (ms)', self.duration[0] * 1e3, self.duration[1] * 1e3))
+        for name, a, b in self.changes:
+            lines.append("%s: %s -> %s" % (name, '-' if a is None else '%x' % a, '-' if b is None else '%x' % b))
+        if not self.changes:
+            lines.append("Same register values written")
+        return '\n'.join(lines)
+
+
+def diff_traces(a: Trace, b: Trace) -> TraceDiff:
+    """Compares two traces. A register written in one trace only, with the
+    value that the other trace read from it, is not a change."""
+    values_a, written_a = register_values(a)
+    values_b, written_b = register_values(b)
+    changes = [(name, values_a.get(name), values_b.get(name))
+               for name in sorted(written_a | written_b)
+               if values_a.get(name) != values_b.get(name)]
+    return TraceDiff((len(a.records), len(b.records)),
+                     (a.count(TRACE_READ) + a.count(TRACE_STATS), b.count(TRACE_READ) + b.count(TRACE_STATS)),
+                     (a.count(TRACE_WRITE), b.count(TRACE_WRITE)),
+                     (a.duration, b.duration),
+                     changes)
@@ -0,0 +1,52 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Guards the number of USB transfers of the hot paths and the modules loaded
+# at startup of the command line. If a change reduces the transfers,
+# update the baseline with:
+#   python -m hydralink.benchmark --save test/benchmark_baseline.json
+# The startup time depends on the machine, check it against its budget with:
+#   python -m hydralink.benchmark --startup
+
+import os
+
+from hydralink.benchmark import (DESTRUCTIVE_BENCHMARKS, STARTUP_EXCLUDED, load_results, run_benchmarks,
+                                 simulated_device, startup_modules)
+from hydralink.simulator import LAN7801_Sim
+from hydralink.trace import TraceRecorder
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+
+def test_transfer_counts() -> None:
+    baseline = load_results(BASELINE)
+    results = run_benchmarks()
+    assert results.keys() == baseline.keys()
+    for name, r in results.items():
+        assert r.transfers == baseline[name].transfers, name
+
+
+def test_destructive_skipped() -> None:
+    # Seen through a recorder, the simulator looks like a real device
+    def device() -> TraceRecorder:
+        return TraceRecorder(simulated_device())
+
+    names = ['eeprom_read'] + DESTRUCTIVE_BENCHMARKS
+    assert list(run_benchmarks(device, 1, names)) == ['eeprom_read']
+    assert list(run_benchmarks(device, 1, names, destructive=True)) == names
+
+
+def test_block_write_restores() -> None:
+    sim = simulated_device()
+    assert isinstance(sim, LAN7801_Sim)
+    sim.phy.c45[1, 0x9305] = 0x1234
+    run_benchmarks(lambda: sim, 3, ['write_mdio_block_c45'])
+    # The vendor registers keep their values, not the operation counter
+    assert sim.phy.c45[1, 0x9305] == 0x1234 and sim.phy.c45[1, 0x930f] == 0
+
+
+def test_startup() -> None:
+    loaded = startup_modules(['--help'])
+    assert 'hydralink' in loaded
+    assert [name for name in STARTUP_EXCLUDED if name in loaded] == []
@@ -12,7 +12,7 @@ from typing import Optional, cast
 from hydralink.hydralink import HydraLink
 from hydralink.gui import get_hydralinks, hydralink_by_serial
 from hydralink.lan7801_libusb import LAN7801_LibUSB
-from glob import glob
+from hydralink.discovery import SYSFS_USB_DEVICES, scan_device, usb_sysname
 import subprocess
 
 
@@ -21,21 +21,13 @@ REFERENCE_HYDRALINK = 'dscthl_00000'  # known working
 
 def get_netif_by_hydralink(hl: HydraLink) -> Optional[str]:
     dev = cast(LAN7801_LibUSB, hl.mac.dev).dev
-    nets = glob('/sys/bus/usb/drivers/lan78xx/'+(
-            str(dev.bus)+'-'+'.'.join([str(n) for n in dev.port_numbers])
-            )+':**/net/**/')
-    if len(nets) > 1:
-        raise Exception("More than one LAN78xx has the same interface name!")
-    if len(nets) == 0:
-        return None
-    net = nets[0]
-    return net.split('/')[-2]
+    info = scan_device(SYSFS_USB_DEVICES, usb_sysname(dev.bus, dev.port_numbers))
+    return None if info is None else info.netif
 
 
 def reset_hydralink(hl: HydraLink) -> Optional[str]:
     dev = cast(LAN7801_LibUSB, hl.mac.dev).dev
-    name = str(dev.bus)+'-'+'.'.join([str(n) for n in dev.port_numbers])
-    name += ":1.0"
+    name = usb_sysname(dev.bus, dev.port_numbers) + ":1.0"
     with open('/sys/bus/usb/drivers/lan78xx/unbind', 'w') as fd:
         fd.write(name)
     with open('/sys/bus/usb/drivers/lan78xx/bind', 'w') as fd:
@@ -102,7 +94,8 @@ class TestEnv:
         self.hl0.setup(master=not master, speed=speed)
         self.hl1.setup(master=master, speed=speed)
         eff_speed = speed*93//100
-        time.sleep(0.1)
+        self.hl0.wait_for_link()
+        self.hl1.wait_for_link()
         FILENAME = '/tmp/hydralink_test_results.json'
         with open(FILENAME, 'w+') as fd:
             subprocess.check_call(
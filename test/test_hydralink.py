@@ -0,0 +1,795 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import errno
+import pathlib
+import random
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+from hydralink.aio import AsyncHydraLink
+from hydralink.config import DeviceState, HydraLinkConfig, plan_config
+from hydralink.counters import STAT_INDEX, StatsHistory
+from hydralink.daemon import DaemonClient, DaemonError, HydraLinkDaemon
+from hydralink.discovery import (EVENTS_LOST, DiscoveryIndex, EventQueue, NetlinkEvents, interface_map, parse_uevent,
+                                 resolve_netif, usb_device_name, usb_sysname)
+from hydralink.exporter import Exporter, Sampler, parse_address
+from hydralink.health import HEALTH_FIELDS, Field, HealthEvent, HealthMonitor, PhyHealth, read_health
+from hydralink.dump import PHY_REGISTER_RANGES, load_snapshot, read_snapshot, save_snapshot
+from hydralink.hydralink import LINK_POLL, HydraLink, SetupReport
+from hydralink.lan7801 import OP_WRITE
+from hydralink.multi import configure_many
+from hydralink.pool import HydraLinkPool
+from hydralink.profile import (BootProfile, has_boot_profile, header_descriptors, read_boot_profile,
+                               write_boot_profile)
+from hydralink.simulator import BCM89881_Model, LAN7801_Sim
+from hydralink.trace import (TRACE_STATS, LAN7801_Replay, ReplayError, Trace, TraceRecorder, diff_traces, load_trace,
+                             register_values, save_trace)
+
+
+@pytest.fixture(params=[0, 3], ids=['fast', 'busy'])
+def sim(request: pytest.FixtureRequest) -> LAN7801_Sim:
+    busy = request.param
+    return LAN7801_Sim(mii_busy_cycles=busy, eeprom_busy_cycles=busy, txrx_busy_cycles=busy)
+
+
+def test_identity() -> None:
+    sim = LAN7801_Sim()
+    sim.regs[0x000] = 0x78000002
+    with pytest.raises(IOError):
+        HydraLink(sim)
+    phy = BCM89881_Model()
+    phy.c45[1, 2] = 0x1234
+    with pytest.raises(IOError):
+        HydraLink(LAN7801_Sim(phy=phy))
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_setup(sim: LAN7801_Sim, cache: bool) -> None:
+    hl = HydraLink(sim, cache=cache)
+    hl.verbose = False
+
+    hl.setup(master=True, speed=100, mac_addr='02:00:00:12:34:56', promiscuous=True)
+    assert hl.phy.get_speed() == 100
+    assert hl.phy.get_master()
+    assert hl.mac.get_speed() == 1
+    assert sim.regs[0x100] & 0x0800 == 0
+    assert sim.regs[0x0b0] == 0x1f80
+    assert (sim.regs[0x118], sim.regs[0x11c]) == (0x0200, 0x00123456)
+    assert sim.regs[0x104] & 1 and sim.regs[0x108] & 1
+    assert sim.phy.c45[1, 0xa027] == 0x0f15
+    assert not sim.phy.in_reset()
+
+    hl.setup(master=False, speed=1000, promiscuous=False)
+    assert hl.phy.get_speed() == 1000
+    assert not hl.phy.get_master()
+    assert hl.mac.get_speed() == 2
+    assert sim.regs[0x0b0] == 0x1c8a
+
+    assert sim.violations == [] and sim.phy.violations == []
+
+    with pytest.raises(ValueError):
+        hl.setup(speed=10)
+
+
+def test_incremental_setup(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    hl.verbose = False
+    report = hl.setup(master=True, speed=100, promiscuous=False, incremental=True)
+    assert report.phy_reset and report.changed == ('init', 'mac_speed', 'phy_speed', 'master')
+
+    report = hl.setup(master=True, speed=100, promiscuous=False, incremental=True)
+    assert report == SetupReport((), False) and sim.phy.resets == 1
+
+    # MAC-only settings do not drop the link
+    report = hl.setup(master=True, speed=100, promiscuous=True, mac_addr='02:00:00:00:00:01', incremental=True)
+    assert report == SetupReport(('promiscuous', 'mac_addr'), False) and sim.phy.resets == 1
+    assert sim.regs[0x0b0] == 0x1f80
+
+    report = hl.setup(master=False, incremental=True)
+    assert report == SetupReport(('master',), True) and not hl.phy.get_master()
+    assert hl.setup(incremental=True).changed == ()
+    sim.phy.c45[1, 0] |= 0x8000
+    assert hl.setup(incremental=True).changed == ('release',) and not sim.phy.in_reset()
+
+    assert hl.setup().changed == ('release', 'init')
+    assert sim.violations == [] and sim.phy.violations == []
+
+
+def test_plan() -> None:
+    state = DeviceState({0x010: 0, 0x100: 0x0800, 0x104: 0x00020001, 0x108: 0x00000001},
+                        {(1, 0x0000): 0x2000, (1, 0x0834): 0x8000})
+    plan = plan_config(HydraLinkConfig(master=True, speed=1000), state)
+    assert plan.phy_reset and plan.changed == ('release', 'init', 'mac_speed', 'phy_speed', 'master')
+    steps = [str(step) for step in plan.steps]
+    # The PHY is held in reset, and TX/RX disabled, while reconfiguring
+    assert steps[:5] == ["write 1.0000 = a000",
+                         "write 104 = 00020002", "write 108 = 00000002",
+                         "poll  104 & 00000001 == 00000000", "poll  108 & 00000001 == 00000000"]
+    assert steps.index("write 100 = 00000004") < steps.index("write 104 = 00020003")
+    assert steps.index("write 1.0000 = 8040") < steps.index("write 1.0834 = c000")
+    # The link status latches are cleared once the PHY is released
+    assert steps[-7:] == ["write 104 = 00020003", "write 108 = 00000003",
+                          "poll  104 & 00000001 == 00000001", "poll  108 & 00000001 == 00000001",
+                          "write 1.0000 = 0040", "read  1.0001", "read  3.0001"]
+    # Only the TX/RX enables and the PHY reset are written more than once
+    writes = [step for step in plan.steps if step.kind == OP_WRITE]
+    assert len({(s.devad, s.address) for s in writes}) == len(writes) - 4
+
+    sim = LAN7801_Sim()
+    hl = HydraLink(sim)
+    hl.verbose = False
+    plan = hl.plan(HydraLinkConfig(master=True, speed=100))
+    assert sim.phy.c45[1, 0x0834] == 0x8000
+    # The plan is applied as estimated, and dry runs do not disturb the
+    # MMD access tracking
+    transfers = sim.transfers
+    assert hl.apply(plan).changed == plan.changed
+    assert sim.transfers - transfers == plan.transfers
+    assert hl.phy.get_master() and hl.phy.get_speed() == 100 and hl.mac.get_speed() == 1
+    assert sim.violations == [] and sim.phy.violations == []
+
+    # A dry run leaves the cache as it was
+    hl = HydraLink(sim, cache=True)
+    hl.verbose = False
+    hl.setup(master=True, speed=100)
+    hl.plan(HydraLinkConfig(master=False, speed=1000), incremental=True)
+    assert hl.phy.cached((1, 0x0834)) == 0xc000 and hl.phy.cached((1, 0x0000)) == 0x2000
+    reads = sim.reads
+    hl.plan(HydraLinkConfig(master=False, speed=1000), incremental=True)
+    # Only the volatile MAC registers are read again
+    assert sim.reads - reads == 2
+
+
+def test_wait_for_link() -> None:
+    sim = LAN7801_Sim(phy=BCM89881_Model(link_delay=0.25), latency=125e-6)
+    hl = HydraLink(sim)
+    hl.verbose = False
+    report = hl.setup(master=True, speed=1000, wait_link=True)
+    assert report.time_to_link is not None and 0.25 <= report.time_to_link < 0.3
+    # The link is seen by the first poll after it came up, the stale latches
+    # of the PHY reset cost no extra interval
+    assert sim.phy.link_up_at is not None and 0 <= sim.now - sim.phy.link_up_at < LINK_POLL.max_interval + 0.001
+    # Polling backs off instead of hammering the bus
+    assert sim.transfers < 1000
+
+    # Without a PHY reset, the link is usable right away
+    report = hl.setup(master=True, speed=1000, incremental=True, wait_link=True)
+    assert report.time_to_link is not None and report.time_to_link < 0.01
+
+    sim.phy.write_c45(1, 0, 0x8040, sim.now)
+    with pytest.raises(TimeoutError):
+        hl.wait_for_link(0.5)
+    assert hl.link_status() == (False, True)
+
+    # The PMA/PMD and PCS link bits latch independently
+    sim.phy.write_c45(1, 0, 0x0040, sim.now)
+    sim.phy.write_c45(1, 0, 0x8040, sim.now)
+    sim.phy.write_c45(1, 0, 0x0040, sim.now)
+    sim.sleep(0.5)
+    assert hl.phy[1, 0x0001] == 0 and hl.phy[1, 0x0001] == 0x0004
+    assert hl.phy[3, 0x0001] == 0 and hl.phy[3, 0x0001] == 0x0004
+
+
+def test_eeprom(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    hl.mac.eeprom_write(0x10, 0xa5)
+    assert hl.mac.eeprom_read(0x10) == 0xa5
+    assert sim.eeprom[0x10] == 0xa5 and not sim.eeprom_write_enabled
+    hl.mac.eeprom_erase_all()
+    assert hl.mac.eeprom_read(0x10) == 0xff
+    assert sim.violations == []
+
+
+def test_eeprom_image(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    image = bytes(range(256)) * 2
+    assert hl.mac.write_image(image) == 510  # two bytes are 0xff already
+    assert bytes(sim.eeprom) == image and not sim.eeprom_write_enabled
+    assert hl.mac.read_image(16) == image[:16]
+
+    # Only the changed bytes are programmed, within one write enable:
+    # EWEN, two times data and WRITE, EWDS, after reading the image
+    image = image[:0x10] + b'\xa5\x5a' + image[0x12:]
+    writes = sim.writes
+    assert hl.mac.write_image(image, verify=False) == 2
+    assert sim.writes - writes == 512 + 1 + 2 * 2 + 1
+    assert bytes(sim.eeprom) == image and sim.violations == []
+
+    with pytest.raises(ValueError):
+        hl.mac.write_image(bytes(513))
+
+
+def test_boot_profile(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    hl.verbose = False
+    profile = BootProfile(master=True, speed=1000, mac_addr='02:00:00:AB:CD:EF')
+    assert read_boot_profile(hl.mac) is None and hl.setup_from_boot_profile() is None
+    assert not has_boot_profile(hl.mac, profile)
+
+    write_boot_profile(hl.mac, profile)
+    assert has_boot_profile(hl.mac, profile)
+    assert not has_boot_profile(hl.mac, profile._replace(master=False))
+    assert read_boot_profile(hl.mac) == profile._replace(mac_addr='02:00:00:ab:cd:ef')
+    # Without the LAN7801 signature, the configuration area is left alone
+    assert sim.eeprom[:7] == b'\xff' * 7
+    assert write_boot_profile(hl.mac, profile) == 0
+
+    sim.eeprom[0] = 0xa5
+    assert not has_boot_profile(hl.mac, profile)
+    write_boot_profile(hl.mac, profile)
+    assert sim.eeprom[:7] == bytes.fromhex('a5020000abcdef') and has_boot_profile(hl.mac, profile)
+
+    assert hl.setup_from_boot_profile() == read_boot_profile(hl.mac)
+    assert hl.phy.get_master() and hl.phy.get_speed() == 1000
+    assert (sim.regs[0x118], sim.regs[0x11c]) == (0x0200, 0x00abcdef)
+
+    sim.eeprom[-1] ^= 1
+    assert read_boot_profile(hl.mac) is None
+
+
+def test_boot_profile_strings(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    manufacturer = b'\x12\x03' + 'dissecto'.encode('utf-16-le')
+    product = b'\x14\x03' + 'HydraLink'.encode('utf-16-le')
+    # Manufacturer string after the header, product string at the end
+    sim.eeprom[:0x16] = bytes.fromhex('a5020000abcdef') + bytes(5) + bytes([0x12, 0x10, 0x14, 0xf6]) + bytes(6)
+    sim.eeprom[0x20:0x32] = manufacturer
+    sim.eeprom[0x1ec:0x200] = product
+    assert header_descriptors(bytes(sim.eeprom[:0x1e])) == [('manufacturer string', 0x20, 0x12),
+                                                            ('product string', 0x1ec, 0x14)]
+    image = bytes(sim.eeprom)
+    with pytest.raises(ValueError, match='product string'):
+        write_boot_profile(hl.mac, BootProfile(speed=1000, mac_addr='02:00:00:00:00:01'))
+    assert bytes(sim.eeprom) == image
+
+    # Elsewhere, the strings are left alone
+    sim.eeprom[0x0f] = 0x80
+    sim.eeprom[0x100:0x114] = product
+    write_boot_profile(hl.mac, BootProfile(speed=1000))
+    assert read_boot_profile(hl.mac) == BootProfile(speed=1000)
+    assert sim.eeprom[0x20:0x32] == manufacturer and sim.eeprom[0x100:0x114] == product
+
+    # So are the custom device and configuration descriptors
+    sim.eeprom[0x18:0x1a] = bytes([0x19, 0xf2])
+    image = bytes(sim.eeprom)
+    with pytest.raises(ValueError, match='high-speed configuration descriptor'):
+        write_boot_profile(hl.mac, BootProfile(speed=100))
+    assert bytes(sim.eeprom) == image
+
+
+def test_async_setup() -> None:
+    sims = [LAN7801_Sim(f'dscthl_{i:05d}', mii_busy_cycles=i) for i in range(4)]
+
+    async def main() -> None:
+        hls = [await AsyncHydraLink.open(sim) for sim in sims]
+        for hl in hls:
+            hl.verbose = False
+        await asyncio.gather(*(hl.setup(master=True, speed=100) for hl in hls))
+        assert await asyncio.gather(*(hl.get_speed() for hl in hls)) == [100] * 4
+        assert all(await asyncio.gather(*(hl.get_master() for hl in hls)))
+
+    asyncio.run(main())
+    assert all(sim.violations == [] for sim in sims)
+
+
+def test_configure_many() -> None:
+    sims = [LAN7801_Sim(f'dscthl_{i:05d}', latency=0.0005, realtime=True) for i in range(8)]
+    broken = LAN7801_Sim('dscthl_broken')
+    broken.regs[0x000] = 0
+    config = HydraLinkConfig(master=True, speed=1000)
+
+    single = configure_many(sims[:1], config)[0]
+    t0 = time.perf_counter()
+    results = configure_many([*sims, broken], config)
+    elapsed = time.perf_counter() - t0
+
+    assert [r.serial for r in results[:8]] == [sim.serial for sim in sims]
+    assert all(r.error is None and r.report is not None and r.report.phy_reset for r in results[:8])
+    assert all(sim.phy.c45[1, 0x0834] & 0x4000 for sim in sims)
+    assert isinstance(results[8].error, IOError) and results[8].report is None
+    # The devices are configured concurrently
+    assert elapsed < 4 * single.duration
+
+
+def test_daemon(tmp_path: pathlib.Path) -> None:
+    sims = {f'dscthl_{i:05d}': LAN7801_Sim(f'dscthl_{i:05d}') for i in range(3)}
+    opened = []
+
+    def opener(device: object) -> HydraLink:
+        opened.append(device)
+        return HydraLink(sims[str(device or 'dscthl_00000')])
+
+    pool = HydraLinkPool(opener, locator=lambda key: str(key or 'dscthl_00000') if str(key or 'dscthl_00000') in sims
+                         else None)
+    daemon = HydraLinkDaemon(str(tmp_path / 'hl.sock'), pool, lister=lambda: list(sims))
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+        with DaemonClient(daemon.path) as client:
+            assert client.request('list') == list(sims)
+            report = client.request('setup', master=True, speed=1000)
+            assert report['phy_reset'] and 'master' in report['changed']
+            plan = client.request('setup', master=True, speed=1000, incremental=True, dry_run=True)
+            assert plan['changed'] == [] and plan['phy_reset'] is False
+            status = client.request('status')
+            assert status['serial'] == 'dscthl_00000' and status['master'] and status['speed'] == 1000
+            dump = client.request('dump', phy=True)
+            assert '"phy"' in dump
+
+            results = client.request('setup', devices=list(sims) + ['missing'], speed=100)
+            assert [r['ok'] for r in results] == [True, True, True, False]
+            assert all(sim.phy.c45[1, 0x0000] & 0x2040 == 0x2000 for sim in sims.values())
+
+            with pytest.raises(DaemonError, match='Unknown command'):
+                client.request('reboot')
+            with pytest.raises(DaemonError, match='Speed'):
+                client.request('setup', speed=10)
+        # The devices stay open across connections
+        with DaemonClient(daemon.path) as client:
+            client.request('status')
+        # The default device is not opened again by its serial number
+        assert opened.count(None) == 1 and 'dscthl_00000' not in opened
+    finally:
+        daemon.shutdown()
+        thread.join()
+    assert not (tmp_path / 'hl.sock').exists()
+
+
+def test_pool() -> None:
+    sims = {'dscthl_00001': LAN7801_Sim('dscthl_00001'), 'eth1': LAN7801_Sim('dscthl_00002')}
+    locations = {'dscthl_00001': (1, 5), 'eth1': (2, 3)}
+    pool = HydraLinkPool(lambda key: HydraLink(sims[str(key)]), locator=lambda key: locations.get(str(key)))
+
+    hl = pool.get('dscthl_00001')
+    reads = sims['dscthl_00001'].reads
+    assert pool.get('dscthl_00001') is hl
+    # A hit neither looks the device up nor verifies it again
+    assert sims['dscthl_00001'].reads == reads
+    pool.get('eth1')
+    assert pool.stats == (1, 2, 0, 0) and len(pool) == 2
+
+    # Replugged: new address, the handle is opened and verified again
+    locations['dscthl_00001'] = (1, 6)
+    assert pool.get('dscthl_00001') is not hl
+    assert sims['dscthl_00001'].reads > reads
+    assert pool.stats.revalidations == 1
+
+    # Unplugged
+    del locations['eth1']
+    assert pool.sweep() == ['eth1']
+    assert 'eth1' not in pool
+    with pytest.raises(FileNotFoundError):
+        pool.get('eth1')
+    assert pool.stats == (1, 3, 1, 1)
+
+    # Every name of a device gets the same handle
+    locations.update({'None': (1, 6), 'eth1': (1, 6)})
+    hl = pool.get('dscthl_00001')
+    assert pool.get(None) is hl and pool.get('eth1') is hl
+    assert len(pool) == 1
+    assert pool.evict('eth1') and 'dscthl_00001' not in pool
+    assert pool.get('dscthl_00001') is not hl
+
+    # Concurrent misses open the device once
+    opened = []
+    release = threading.Event()
+
+    def slow_opener(key: object) -> HydraLink:
+        opened.append(key)
+        release.wait()
+        return HydraLink(sims['eth1'])
+
+    pool = HydraLinkPool(slow_opener, locator=lambda key: (2, 3))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(pool.get, key) for key in ('eth1', 'dscthl_00002')]
+        while not opened:
+            time.sleep(0.001)
+        # Let the second caller find the device being opened
+        time.sleep(0.05)
+        release.set()
+        handles = [future.result() for future in futures]
+    assert handles[0] is handles[1] and len(opened) == 1 and pool.stats == (1, 1, 0, 0)
+
+
+def fake_usb_device(root: pathlib.Path, sysname: str, serial: str, devnum: int,
+                    netif: Optional[str] = None) -> None:
+    path = root / sysname
+    path.mkdir()
+    attrs = {'idVendor': '0424', 'idProduct': '7801', 'serial': serial,
+             'busnum': sysname.split('-')[0], 'devnum': str(devnum)}
+    for name, value in attrs.items():
+        (path / name).write_text(value + '\n')
+    (path / f'{sysname}:1.0').mkdir()
+    if netif is not None:
+        (path / f'{sysname}:1.0' / 'net' / netif).mkdir(parents=True)
+        (path / f'{sysname}:1.0' / 'driver').symlink_to(root / 'lan78xx')
+
+
+def test_discovery(tmp_path: pathlib.Path) -> None:
+    fake_usb_device(tmp_path, '3-1.2', 'dscthl_00001', 7, 'eth1')
+    fake_usb_device(tmp_path, '1-4', 'dscthl_00002', 2)
+    (tmp_path / 'usb3').mkdir()
+    events = EventQueue()
+    index = DiscoveryIndex(str(tmp_path), events)
+
+    assert [info.serial for info in index.devices()] == ['dscthl_00002', 'dscthl_00001']
+    info = index.find('eth1')
+    assert info is not None and info.serial == 'dscthl_00001' and info.port_numbers == (1, 2)
+    assert (info.bus, info.address, info.driver) == (3, 7, 'lan78xx')
+    assert index.find(1) == info
+    # Lookups do not scan sysfs again, unless they find nothing
+    assert index.scans == 1
+    assert index.find('eth2') is None and index.find(2) is None
+    assert index.scans == 3
+
+    # Replugged at another port, and unplugged
+    shutil.rmtree(tmp_path / '3-1.2')
+    fake_usb_device(tmp_path, '3-2', 'dscthl_00001', 8, 'eth1')
+    events.push('remove', '/devices/pci0000:00/0000:00:14.0/usb3/3-1/3-1.2', 'usb')
+    events.push('add', '/devices/pci0000:00/0000:00:14.0/usb3/3-2/3-2:1.0/net/eth1', 'net')
+    shutil.rmtree(tmp_path / '1-4')
+    assert index.find('dscthl_00002') is not None
+    events.push('remove', '/devices/pci0000:00/0000:00:14.0/usb1/1-4', 'usb')
+    assert index.find('dscthl_00002') is None
+    info = index.find('eth1')
+    assert info is not None and (info.sysname, info.address) == ('3-2', 8)
+    assert index.scans == 4
+
+    # Lost events, e.g. after a netlink buffer overflow: sysfs is scanned again
+    fake_usb_device(tmp_path, '1-5', 'dscthl_00003', 3)
+    assert len(index.devices()) == 1
+    events.push(EVENTS_LOST, '')
+    assert [info.serial for info in index.devices()] == ['dscthl_00003', 'dscthl_00001']
+    assert index.scans == 5
+
+    # Without events, the device found is read again
+    polled = DiscoveryIndex(str(tmp_path))
+    assert polled.find('eth1') == info
+    (tmp_path / '3-2' / 'devnum').write_text('9\n')
+    assert polled.find('eth1') == info._replace(address=9)
+
+
+def test_interface_map(tmp_path: pathlib.Path) -> None:
+    # Two hubs deep, the network interfaces link to the USB interfaces
+    hub = tmp_path / 'devices' / 'usb3' / '3-1' / '3-1.2'
+    hub.mkdir(parents=True)
+    fake_usb_device(hub, '3-1.2.4', 'dscthl_00001', 9, 'eth1')
+    fake_usb_device(tmp_path / 'devices' / 'usb3', '3-2', 'dscthl_00002', 4, 'eth2')
+    net = tmp_path / 'net'
+    net.mkdir()
+    (net / 'lo').mkdir()
+    (net / 'eth0').mkdir()
+    (net / 'eth0' / 'device').symlink_to(tmp_path / 'devices')
+    (net / 'eth1').mkdir()
+    (net / 'eth1' / 'device').symlink_to(hub / '3-1.2.4' / '3-1.2.4:1.0')
+    (net / 'eth2').mkdir()
+    (net / 'eth2' / 'device').symlink_to(tmp_path / 'devices' / 'usb3' / '3-2' / '3-2:1.0')
+
+    info = resolve_netif('eth1', str(net))
+    assert info is not None and info.serial == 'dscthl_00001' and info.port_numbers == (1, 2, 4)
+    assert usb_sysname(info.bus, info.port_numbers) == info.sysname == '3-1.2.4'
+    assert resolve_netif('eth0', str(net)) is None and resolve_netif('lo', str(net)) is None
+
+    interfaces = interface_map(str(net))
+    assert sorted(interfaces.by_netif) == ['eth1', 'eth2']
+    assert interfaces.by_serial['dscthl_00001'] == interfaces.by_path['3-1.2.4'] == info
+    assert interfaces.by_serial['dscthl_00002'].netif == 'eth2'
+
+
+def test_uevent() -> None:
+    event = parse_uevent(b'add@/devices/usb3/3-2\0ACTION=add\0DEVPATH=/devices/usb3/3-2\0SUBSYSTEM=usb\0')
+    assert event == ('add', '/devices/usb3/3-2', 'usb')
+    assert usb_device_name('/devices/usb3/3-2/3-2:1.0/net/eth1') == '3-2'
+    assert parse_uevent(b'libudev\0') is None
+
+    class OverflowedSocket:
+        def __init__(self) -> None:
+            self.received: List[Union[bytes, OSError]] = [
+                OSError(errno.ENOBUFS, 'No buffer space available'), b'remove@/devices/usb3/3-2\0', BlockingIOError()]
+
+        def recv(self, size: int) -> bytes:
+            item = self.received.pop()
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+    # A full receive buffer reports the events as lost
+    netlink = NetlinkEvents.__new__(NetlinkEvents)
+    netlink._socket = OverflowedSocket()  # type: ignore[assignment]
+    assert netlink.poll() == []
+    assert netlink.poll() == [('remove', '/devices/usb3/3-2', None), (EVENTS_LOST, '', None)]
+
+
+def test_statistics() -> None:
+    sim = LAN7801_Sim()
+    mac = HydraLink(sim).mac
+    history = StatsHistory(capacity=3)
+    sim.count('rx_fcs_errors', 0xffffe)
+    sim.count('rx_unicast_byte_count', 0xfffffff0)
+
+    transfers = sim.transfers
+    assert history.add(mac.read_statistics()) is None
+    assert sim.transfers == transfers + 1
+
+    for second in range(4):
+        sim.sleep(1.0)
+        sim.count('rx_fcs_errors', 3)
+        sim.count('rx_unicast_byte_count', 1000 * (second + 1))
+        delta = history.add(mac.read_statistics())
+        assert delta is not None and delta.get('rx_fcs_errors') == 3
+    # Both counters wrapped around
+    assert sim.counters[STAT_INDEX['rx_fcs_errors']] < 0xffffe
+    assert sim.counters[STAT_INDEX['rx_unicast_byte_count']] < 0xfffffff0
+    assert delta is not None and delta.rate('rx_unicast_byte_count') == pytest.approx(4000, rel=1e-3)
+
+    assert len(history) == 3
+    assert history.deltas('rx_unicast_byte_count') == [2000, 3000, 4000]
+    assert history.rates('rx_fcs_errors') == pytest.approx([3, 3, 3], rel=1e-3)
+    assert history.totals()['rx_fcs_errors'] == 12
+    assert history.totals()['tx_pause_frames'] == 0
+
+
+def test_health_monitor() -> None:
+    sim = LAN7801_Sim()
+    hl = HydraLink(sim)
+    sim.phy.c45[1, 0x0901] = 0x3000
+    sim.phy.c45[3, 0x0902] = 0x0100
+    sim.phy.c45[1, 0x9400] = 0x0005
+    fields = dict(HEALTH_FIELDS, sqi=Field(1, 0x9400, 0, 3))
+
+    transfers = sim.transfers
+    health = read_health(hl.phy, fields)
+    assert health.link and health.local_receiver and health.remote_receiver and health.block_lock
+    assert not health.master and not health.high_ber and health.pcs_errors == 0 and health.sqi == 5
+    # One C45 read per register
+    assert sim.transfers - transfers == 7 * 12 + 1
+
+    events: List[HealthEvent] = []
+    monitor = HealthMonitor({'hl0': hl.phy}, interval=0.01, fields=fields, on_event=events.append)
+    first = monitor.poll()
+    assert {e.field for e in first} == set(PhyHealth._fields) - {'time'}
+    assert all(e.old is None for e in first)
+    assert monitor.poll() == []
+
+    sim.phy.link_up_at = None
+    sim.phy.c45[3, 0x0902] = 0x0203
+    changes = {e.field: (e.old, e.new) for e in monitor.poll()}
+    assert changes == {'pma_link': (1, 0), 'pcs_link': (1, 0), 'block_lock': (1, 0), 'high_ber': (0, 1),
+                       'pcs_errors': (0, 3)}
+
+    monitor.start()
+    while monitor.samples < 5:
+        time.sleep(0.001)
+    monitor.stop()
+    # The counter keeps reporting errors, nothing else changes
+    assert events and {e.field for e in events} == {'pcs_errors'}
+
+    # An unreadable PHY is reported once, on the clock of its device
+    def unplugged(category: int) -> None:
+        raise IOError("No such device")
+
+    sim._transfer = unplugged  # type: ignore[method-assign]
+    sim.sleep(1000)
+    assert [(e.field, e.time) for e in monitor.poll()] == [('error', sim.now)]
+    assert monitor.poll() == []
+
+
+def test_exporter() -> None:
+    sims = {f'dscthl_{i:05d}': LAN7801_Sim(f'dscthl_{i:05d}') for i in range(2)}
+    pool = HydraLinkPool(lambda key: HydraLink(sims[str(key)]), locator=lambda key: key if key in sims else None)
+    sampler = Sampler(list(sims) + ['missing'], pool=pool)
+    HydraLink(sims['dscthl_00000']).setup(master=False, speed=100, promiscuous=False)
+    HydraLink(sims['dscthl_00001']).setup(master=True, speed=1000, promiscuous=True)
+    assert sampler.exposition() == b''
+
+    sampler.sample()
+    sims['dscthl_00000'].count('rx_fcs_errors', 3)
+    sims['dscthl_00001'].phy.c45[3, 0x0902] = 0x0105
+    sampler.sample()
+    lines = set(sampler.exposition().decode().splitlines())
+    assert {'hydralink_up{device="dscthl_00000"} 1',
+            'hydralink_up{device="missing"} 0',
+            'hydralink_speed_mbps{device="dscthl_00000"} 100',
+            'hydralink_speed_mbps{device="dscthl_00001"} 1000',
+            'hydralink_master{device="dscthl_00000"} 0',
+            'hydralink_master{device="dscthl_00001"} 1',
+            'hydralink_promiscuous{device="dscthl_00000"} 0',
+            'hydralink_promiscuous{device="dscthl_00001"} 1',
+            'hydralink_mac_statistic_total{device="dscthl_00000",counter="rx_fcs_errors"} 3',
+            'hydralink_mac_statistic_total{device="dscthl_00001",counter="rx_fcs_errors"} 0',
+            'hydralink_phy_pcs_errors_total{device="dscthl_00001"} 5',
+            '# TYPE hydralink_transfer_duration_seconds histogram'} <= lines
+    assert any(line.startswith('hydralink_transfer_duration_seconds_count{device="dscthl_00000",category="reg_read"}')
+               for line in lines)
+
+    # Replugged, or the MAC was reset: the totals start over instead of wrapping around
+    sims['dscthl_00000'].counters = [0] * len(sims['dscthl_00000'].counters)
+    sims['dscthl_00000'].count('rx_fcs_errors', 1)
+    sampler.sample()
+    pool.evict('dscthl_00000')
+    sims['dscthl_00000'].counters = [0] * len(sims['dscthl_00000'].counters)
+    sampler.sample()
+    sims['dscthl_00000'].count('rx_fcs_errors', 2)
+    sampler.sample()
+    lines = set(sampler.exposition().decode().splitlines())
+    assert 'hydralink_mac_statistic_total{device="dscthl_00000",counter="rx_fcs_errors"} 2' in lines
+
+    exporter = Exporter(('127.0.0.1', 0), sampler)
+    sampler.interval = 3600
+    thread = threading.Thread(target=exporter.serve_forever)
+    thread.start()
+    try:
+        while sampler.cycles < 6:
+            time.sleep(0.001)
+        url = 'http://%s:%d' % exporter.address
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            body = response.read()
+        # The scrape returns the last sample and does not touch the devices
+        reads = sims['dscthl_00000'].reads
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.read() == body == sampler.exposition()
+        assert sims['dscthl_00000'].reads == reads
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/')
+    finally:
+        exporter.shutdown()
+        thread.join()
+    assert sampler.cycles == 6
+    assert parse_address(':9101') == ('', 9101) and parse_address('localhost:9101') == ('localhost', 9101)
+    with pytest.raises(ValueError):
+        parse_address('9101')
+
+
+def test_trace(tmp_path: pathlib.Path) -> None:
+    def record(speed: int) -> Trace:
+        recorder = TraceRecorder(LAN7801_Sim('dscthl_00001', latency=125e-6))
+        hl = HydraLink(recorder)
+        hl.verbose = False
+        hl.setup(master=True, speed=speed, mac_addr='02:00:00:00:00:01')
+        hl.mac.eeprom_write(5, 0x12)
+        hl.mac.read_statistics()
+        return recorder.trace()
+
+    trace = record(1000)
+    save_trace(trace, str(tmp_path / 'setup.hltrace'))
+    assert load_trace(str(tmp_path / 'setup.hltrace')) == trace
+    assert trace.serial == 'dscthl_00001' and trace.count(TRACE_STATS) == 1
+
+    replay = LAN7801_Replay(trace)
+    hl = HydraLink(replay)
+    hl.verbose = False
+    hl.setup(master=True, speed=1000, mac_addr='02:00:00:00:00:01')
+    hl.mac.eeprom_write(5, 0x12)
+    assert len(hl.mac.read_statistics().values) == 47
+    assert replay.remaining == 0 and replay.now == pytest.approx(trace.duration)
+    # A different setup leaves the trace at the first differing write
+    hl = HydraLink(LAN7801_Replay(trace))
+    hl.verbose = False
+    with pytest.raises(ReplayError, match='instead of write'):
+        hl.setup(master=False, speed=1000)
+
+    values, written = register_values(trace)
+    assert values['eeprom.005'] == 0x12 and values['1.0834'] & 0x4000
+    assert {'eeprom.005', '1.0834', '118', '11c'} <= written
+    assert diff_traces(trace, trace).changes == []
+    diff = diff_traces(trace, record(100))
+    assert diff.transfers[0] < diff.transfers[1] and diff.changes == [('1.0000', 0x0040, 0x2000), ('100', 4, 2)]
+    assert 'transfers' in diff.describe()
+
+
+def test_transfer_stats(sim: LAN7801_Sim) -> None:
+    hl = HydraLink(sim)
+    hl.verbose = False
+    stats = sim.enable_stats()
+    sim.latency = 0.0005
+    before = sim.transfers
+    hl.setup(master=True, speed=1000)
+    hl.mac.eeprom_read(0)
+
+    snapshot = stats.snapshot()
+    assert sum(c.transfers for c in snapshot.values()) == stats.transfers == sim.transfers - before
+    for name in ('reg_read', 'reg_write', 'mdio_c45', 'eeprom', 'poll'):
+        assert snapshot[name].transfers > 0, name
+    assert snapshot['mdio_c45'].mean == pytest.approx(0.0005)
+    assert snapshot['poll'].histogram[9] == snapshot['poll'].transfers
+
+    stats.reset()
+    assert stats.transfers == 0
+
+
+def test_poll_timeout() -> None:
+    sim = LAN7801_Sim(mii_busy_cycles=1000000)
+    with pytest.raises(TimeoutError):
+        HydraLink(sim)
+    # The deadline is enforced in (virtual) time, with backoff between reads
+    assert 0.1 <= sim.now < 0.2
+    assert sim.poll_iterations < 100
+
+
+def test_eeprom_write_backoff() -> None:
+    sim = LAN7801_Sim(latency=125e-6, eeprom_write_time=0.004)
+    hl = HydraLink(sim)
+    iterations = sim.poll_iterations
+    hl.mac.eeprom_write(0x20, 0x5a)
+    assert sim.eeprom[0x20] == 0x5a
+    assert sim.poll_iterations - iterations <= 5
+
+
+def test_mmd_tracking() -> None:
+    sim = LAN7801_Sim()
+    hl = HydraLink(sim, track_mmd=True)
+    mac, phy = hl.mac, hl.phy
+    rng = random.Random(1)
+    expected = dict(sim.phy.c45)
+    for i in range(200):
+        key = (rng.choice([1, 3, 7]), rng.randrange(0x10, 0x20))
+        if rng.randrange(3):
+            value = rng.randrange(0x10000) & ~0x8000
+            phy[key] = value
+            expected[key] = value
+        else:
+            assert phy[key] == expected.get(key, 0)
+        if rng.randrange(20) == 0:
+            # Someone else moves the MMD address
+            mac.write_mdio_reg(0, 0xd, 0x0007)
+            mac.write_mdio_reg(0, 0xe, 0x1234)
+    assert {k: v for k, v in sim.phy.c45.items() if k in expected} == expected
+
+    # Registers written in ascending order are not re-addressed
+    writes = sim.writes
+    b = mac.batch()
+    for i in range(8):
+        phy.queue_write(b, 1, 0x9000 + i, i)
+    b.execute()
+    assert sim.writes - writes == 3 * 2 + 8 * 2
+
+
+def test_mmd_untracked() -> None:
+    sim = LAN7801_Sim()
+    hl = HydraLink(sim)
+    other = HydraLink(sim)
+    hl.phy[1, 0x9000] = 0x1234
+    # Another handle, or the kernel driver, moves the MMD address
+    other.phy[7, 0x0200] = 0x0001
+    assert hl.phy[1, 0x9000] == 0x1234
+    hl.phy[1, 0x9001] = 0x5678
+    assert sim.phy.c45[7, 0x0200] == 0x0001 and sim.phy.c45[1, 0x9001] == 0x5678
+
+    # A block is still addressed once
+    writes = sim.writes
+    hl.phy.write_block(1, 0x9000, list(range(8)))
+    assert sim.writes - writes == 3 * 2 + 8 * 2
+
+
+def test_mdio_block(sim: LAN7801_Sim, tmp_path: pathlib.Path) -> None:
+    hl = HydraLink(sim, cache=True)
+    values = [0x1000 + i for i in range(32)]
+    hl.phy.write_block(1, 0xa000, values)
+    assert [sim.phy.c45[1, 0xa000 + i] for i in range(32)] == values
+    assert hl.phy.read_block(1, 0xa000, 32) == values
+    reads = sim.reads
+    assert hl.phy[1, 0xa01f] == values[-1] and sim.reads == reads
+    # The MMD is addressed once for the whole block
+    sim.phy.c45[3, 0x0005] = 0x1234
+    writes = sim.writes
+    assert hl.mac.read_mdio_block_c45(0, 3, 0x0000, 8)[5] == 0x1234
+    assert sim.writes - writes == 3 * 2 + 8
+    with pytest.raises(ValueError):
+        hl.mac.read_mdio_block_c45(0, 1, 0xfff0, 0x20)
+
+    snapshot = read_snapshot(hl.mac, hl.phy.phy_addr)
+    assert len(snapshot.phy) == sum(count for devad, start, count in PHY_REGISTER_RANGES)
+    assert snapshot.phy[1, 0x0002] == 0xae02 and snapshot.phy[1, 0xa010] == 0x1010
+    for ext in ('bin', 'json', 'txt'):
+        save_snapshot(snapshot, str(tmp_path / f'phy.{ext}'))
+        assert load_snapshot(str(tmp_path / f'phy.{ext}')).phy == snapshot.phy
@@ -0,0 +1,133 @@
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import pathlib
+from typing import Dict, List, Tuple
+
+from hydralink.aio import AsyncLAN7801
+from hydralink.dump import diff_snapshots, load_snapshot, read_snapshot, save_snapshot
+from hydralink.lan7801 import LAN7801, LAN7801_LL, OP_POLL
+
+
+class RegisterFile(LAN7801_LL):
+    """Register file whose busy flags clear immediately, logging every
+    transfer"""
+    BUSY_FLAGS = {0x040: 0x80000000, 0x120: 0x00000001}
+
+    def __init__(self) -> None:
+        self.regs: Dict[int, int] = {}
+        self.log: List[Tuple[str, int, int]] = []
+
+    def write_reg(self, address: int, value: int) -> None:
+        self.log.append(('w', address, value))
+        self.regs[address] = value & ~self.BUSY_FLAGS.get(address, 0)
+
+    def read_reg(self, address: int) -> int:
+        value = self.regs.get(address, 0)
+        self.log.append(('r', address, value))
+        return value
+
+
+def test_batch_results() -> None:
+    ll = RegisterFile()
+    ll.regs[0x10] = 0x0000ff00
+    mac = LAN7801(ll)
+
+    b = mac.batch()
+    r0 = b.read(0x10)
+    w0 = b.write(0x20, 0x1234)
+    m0 = b.modify(0x10, set=0x1, clr=0x0f00)
+    p0 = b.poll(0x20, 0x00f0, 0x0030)
+    r1 = b.read(0x10)
+    results = b.execute()
+
+    assert len(results) == len(b)
+    assert results[r0] == 0x0000ff00
+    assert results[w0] == 0x1234
+    assert results[m0] == 0x0000f001
+    assert results[p0] == 0x1234
+    assert results[r1] == 0x0000f001
+    assert ll.regs[0x10] == 0x0000f001
+
+
+def test_batch_skips_redundant_polls() -> None:
+    ll = RegisterFile()
+    mac = LAN7801(ll)
+
+    b = mac.batch()
+    mac.queue_mdio_write(b, 0, 0xd, 0x0001)
+    mac.queue_mdio_write(b, 0, 0xe, 0x0002)
+    idx = mac.queue_mdio_read(b, 0, 0xe)
+    b.execute()
+
+    # Only the first MDIO operation needs to wait for the interface to be idle
+    polls = [op for op in b.ops if op.address == 0x120 and op.kind == OP_POLL]
+    assert len(polls) == 4
+    assert b.ops[idx].address == 0x124
+    assert ll.log[0] == ('r', 0x120, 0)
+    assert ll.log[1:4] == [('w', 0x124, 1), ('w', 0x120, 0x0343), ('r', 0x120, 0x0342)]
+
+
+def test_cache_serves_config_registers() -> None:
+    ll = RegisterFile()
+    ll.regs[0x010] = 0x00000100
+    ll.regs[0x104] = 0x00000001
+    mac = LAN7801(ll, cache=True)
+
+    mac[0x010] |= 0x02000000
+    b = mac.batch()
+    b.modify(0x010, clr=0x00000100)
+    b.modify(0x104, set=2)
+    hw_cfg = b.read(0x010)
+    results = b.execute()
+
+    assert results[hw_cfg] == 0x02000000
+    assert ll.regs[0x010] == 0x02000000
+    assert ll.regs[0x104] == 0x00000003
+    # HW_CFG is read from the device exactly once, MAC_RX every time
+    assert [e for e in ll.log if e[0] == 'r'] == [('r', 0x010, 0x00000100), ('r', 0x104, 0x00000001)]
+    assert (mac.cache_hits, mac.cache_misses) == (2, 1)
+
+    ll.regs[0x010] = 0x12345678
+    assert mac[0x010] == 0x02000000
+    mac.refresh()
+    assert mac[0x010] == 0x12345678
+    mac.invalidate()
+    ll.regs[0x010] = 0
+    assert mac[0x010] == 0
+
+
+def test_async_access() -> None:
+    async def configure(mac: AsyncLAN7801, i: int) -> int:
+        await mac.write_reg(0x0b0, i)
+        await mac.write_mdio_reg(0, 0x1f, i)
+        b = mac.batch()
+        b.modify(0x0b0, set=0x100)
+        idx = b.read(0x0b0)
+        return (await mac.run(b))[idx]
+
+    async def main() -> List[int]:
+        macs = [AsyncLAN7801(RegisterFile()) for i in range(8)]
+        return await asyncio.gather(*(configure(mac, i) for i, mac in enumerate(macs)))
+
+    assert asyncio.run(main()) == [0x100 | i for i in range(8)]
+
+
+def test_snapshot_formats(tmp_path: pathlib.Path) -> None:
+    ll = RegisterFile()
+    ll.regs[0x000] = 0x78010000
+    ll.regs[0x0b0] = 0x1c8a
+    a = read_snapshot(LAN7801(ll))
+    assert len(a.mac) == 0x400 and len(ll.log) == 0x400
+
+    ll.regs[0x0b0] = 0x1f80
+    b = read_snapshot(LAN7801(ll))._replace(serial='dscthl_00000')
+    for ext in ('bin', 'json', 'txt'):
+        save_snapshot(b, str(tmp_path / f'b.{ext}'))
+        loaded = load_snapshot(str(tmp_path / f'b.{ext}'))
+        assert loaded.mac == b.mac
+        if ext != 'txt':
+            assert loaded[:2] == b[:2]
+        assert diff_snapshots(a, loaded) == [(0x0b0, 0x1c8a, 0x1f80)]